@@ -1,5 +1,5 @@
-from flask import Flask, request, jsonify, send_from_directory, session, redirect
-from db import get_conn, init_db, execute, query_all, get_config, begin_transaction, execute_with_conn, map_db_error, is_db_error
+from flask import Flask, request, jsonify, send_from_directory, session, redirect, Response
+from db import get_conn, init_db, migrate, execute, execute_returning, query_all, get_config, begin_transaction, execute_with_conn, map_db_error, is_db_error
 import os
 import secrets
 import hashlib
@@ -9,6 +9,12 @@ import json
 import psycopg2
 import threading
 import time
+import functools
+import math
+import io
+import csv
+import queue
+import zlib
 
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', secrets.token_hex(16))
@@ -250,6 +256,131 @@ def admin_query_loan_page():
         return _require_login('admin')
     return send_from_directory('templates', 'query_loan.html')
 
+# 管理端查询接口的 keyset 分页：limit 限定页大小，cursor 为上一页最后一条的 id，下一页游标放在 X-Next-Cursor 响应头
+ADMIN_QUERY_PAGE_SIZE = 50
+ADMIN_QUERY_MAX_PAGE_SIZE = 200
+
+def _keyset_args():
+    """解析 limit/cursor 分页参数，返回 (limit, cursor)，不合法时抛出 ValueError"""
+    limit = int(request.args.get('limit', ADMIN_QUERY_PAGE_SIZE))
+    cursor = int(request.args.get('cursor', 0))
+    if limit < 1 or limit > ADMIN_QUERY_MAX_PAGE_SIZE or cursor < 0:
+        raise ValueError('page')
+    return limit, cursor
+
+def _keyset_response(rows, limit, key='id'):
+    """rows 需按 key 升序且多取一条，多出的一条用于判断是否还有下一页"""
+    rows = list(rows)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1][key]
+    resp = jsonify(rows)
+    if next_cursor is not None:
+        resp.headers['X-Next-Cursor'] = str(next_cursor)
+    return resp
+
+# 基础数据列表接口：名称 -> (FROM 子句, ETag 依赖的表, 可选字段 -> 列表达式)，字段 id 作为分页键
+LIST_RESOURCES = {
+    'branches': ('branch', ('branch',),
+                 {'id': 'id', 'union_no': 'union_no', 'name': 'name', 'city': 'city'}),
+    'employees': ('employee', ('employee',),
+                  {'id': 'id', 'name': 'name', 'phone': 'phone', 'hire_date': 'hire_date', 'manager_id': 'manager_id'}),
+    'dependents': ('dependent', ('dependent',),
+                   {'id': 'id', 'employee_id': 'employee_id', 'name': 'name', 'relationship': 'relationship'}),
+    'customers': ('customer', ('customer',),
+                  {'id': 'id', 'name': 'name', 'identity_no': 'identity_no', 'city': 'city', 'street': 'street',
+                   'assistant_employee_id': 'assistant_employee_id'}),
+    'accounts': ('account a LEFT JOIN savings_account s ON s.account_id = a.id LEFT JOIN checking_account c ON c.account_id = a.id',
+                 ('account', 'savings_account', 'checking_account'),
+                 {'id': 'a.id', 'account_no': 'a.account_no', 'created_at': 'a.created_at', 'balance': 'a.balance',
+                  'type': 'a.type', 'interest_rate': 's.interest_rate', 'overdraft_limit': 'c.overdraft_limit'}),
+    'loans': ('loan', ('loan',),
+              {'id': 'id', 'loan_no': 'loan_no', 'amount': 'amount', 'branch_id': 'branch_id'}),
+    'repayments': ('repayment', ('repayment',),
+                   {'id': 'id', 'loan_id': 'loan_id', 'batch_no': 'batch_no', 'paid_at': 'paid_at', 'amount': 'amount',
+                    'savings_account_id': 'savings_account_id'})
+}
+
+def _list_etag(tables):
+    """
+    由 table_change_counter 计算列表版本，计数表的 oid 区分重建过的库；
+    必须在查数据之前取版本，这样并发提交最多导致多查一次，不会让客户端长期拿着旧数据
+    """
+    rows = query_all(
+        "SELECT 'table_change_counter'::regclass::oid::text || ':' || string_agg(v::text, '.' ORDER BY n) AS version "
+        "FROM (SELECT t.n, COALESCE((SELECT SUM(version) FROM table_change_counter c WHERE c.table_name = t.n), 0) AS v "
+        "FROM unnest(%s::text[]) AS t(n)) s",
+        (list(tables),)
+    )
+    key = rows[0]['version'] + '|' + request.query_string.decode('utf-8', 'replace')
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+def _list_resource(name):
+    """基础数据列表：limit/cursor 分页、fields 字段选择，数据未变化时返回 304"""
+    if _require_login('admin'):
+        return _require_login('admin')
+    source, tables, fields = LIST_RESOURCES[name]
+    try:
+        limit, cursor = _keyset_args()
+    except ValueError:
+        return jsonify({'ok': False, 'error': '分页参数不合法'}), 400
+    selected = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()] or list(fields)
+    unknown = [f for f in selected if f not in fields]
+    if unknown:
+        return jsonify({'ok': False, 'error': f"不支持的字段: {', '.join(unknown)}"}), 400
+    if 'id' not in selected:
+        selected.insert(0, 'id')
+    etag = _list_etag(tables)
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        columns = ', '.join(f'{fields[f]} AS {f}' for f in selected)
+        rows = query_all(
+            f"SELECT {columns} FROM {source} WHERE {fields['id']} > %s ORDER BY {fields['id']} LIMIT %s",
+            (cursor, limit + 1)
+        )
+        resp = _keyset_response(rows, limit)
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
+
+def _like_escape(term):
+    """转义 LIKE 通配符，用户输入按字面匹配"""
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def _fuzzy_pattern(term):
+    """
+    生成包含匹配的 ILIKE 模式（转义用户输入中的通配符）。
+    3 个字符及以上可走 pg_trgm 索引；更短的词（如“北京”）无法构成三元组，仍按包含匹配，接受顺序扫描
+    """
+    return '%' + _like_escape(term) + '%'
+
+ID_PREFIX_MAX_DIGITS = 18
+
+def _id_prefix_clause(prefix, column='id'):
+    """
+    数字ID模糊查询按前缀语义转换为主键区间条件：前缀 12 对应 12、120-129、1200-1299 ...
+    返回 (sql, params)，前缀不是数字时返回 None
+    """
+    if not re.fullmatch(r'[0-9]{1,%d}' % ID_PREFIX_MAX_DIGITS, prefix or ''):
+        return None
+    if prefix.startswith('0'):
+        return 'FALSE', ()
+    base = int(prefix)
+    clauses = []
+    params = []
+    width = 1
+    for _ in range(ID_PREFIX_MAX_DIGITS - len(prefix) + 1):
+        clauses.append(f'{column} BETWEEN %s AND %s')
+        params.extend([base * width, base * width + width - 1])
+        width *= 10
+    return '(' + ' OR '.join(clauses) + ')', tuple(params)
+
+# 查询接口的 SQL 定义为模块常量，check_indexes.py 直接引用做索引覆盖检查
+BRANCH_FUZZY_SQL = 'SELECT id, union_no, name, city FROM branch WHERE union_no ILIKE %s AND id > %s ORDER BY id LIMIT %s'
+BRANCH_BY_UNION_NO_SQL = 'SELECT id, union_no, name, city FROM branch WHERE union_no=%s'
+
 @app.get('/admin/api/query/branch')
 def admin_api_query_branch():
     if _require_login('admin'):
@@ -259,7 +390,11 @@ def admin_api_query_branch():
     if not union_no:
         return jsonify({'ok': False, 'error': '缺少联行号'}), 400
     if fuzzy:
-        rows = query_all('SELECT id, union_no, name, city FROM branch WHERE union_no ILIKE %s ORDER BY id', ('%' + union_no + '%',))
+        try:
+            limit, cursor = _keyset_args()
+        except ValueError:
+            return jsonify({'ok': False, 'error': '分页参数不合法'}), 400
+        rows = query_all(BRANCH_FUZZY_SQL, (_fuzzy_pattern(union_no), cursor, limit + 1))
         result = [{
             'id': r['id'],
             'union_no': r['union_no'],
@@ -270,8 +405,8 @@ def admin_api_query_branch():
             'manager': None,
             'established_date': None
         } for r in rows]
-        return jsonify(result)
-    rows = query_all('SELECT id, union_no, name, city FROM branch WHERE union_no=%s', (union_no,))
+        return _keyset_response(result, limit)
+    rows = query_all(BRANCH_BY_UNION_NO_SQL, (union_no,))
     if not rows:
         return jsonify({'ok': False, 'error': '未找到支行'}), 404
     r = rows[0]
@@ -286,6 +421,10 @@ def admin_api_query_branch():
         'established_date': None
     })
 
+CUSTOMER_QUERY_SQL = 'SELECT id, name, identity_no, city, street, assistant_employee_id FROM customer WHERE '
+# {clause} 替换为 _id_prefix_clause 生成的 id 前缀条件
+CUSTOMER_PREFIX_SQL = CUSTOMER_QUERY_SQL + '{clause} AND id > %s ORDER BY id LIMIT %s'
+
 @app.get('/admin/api/query/customer')
 def admin_api_query_customer():
     if _require_login('admin'):
@@ -295,20 +434,27 @@ def admin_api_query_customer():
     if not cid:
         return jsonify({'ok': False, 'error': '缺少客户ID'}), 400
     if fuzzy:
-        rows = query_all('SELECT id, name, identity_no, city, street, assistant_employee_id FROM customer WHERE CAST(id AS TEXT) ILIKE %s ORDER BY id', ('%' + cid + '%',))
-        return jsonify([{
+        try:
+            limit, cursor = _keyset_args()
+        except ValueError:
+            return jsonify({'ok': False, 'error': '分页参数不合法'}), 400
+        clause = _id_prefix_clause(cid)
+        if clause is None:
+            return jsonify({'ok': False, 'error': '客户ID格式错误'}), 400
+        rows = query_all(CUSTOMER_PREFIX_SQL.format(clause=clause[0]), clause[1] + (cursor, limit + 1))
+        return _keyset_response([{
             'id': r['id'],
             'name': r['name'],
             'phone': None,
             'address': r['city'] + ' ' + r['street'],
             'identity_no': _mask_id(r['identity_no']),
             'assistant_employee_id': r['assistant_employee_id']
-        } for r in rows])
+        } for r in rows], limit)
     try:
         cid_i = int(cid)
     except Exception:
         return jsonify({'ok': False, 'error': '客户ID格式错误'}), 400
-    rows = query_all('SELECT id, name, identity_no, city, street, assistant_employee_id FROM customer WHERE id=%s', (cid_i,))
+    rows = query_all(CUSTOMER_QUERY_SQL + 'id=%s', (cid_i,))
     if not rows:
         return jsonify({'ok': False, 'error': '未找到客户'}), 404
     r = rows[0]
@@ -321,6 +467,26 @@ def admin_api_query_customer():
         'assistant_employee_id': r['assistant_employee_id']
     })
 
+ACCOUNT_FUZZY_WHERE = 'account_no ILIKE %s AND id > %s'
+
+def _accounts_sql(where, params, limit=None):
+    """按条件查询账户的 SQL，拥有人列表和最近访问日期在同一条 SQL 中聚合，返回 (sql, 参数)"""
+    sql = 'SELECT id, account_no, created_at, type FROM account WHERE ' + where + ' ORDER BY id'
+    if limit is not None:
+        sql += ' LIMIT %s'
+        params = tuple(params) + (limit,)
+    return '''
+        SELECT a.id, a.account_no, a.created_at, MAX(ac.last_access_date) AS last_access_date, a.type,
+               COALESCE(array_agg(ac.customer_id ORDER BY ac.customer_id) FILTER (WHERE ac.customer_id IS NOT NULL), '{}') AS owners
+        FROM (''' + sql + ''') a
+        LEFT JOIN account_customer ac ON ac.account_id = a.id
+        GROUP BY a.id, a.account_no, a.created_at, a.type
+        ORDER BY a.id
+    ''', params
+
+def _query_accounts(where, params, limit=None):
+    return query_all(*_accounts_sql(where, params, limit))
+
 @app.get('/admin/api/query/account')
 def admin_api_query_account():
     if _require_login('admin'):
@@ -330,34 +496,16 @@ def admin_api_query_account():
     if not account_no:
         return jsonify({'ok': False, 'error': '缺少账户号'}), 400
     if fuzzy:
-        rows = query_all('SELECT id, account_no, created_at, type FROM account WHERE account_no ILIKE %s ORDER BY id', ('%' + account_no + '%',))
-        result = []
-        for a in rows:
-            owners = query_all('SELECT customer_id FROM account_customer WHERE account_id=%s', (a['id'],))
-            last = query_all('SELECT MAX(last_access_date) AS last_access_date FROM account_customer WHERE account_id=%s', (a['id'],))
-            result.append({
-                'id': a['id'],
-                'account_no': a['account_no'],
-                'created_at': a['created_at'],
-                'last_access_date': (last[0]['last_access_date'] if last and last[0] else None),
-                'type': a['type'],
-                'owners': [o['customer_id'] for o in owners]
-            })
-        return jsonify(result)
-    rows = query_all('SELECT id, account_no, created_at, type FROM account WHERE account_no=%s', (account_no,))
+        try:
+            limit, cursor = _keyset_args()
+        except ValueError:
+            return jsonify({'ok': False, 'error': '分页参数不合法'}), 400
+        rows = _query_accounts(ACCOUNT_FUZZY_WHERE, (_fuzzy_pattern(account_no), cursor), limit + 1)
+        return _keyset_response(rows, limit)
+    rows = _query_accounts('account_no=%s', (account_no,))
     if not rows:
         return jsonify({'ok': False, 'error': '未找到账户'}), 404
-    a = rows[0]
-    owners = query_all('SELECT customer_id FROM account_customer WHERE account_id=%s', (a['id'],))
-    last = query_all('SELECT MAX(last_access_date) AS last_access_date FROM account_customer WHERE account_id=%s', (a['id'],))
-    return jsonify({
-        'id': a['id'],
-        'account_no': a['account_no'],
-        'created_at': a['created_at'],
-        'last_access_date': (last[0]['last_access_date'] if last and last[0] else None),
-        'type': a['type'],
-        'owners': [o['customer_id'] for o in owners]
-    })
+    return jsonify(rows[0])
 
 @app.get('/admin/api/query/employee')
 def admin_api_query_employee():
@@ -368,14 +516,21 @@ def admin_api_query_employee():
     if not eid:
         return jsonify({'ok': False, 'error': '缺少员工ID'}), 400
     if fuzzy:
-        rows = query_all('SELECT id, name, phone, hire_date, manager_id FROM employee WHERE CAST(id AS TEXT) ILIKE %s ORDER BY id', ('%' + eid + '%',))
-        return jsonify([{
+        try:
+            limit, cursor = _keyset_args()
+        except ValueError:
+            return jsonify({'ok': False, 'error': '分页参数不合法'}), 400
+        clause = _id_prefix_clause(eid)
+        if clause is None:
+            return jsonify({'ok': False, 'error': '员工ID格式错误'}), 400
+        rows = query_all('SELECT id, name, phone, hire_date, manager_id FROM employee WHERE ' + clause[0] + ' AND id > %s ORDER BY id LIMIT %s', clause[1] + (cursor, limit + 1))
+        return _keyset_response([{
             'id': r['id'],
             'name': r['name'],
             'phone': _mask_phone(r['phone'] or ''),
             'hire_date': r['hire_date'],
             'manager_id': r['manager_id']
-        } for r in rows])
+        } for r in rows], limit)
     try:
         eid_i = int(eid)
     except Exception:
@@ -392,6 +547,35 @@ def admin_api_query_employee():
         'manager_id': r['manager_id']
     })
 
+LOAN_FUZZY_WHERE = 'loan_no ILIKE %s AND id > %s'
+
+def _loans_sql(where, params, limit=None):
+    """按条件查询贷款的 SQL，发放支行、客户列表和已还金额在同一条 SQL 中关联聚合，返回 (sql, 参数)"""
+    sql = 'SELECT id, loan_no, amount, branch_id FROM loan WHERE ' + where + ' ORDER BY id'
+    if limit is not None:
+        sql += ' LIMIT %s'
+        params = tuple(params) + (limit,)
+    return '''
+        SELECT l.id, l.loan_no, l.amount, b.union_no AS branch_union_no,
+               COALESCE((SELECT array_agg(lc.customer_id ORDER BY lc.customer_id) FROM loan_customer lc WHERE lc.loan_id = l.id), '{}') AS customers,
+               COALESCE((SELECT SUM(r.amount) FROM repayment r WHERE r.loan_id = l.id), 0) AS paid_amount
+        FROM (''' + sql + ''') l
+        LEFT JOIN branch b ON b.id = l.branch_id
+        ORDER BY l.id
+    ''', params
+
+def _query_loans(where, params, limit=None):
+    rows = query_all(*_loans_sql(where, params, limit))
+    return [{
+        'id': l['id'],
+        'loan_no': l['loan_no'],
+        'amount': float(l['amount']),
+        'branch_union_no': l['branch_union_no'],
+        'customers': l['customers'],
+        'paid_amount': float(l['paid_amount']),
+        'remaining_amount': float(l['amount']) - float(l['paid_amount'])
+    } for l in rows]
+
 @app.get('/admin/api/query/loan')
 def admin_api_query_loan():
     if _require_login('admin'):
@@ -401,42 +585,62 @@ def admin_api_query_loan():
     if not loan_no:
         return jsonify({'ok': False, 'error': '缺少贷款号'}), 400
     if fuzzy:
-        loans = query_all('SELECT id, loan_no, amount, branch_id FROM loan WHERE loan_no ILIKE %s ORDER BY id', ('%' + loan_no + '%',))
-        result = []
-        for l in loans:
-            b = query_all('SELECT union_no FROM branch WHERE id=%s', (l['branch_id'],))
-            owners = query_all('SELECT customer_id FROM loan_customer WHERE loan_id=%s', (l['id'],))
-            repaid = query_all('SELECT COALESCE(SUM(amount),0) AS total FROM repayment WHERE loan_id=%s', (l['id'],))
-            paid = float(repaid[0]['total']) if repaid and repaid[0] else 0.0
-            remain = float(l['amount']) - paid
-            result.append({
-                'id': l['id'],
-                'loan_no': l['loan_no'],
-                'amount': float(l['amount']),
-                'branch_union_no': (b[0]['union_no'] if b else None),
-                'customers': [o['customer_id'] for o in owners],
-                'paid_amount': paid,
-                'remaining_amount': remain
-            })
-        return jsonify(result)
-    rows = query_all('SELECT id, loan_no, amount, branch_id FROM loan WHERE loan_no=%s', (loan_no,))
+        try:
+            limit, cursor = _keyset_args()
+        except ValueError:
+            return jsonify({'ok': False, 'error': '分页参数不合法'}), 400
+        rows = _query_loans(LOAN_FUZZY_WHERE, (_fuzzy_pattern(loan_no), cursor), limit + 1)
+        return _keyset_response(rows, limit)
+    rows = _query_loans('loan_no=%s', (loan_no,))
     if not rows:
         return jsonify({'ok': False, 'error': '未找到贷款'}), 404
-    l = rows[0]
-    b = query_all('SELECT union_no FROM branch WHERE id=%s', (l['branch_id'],))
-    owners = query_all('SELECT customer_id FROM loan_customer WHERE loan_id=%s', (l['id'],))
-    repaid = query_all('SELECT COALESCE(SUM(amount),0) AS total FROM repayment WHERE loan_id=%s', (l['id'],))
-    paid = float(repaid[0]['total']) if repaid and repaid[0] else 0.0
-    remain = float(l['amount']) - paid
-    return jsonify({
-        'id': l['id'],
-        'loan_no': l['loan_no'],
-        'amount': float(l['amount']),
-        'branch_union_no': (b[0]['union_no'] if b else None),
-        'customers': [o['customer_id'] for o in owners],
-        'paid_amount': paid,
-        'remaining_amount': remain
-    })
+    return jsonify(rows[0])
+
+ADMIN_SEARCH_TYPES = ('customer', 'account', 'loan', 'branch', 'employee')
+ADMIN_SEARCH_MAX_LIMIT = 100
+# body 以数字 id 开头，必须做包含匹配；1-2 个字的短词无法使用三元组索引，按包含匹配扫描
+ADMIN_SEARCH_SQL = """
+    SELECT entity_type, entity_id, title, subtitle,
+           word_similarity(%(q)s, body) + ts_rank(tsv, plainto_tsquery('simple', %(q)s)) AS score
+    FROM search_document
+    WHERE entity_type = ANY(%(types)s)
+      AND (body ILIKE %(pattern)s OR tsv @@ plainto_tsquery('simple', %(q)s))
+    ORDER BY score DESC, entity_type, entity_id
+    LIMIT %(limit)s
+"""
+
+@app.get('/admin/api/search')
+def admin_api_search():
+    """统一搜索：一次查询 search_document 检索客户、账户、贷款、支行和员工，按相关度返回带类型的结果"""
+    if _require_login('admin'):
+        return _require_login('admin')
+    q = (request.args.get('q') or '').strip()
+    if not q:
+        return jsonify({'ok': False, 'error': '缺少搜索词'}), 400
+    try:
+        limit = int(request.args.get('limit', '20'))
+    except ValueError:
+        limit = 0
+    if limit < 1 or limit > ADMIN_SEARCH_MAX_LIMIT:
+        return jsonify({'ok': False, 'error': '分页参数不合法'}), 400
+    types = [t for t in (request.args.get('types') or '').split(',') if t] or list(ADMIN_SEARCH_TYPES)
+    if any(t not in ADMIN_SEARCH_TYPES for t in types):
+        return jsonify({'ok': False, 'error': '搜索类型不合法'}), 400
+    rows = query_all(ADMIN_SEARCH_SQL, {'q': q, 'pattern': '%' + _like_escape(q) + '%', 'types': types, 'limit': limit})
+    return jsonify([{
+        'type': r['entity_type'],
+        'id': r['entity_id'],
+        'title': r['title'],
+        'subtitle': r['subtitle'],
+        'score': round(float(r['score']), 4)
+    } for r in rows])
+
+@app.post('/admin/search/rebuild')
+def admin_search_rebuild():
+    """按源表全量重建统一搜索文档（后台任务执行）"""
+    if _require_login('admin'):
+        return _require_login('admin')
+    return _job_accepted('search_rebuild')
 
 @app.get('/user')
 def user_page():
@@ -486,56 +690,7 @@ def initdb():
         cur = conn.cursor()
         ph, ps = _hash_password('123456')
         cur.execute('INSERT INTO admin_user(username, password_hash, password_salt) VALUES(%s,%s,%s) ON CONFLICT (username) DO NOTHING', ('administrator', ph, ps))
-        
-        # 初始化新增的表结构
-        # 添加业务单表
-        cur.execute('''
-        CREATE TABLE IF NOT EXISTS business (
-          id BIGSERIAL PRIMARY KEY,
-          business_type VARCHAR(32) NOT NULL,
-          customer_id BIGINT NOT NULL REFERENCES customer(id),
-          status VARCHAR(32) NOT NULL DEFAULT 'INIT',
-          created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-          updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-          operator_id BIGINT REFERENCES employee(id),
-          remark TEXT
-        )
-        ''')
-        
-        # 添加转账表
-        cur.execute('''
-        CREATE TABLE IF NOT EXISTS transfer (
-          id BIGSERIAL PRIMARY KEY,
-          from_account_id BIGINT NOT NULL REFERENCES account(id),
-          to_account_id BIGINT NOT NULL REFERENCES account(id),
-          amount NUMERIC(18,2) NOT NULL CHECK (amount > 0),
-          status VARCHAR(32) NOT NULL DEFAULT 'SUCCESS',
-          created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-          completed_at TIMESTAMP
-        )
-        ''')
-        
-        # 添加交易流水表
-        cur.execute('''
-        CREATE TABLE IF NOT EXISTS transaction (
-          id BIGSERIAL PRIMARY KEY,
-          account_id BIGINT NOT NULL REFERENCES account(id),
-          business_id BIGINT REFERENCES business(id),
-          transfer_id BIGINT REFERENCES transfer(id),
-          txn_type VARCHAR(32) NOT NULL,
-          amount NUMERIC(18,2) NOT NULL,
-          balance_after NUMERIC(18,2) NOT NULL,
-          created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-          remark TEXT
-        )
-        ''')
-        
-        # 创建索引
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_transaction_account_created ON transaction(account_id, created_at)')
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_transfer_from_account ON transfer(from_account_id)')
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_transfer_to_account ON transfer(to_account_id)')
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_business_customer_status ON business(customer_id, status)')
-        
+
         conn.commit()
         cur.close()
         conn.close()
@@ -548,45 +703,14 @@ def initdb():
 
 @app.post('/migrate-db')
 def migrate_db():
-    """数据库迁移接口，添加缺失的字段"""
+    """数据库迁移接口，执行尚未应用的版本化迁移（可能在大表上建索引、等待迁移锁，以后台任务执行）"""
     if _require_login('admin'):
         return _require_login('admin')
-    
-    try:
-        conn = get_conn()
-        cur = conn.cursor()
-        
-        # 检查并添加account表的closed_at字段
-        cur.execute("""
-            DO $$
-            BEGIN
-              IF NOT EXISTS (
-                SELECT 1 
-                FROM information_schema.columns 
-                WHERE table_name = 'account' AND column_name = 'closed_at'
-              ) THEN
-                ALTER TABLE account ADD COLUMN closed_at TIMESTAMP;
-              END IF;
-            END$$;
-        """)
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        
-        return jsonify({"ok": True, "message": "数据库迁移完成"})
-    except Exception as e:
-        if is_db_error(e):
-            s, c, m = map_db_error(e)
-            return jsonify({'ok': False, 'error': m, 'code': c}), s
-        return jsonify({"ok": False, "error": '系统繁忙，请稍后再试'}), 500
+    return _job_accepted('migrate', {}, 'migrate_db')
 
 @app.get('/branches')
 def list_branches():
-    if _require_login('admin'):
-        return _require_login('admin')
-    rows = query_all('SELECT id, union_no, name, city FROM branch ORDER BY id')
-    return jsonify(rows)
+    return _list_resource('branches')
 
 @app.post('/branches')
 def create_branch():
@@ -641,49 +765,67 @@ def update_branch():
             return jsonify({'ok': False, 'error': m, 'code': c}), s
         return jsonify({'ok': False, "error": "更新分行信息失败"}), 500
 
+# 级联删除：每张表的关联数据都按整批 id 用 = ANY(...) 一次删除，单条删除和批量删除共用
+def _delete_loans(cur, ids):
+    cur.execute('DELETE FROM loan_customer WHERE loan_id = ANY(%s::bigint[])', (ids,))
+    cur.execute('DELETE FROM repayment_schedule WHERE loan_id = ANY(%s::bigint[])', (ids,))
+    cur.execute('DELETE FROM repayment WHERE loan_id = ANY(%s::bigint[])', (ids,))
+    cur.execute('DELETE FROM loan WHERE id = ANY(%s::bigint[])', (ids,))
+
+def _delete_branches(cur, ids):
+    cur.execute('SELECT id FROM loan WHERE branch_id = ANY(%s::bigint[])', (ids,))
+    loan_ids = [row[0] for row in cur.fetchall()]
+    if loan_ids:
+        _delete_loans(cur, loan_ids)
+    cur.execute('DELETE FROM branch WHERE id = ANY(%s::bigint[])', (ids,))
+
+def _delete_employees(cur, ids):
+    cur.execute('DELETE FROM dependent WHERE employee_id = ANY(%s::bigint[])', (ids,))
+    cur.execute('UPDATE employee SET manager_id=NULL WHERE manager_id = ANY(%s::bigint[])', (ids,))
+    cur.execute('UPDATE customer SET assistant_employee_id=NULL WHERE assistant_employee_id = ANY(%s::bigint[])', (ids,))
+    cur.execute('DELETE FROM employee WHERE id = ANY(%s::bigint[])', (ids,))
+
+def _delete_customers(cur, ids):
+    cur.execute('DELETE FROM transaction WHERE business_id IN (SELECT id FROM business WHERE customer_id = ANY(%s::bigint[]))', (ids,))
+    cur.execute('DELETE FROM account_customer WHERE customer_id = ANY(%s::bigint[])', (ids,))
+    cur.execute('DELETE FROM loan_customer WHERE customer_id = ANY(%s::bigint[])', (ids,))
+    cur.execute('DELETE FROM business WHERE customer_id = ANY(%s::bigint[])', (ids,))
+    cur.execute('DELETE FROM user_customer WHERE customer_id = ANY(%s::bigint[])', (ids,))
+    cur.execute('DELETE FROM customer WHERE id = ANY(%s::bigint[])', (ids,))
+
+def _delete_accounts(cur, ids):
+    cur.execute('DELETE FROM transaction WHERE account_id = ANY(%s::bigint[])', (ids,))
+    _archive_transfers(cur, ids)
+    cur.execute('DELETE FROM account WHERE id = ANY(%s::bigint[])', (ids,))
+
+def _delete_repayments(cur, ids):
+    cur.execute('DELETE FROM repayment WHERE id = ANY(%s::bigint[])', (ids,))
+
+CASCADE_DELETES = {
+    'branch': _delete_branches,
+    'employee': _delete_employees,
+    'customer': _delete_customers,
+    'account': _delete_accounts,
+    'loan': _delete_loans,
+    'repayment': _delete_repayments
+}
+
 @app.post('/branches/delete')
 def delete_branch():
     if _require_login('admin'):
         return _require_login('admin')
     data = request.get_json(force=True)
     bid = data.get('id')
-    if not bid:
-        return jsonify({'ok': False, 'error': 'invalid_params'}), 400
-    conn = begin_transaction()
-    cur = conn.cursor()
     try:
-        cur.execute('SELECT id FROM loan WHERE branch_id=%s', (bid,))
-        loan_ids = [row[0] for row in cur.fetchall()]
-        for lid in loan_ids:
-            cur.execute('DELETE FROM loan_customer WHERE loan_id=%s', (lid,))
-            cur.execute('DELETE FROM repayment_schedule WHERE loan_id=%s', (lid,))
-            cur.execute('DELETE FROM repayment WHERE loan_id=%s', (lid,))
-            cur.execute('DELETE FROM loan WHERE id=%s', (lid,))
-        cur.execute('DELETE FROM branch WHERE id=%s', (bid,))
-        conn.commit()
-        cur.close(); conn.close()
-        execute('INSERT INTO admin_activity_log(user_id, action, meta) VALUES(%s,%s,%s)', (session.get('user_id'), 'delete_branch', json.dumps({'id': bid})))
-        return jsonify({'ok': True, "message": "分行删除成功"})
-    except Exception as e:
-        try:
-            conn.rollback()
-        except Exception:
-            pass
-        try:
-            cur.close(); conn.close()
-        except Exception:
-            pass
-        if is_db_error(e):
-            s, c, m = map_db_error(e)
-            return jsonify({'ok': False, 'error': m, 'code': c}), s
-        return jsonify({'ok': False, "error": "删除分行失败"}), 500
+        bid = int(bid)
+    except (TypeError, ValueError):
+        return jsonify({'ok': False, 'error': 'invalid_params'}), 400
+    # 分行下贷款及还款明细可能很多，交给后台任务分批删除
+    return _job_accepted('delete', {'table': 'branch', 'ids': [bid]}, 'delete_branch')
 
 @app.get('/employees')
 def list_employees():
-    if _require_login('admin'):
-        return _require_login('admin')
-    rows = query_all('SELECT id, name, phone, hire_date, manager_id FROM employee ORDER BY id')
-    return jsonify(rows)
+    return _list_resource('employees')
 
 @app.post('/employees')
 def create_employee():
@@ -708,10 +850,7 @@ def create_employee():
 
 @app.get('/dependents')
 def list_dependents():
-    if _require_login('admin'):
-        return _require_login('admin')
-    rows = query_all('SELECT id, employee_id, name, relationship FROM dependent ORDER BY id')
-    return jsonify(rows)
+    return _list_resource('dependents')
 
 @app.post('/dependents')
 def create_dependent():
@@ -733,10 +872,7 @@ def create_dependent():
 
 @app.get('/customers')
 def list_customers():
-    if _require_login('admin'):
-        return _require_login('admin')
-    rows = query_all('SELECT id, name, identity_no, city, street, assistant_employee_id FROM customer ORDER BY id')
-    return jsonify(rows)
+    return _list_resource('customers')
 
 @app.post('/customers')
 def create_customer():
@@ -799,10 +935,7 @@ def create_customer():
 
 @app.get('/accounts')
 def list_accounts():
-    if _require_login('admin'):
-        return _require_login('admin')
-    rows = query_all('SELECT a.id, a.account_no, a.created_at, a.balance, a.type, s.interest_rate, c.overdraft_limit FROM account a LEFT JOIN savings_account s ON s.account_id = a.id LEFT JOIN checking_account c ON c.account_id = a.id ORDER BY a.id')
-    return jsonify(rows)
+    return _list_resource('accounts')
 
 @app.post('/accounts')
 def create_account():
@@ -847,6 +980,14 @@ def create_account():
         if conn:
             conn.close()
 
+# 目标状态 -> 允许的原状态
+LOAN_STATUS_TRANSITIONS = {
+    'APPROVED': ('PENDING',),
+    'DISBURSED': ('APPROVED',),
+    'SETTLED': ('DISBURSED', 'APPROVED')
+}
+LOAN_STATUS_BATCH_MAX = 1000
+
 @app.post('/loans/<int:loan_id>/status')
 def update_loan_status(loan_id):
     if _require_login('admin'):
@@ -855,7 +996,7 @@ def update_loan_status(loan_id):
     status = data.get('status')
     confirm = data.get('confirm')
     remark = data.get('remark', '')
-    if status not in ('APPROVED','DISBURSED','SETTLED'):
+    if status not in LOAN_STATUS_TRANSITIONS:
         return jsonify({'ok': False, 'error': 'invalid_status'}), 400
     if not confirm:
         return jsonify({'ok': False, 'error': 'need_confirm'}), 400
@@ -870,14 +1011,7 @@ def update_loan_status(loan_id):
         if not row:
             return jsonify({'ok': False, 'error': 'not_found'}), 404
         old = row[0]
-        ok = False
-        if old == 'PENDING' and status == 'APPROVED':
-            ok = True
-        elif old == 'APPROVED' and status == 'DISBURSED':
-            ok = True
-        elif old in ('DISBURSED','APPROVED') and status == 'SETTLED':
-            ok = True
-        if not ok:
+        if old not in LOAN_STATUS_TRANSITIONS[status]:
             return jsonify({'ok': False, 'error': 'invalid_transition'}), 400
         if status == 'SETTLED':
             cur.execute('UPDATE loan SET status=%s, settled_at=NOW() WHERE id=%s', (status, loan_id))
@@ -899,6 +1033,85 @@ def update_loan_status(loan_id):
         if conn:
             conn.close()
 
+@app.post('/loans/batch/status')
+def batch_update_loan_status():
+    """批量变更贷款状态：一条 UPDATE 完成合法流转并在同一事务内批量写入操作日志，逐个返回结果"""
+    if _require_login('admin'):
+        return _require_login('admin')
+    data = request.get_json(force=True)
+    ids = data.get('ids') or []
+    status = data.get('status')
+    confirm = data.get('confirm')
+    remark = data.get('remark', '')
+    if status not in LOAN_STATUS_TRANSITIONS:
+        return jsonify({'ok': False, 'error': 'invalid_status'}), 400
+    if not confirm:
+        return jsonify({'ok': False, 'error': 'need_confirm'}), 400
+    # 字符串、对象也能迭代，必须是 id 数组；布尔值是 int 的子类，单独排除
+    if not isinstance(ids, list) or any(isinstance(i, bool) for i in ids):
+        return jsonify({'ok': False, 'error': 'invalid_params'}), 400
+    try:
+        ids = sorted({int(i) for i in ids})
+    except (TypeError, ValueError):
+        return jsonify({'ok': False, 'error': 'invalid_params'}), 400
+    if not ids or len(ids) > LOAN_STATUS_BATCH_MAX:
+        return jsonify({'ok': False, 'error': 'invalid_params'}), 400
+    admin_id = session.get('user_id')
+    conn = None
+    cur = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        cur.execute("""
+            WITH moved AS (
+                UPDATE loan l
+                SET status = %(to)s,
+                    settled_at = CASE WHEN %(to)s = 'SETTLED' THEN NOW() ELSE l.settled_at END
+                FROM (
+                    SELECT id, status FROM loan
+                    WHERE id = ANY(%(ids)s) AND status = ANY(%(from)s)
+                    ORDER BY id
+                    FOR UPDATE
+                ) o
+                WHERE l.id = o.id
+                RETURNING l.id, o.status AS old_status
+            ), logged AS (
+                INSERT INTO admin_activity_log(user_id, action, meta)
+                SELECT %(admin)s, 'loan_status_update',
+                       jsonb_build_object('loan_id', id, 'from', old_status, 'to', %(to)s, 'remark', %(remark)s)
+                FROM moved
+            )
+            SELECT id, old_status FROM moved
+        """, {'to': status, 'ids': ids, 'from': list(LOAN_STATUS_TRANSITIONS[status]), 'admin': admin_id, 'remark': remark})
+        moved = dict(cur.fetchall())
+        rest = [i for i in ids if i not in moved]
+        current = {}
+        if rest:
+            cur.execute('SELECT id, status FROM loan WHERE id = ANY(%s)', (rest,))
+            current = dict(cur.fetchall())
+        conn.commit()
+        results = []
+        for i in ids:
+            if i in moved:
+                results.append({'id': i, 'ok': True, 'from': moved[i], 'to': status})
+            elif i in current:
+                results.append({'id': i, 'ok': False, 'from': current[i], 'error': 'invalid_transition'})
+            else:
+                results.append({'id': i, 'ok': False, 'error': 'not_found'})
+        return jsonify({'ok': True, 'updated': len(moved), 'results': results})
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        if is_db_error(e):
+            s, c, m = map_db_error(e)
+            return jsonify({'ok': False, 'error': m, 'code': c}), s
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
 @app.post('/account_owners')
 def add_account_owner():
     if _require_login('admin'):
@@ -940,36 +1153,12 @@ def admin_delete_branch():
         return _require_login('admin')
     data = request.get_json(force=True)
     bid = data.get('id')
-    if not bid:
-        return jsonify({'ok': False, 'error': 'invalid_params'}), 400
-    conn = begin_transaction()
-    cur = conn.cursor()
     try:
-        cur.execute('SELECT id FROM loan WHERE branch_id=%s', (bid,))
-        loan_ids = [row[0] for row in cur.fetchall()]
-        for lid in loan_ids:
-            cur.execute('DELETE FROM loan_customer WHERE loan_id=%s', (lid,))
-            cur.execute('DELETE FROM repayment_schedule WHERE loan_id=%s', (lid,))
-            cur.execute('DELETE FROM repayment WHERE loan_id=%s', (lid,))
-            cur.execute('DELETE FROM loan WHERE id=%s', (lid,))
-        cur.execute('DELETE FROM branch WHERE id=%s', (bid,))
-        conn.commit()
-        cur.close(); conn.close()
-        execute('INSERT INTO admin_activity_log(user_id, action, meta) VALUES(%s,%s,%s)', (session.get('user_id'), 'delete_branch', json.dumps({'id': bid})))
-        return jsonify({'ok': True})
-    except Exception as e:
-        try:
-            conn.rollback()
-        except Exception:
-            pass
-        try:
-            cur.close(); conn.close()
-        except Exception:
-            pass
-        if is_db_error(e):
-            s, c, m = map_db_error(e)
-            return jsonify({'ok': False, 'error': m, 'code': c}), s
-        return jsonify({'ok': False, 'error': '删除分行失败'}), 500
+        bid = int(bid)
+    except (TypeError, ValueError):
+        return jsonify({'ok': False, 'error': 'invalid_params'}), 400
+    # 分行下贷款及还款明细可能很多，交给后台任务分批删除
+    return _job_accepted('delete', {'table': 'branch', 'ids': [bid]}, 'delete_branch')
 
 @app.post('/admin/employees/delete')
 def admin_delete_employee():
@@ -987,10 +1176,7 @@ def admin_delete_employee():
     conn = begin_transaction()
     cur = conn.cursor()
     try:
-        cur.execute('DELETE FROM dependent WHERE employee_id=%s', (eid,))
-        cur.execute('UPDATE employee SET manager_id=NULL WHERE manager_id=%s', (eid,))
-        cur.execute('UPDATE customer SET assistant_employee_id=NULL WHERE assistant_employee_id=%s', (eid,))
-        cur.execute('DELETE FROM employee WHERE id=%s', (eid,))
+        _delete_employees(cur, [eid])
         conn.commit()
         cur.close(); conn.close()
         execute('INSERT INTO admin_activity_log(user_id, action, meta) VALUES(%s,%s,%s)', (session.get('user_id'), 'delete_employee', json.dumps({'id': eid})))
@@ -1043,15 +1229,7 @@ def admin_delete_customer():
     conn = begin_transaction()
     cur = conn.cursor()
     try:
-        cur.execute('SELECT id FROM business WHERE customer_id=%s', (cid,))
-        bs_ids = [row[0] for row in cur.fetchall()]
-        for bid_ in bs_ids:
-            cur.execute('DELETE FROM transaction WHERE business_id=%s', (bid_,))
-        cur.execute('DELETE FROM account_customer WHERE customer_id=%s', (cid,))
-        cur.execute('DELETE FROM loan_customer WHERE customer_id=%s', (cid,))
-        cur.execute('DELETE FROM business WHERE customer_id=%s', (cid,))
-        cur.execute('DELETE FROM user_customer WHERE customer_id=%s', (cid,))
-        cur.execute('DELETE FROM customer WHERE id=%s', (cid,))
+        _delete_customers(cur, [cid])
         conn.commit()
         cur.close(); conn.close()
         execute('INSERT INTO admin_activity_log(user_id, action, meta) VALUES(%s,%s,%s)', (session.get('user_id'), 'delete_customer', json.dumps({'id': cid})))
@@ -1086,9 +1264,7 @@ def admin_delete_account():
     conn = begin_transaction()
     cur = conn.cursor()
     try:
-        cur.execute('DELETE FROM transaction WHERE account_id=%s', (aid,))
-        cur.execute('DELETE FROM transfer WHERE from_account_id=%s OR to_account_id=%s', (aid, aid))
-        cur.execute('DELETE FROM account WHERE id=%s', (aid,))
+        _delete_accounts(cur, [aid])
         conn.commit()
         cur.close(); conn.close()
         execute('INSERT INTO admin_activity_log(user_id, action, meta) VALUES(%s,%s,%s)', (session.get('user_id'), 'delete_account', json.dumps({'id': aid})))
@@ -1123,10 +1299,7 @@ def admin_delete_loan():
     conn = begin_transaction()
     cur = conn.cursor()
     try:
-        cur.execute('DELETE FROM loan_customer WHERE loan_id=%s', (lid,))
-        cur.execute('DELETE FROM repayment_schedule WHERE loan_id=%s', (lid,))
-        cur.execute('DELETE FROM repayment WHERE loan_id=%s', (lid,))
-        cur.execute('DELETE FROM loan WHERE id=%s', (lid,))
+        _delete_loans(cur, [lid])
         conn.commit()
         cur.close(); conn.close()
         execute('INSERT INTO admin_activity_log(user_id, action, meta) VALUES(%s,%s,%s)', (session.get('user_id'), 'delete_loan', json.dumps({'id': lid})))
@@ -1170,10 +1343,7 @@ def admin_delete_repayment():
 
 @app.get('/loans')
 def list_loans():
-    if _require_login('admin'):
-        return _require_login('admin')
-    rows = query_all('SELECT id, loan_no, amount, branch_id FROM loan ORDER BY id')
-    return jsonify(rows)
+    return _list_resource('loans')
 
 @app.get('/loans/financials')
 def loans_financials():
@@ -1211,6 +1381,108 @@ def loans_financials():
     finally:
         cur.close(); conn.close()
 
+@app.get('/admin/portfolio/branches')
+def admin_portfolio_branches():
+    """分行贷款组合统计（读取触发器维护的 branch_loan_portfolio 汇总表）"""
+    if _require_login('admin'):
+        return _require_login('admin')
+    rows = query_all("""
+        SELECT b.id AS branch_id, b.union_no, b.name, p.status, p.loan_count, p.principal, p.repaid, p.rate_weighted
+        FROM branch_loan_portfolio p
+        JOIN branch b ON b.id = p.branch_id
+        WHERE p.loan_count <> 0
+        ORDER BY b.id, p.status
+    """)
+    result = []
+    by_branch = {}
+    for r in rows:
+        item = by_branch.get(r['branch_id'])
+        if item is None:
+            item = {
+                'branch_id': r['branch_id'],
+                'union_no': r['union_no'],
+                'name': r['name'],
+                'loan_count': 0,
+                'principal_amount': 0.0,
+                'repaid_amount': 0.0,
+                'outstanding_amount': 0.0,
+                'weighted_rate': 0.0,
+                'status_counts': {},
+                '_rate_weighted': 0.0
+            }
+            by_branch[r['branch_id']] = item
+            result.append(item)
+        item['loan_count'] += r['loan_count']
+        item['principal_amount'] += float(r['principal'])
+        item['repaid_amount'] += float(r['repaid'])
+        item['_rate_weighted'] += float(r['rate_weighted'])
+        item['status_counts'][r['status']] = r['loan_count']
+    for item in result:
+        principal = item['principal_amount']
+        item['weighted_rate'] = round(item.pop('_rate_weighted') / principal, 6) if principal else 0.0
+        item['outstanding_amount'] = round(principal - item['repaid_amount'], 2)
+        item['principal_amount'] = round(principal, 2)
+        item['repaid_amount'] = round(item['repaid_amount'], 2)
+    return jsonify(result)
+
+@app.post('/admin/portfolio/rebuild')
+def admin_portfolio_rebuild():
+    """按明细全量重建分行贷款组合汇总表（用于首次回填或校正，后台任务执行）"""
+    if _require_login('admin'):
+        return _require_login('admin')
+    return _job_accepted('portfolio_rebuild')
+
+def _add_months(d, m):
+    y = d.year + (d.month - 1 + m) // 12
+    mo = (d.month - 1 + m) % 12 + 1
+    day = min(d.day, [31,29 if (y%4==0 and (y%100!=0 or y%400==0)) else 28,31,30,31,30,31,31,30,31,30,31][mo-1])
+    return datetime.date(y, mo, day)
+
+# 年利率上限（loan.interest_rate 为 NUMERIC(5,4)），同时避免试算时 (1 + r) ** n 溢出
+LOAN_MAX_INTEREST_RATE = 1
+
+def _loan_terms_error(interest_rate, term_months, repayment_method):
+    """校验贷款期限、利率和还款方式，不合法时返回错误信息"""
+    if not isinstance(term_months, int) or term_months <= 0:
+        return '期限不合法'
+    if (not isinstance(interest_rate, (int, float)) or isinstance(interest_rate, bool)
+            or not math.isfinite(interest_rate) or interest_rate < 0 or interest_rate > LOAN_MAX_INTEREST_RATE):
+        return '利率不合法'
+    if repayment_method not in ('EQUAL_INSTALLMENT','EQUAL_PRINCIPAL'):
+        return '还款方式不合法'
+    return None
+
+def _build_repayment_schedule(amount, interest_rate, term_months, repayment_method, start_date):
+    """按等额本息/等额本金生成还款计划，返回 [(期数, 到期日, 应还本金, 应还利息), ...]"""
+    monthly_rate = (interest_rate or 0) / 12.0
+    remaining = float(amount)
+    schedule = []
+    if repayment_method == 'EQUAL_INSTALLMENT':
+        r = monthly_rate
+        n = term_months
+        pay = 0.0
+        if r > 0:
+            pay = remaining * r * (1 + r) ** n / ((1 + r) ** n - 1)
+        else:
+            pay = remaining / n
+        pay = round(pay + 1e-8, 2)
+        for i in range(1, term_months + 1):
+            interest = round(remaining * r, 2)
+            principal = pay - interest
+            if i == term_months:
+                principal = round(remaining, 2)
+                interest = round(pay - principal, 2) if monthly_rate > 0 else 0.0
+            schedule.append((i, _add_months(start_date, i), principal, interest))
+            remaining = round(remaining - principal, 2)
+    else:
+        principal_each = round(remaining / term_months, 2)
+        for i in range(1, term_months + 1):
+            interest = round(remaining * monthly_rate, 2)
+            principal = principal_each if i < term_months else round(remaining, 2)
+            schedule.append((i, _add_months(start_date, i), principal, interest))
+            remaining = round(remaining - principal, 2)
+    return schedule
+
 @app.post('/loans')
 def create_loan():
     if _require_login('admin'):
@@ -1233,12 +1505,9 @@ def create_loan():
     for cid in customer_ids:
         if not query_all('SELECT 1 FROM customer WHERE id=%s LIMIT 1', (cid,)):
             return jsonify({'ok': False, 'error': f'客户不存在: {cid}'}), 400
-    if not isinstance(term_months, int) or term_months <= 0:
-        return jsonify({'ok': False, 'error': '期限不合法'}), 400
-    if not isinstance(interest_rate, (int, float)) or interest_rate < 0:
-        return jsonify({'ok': False, 'error': '利率不合法'}), 400
-    if repayment_method not in ('EQUAL_INSTALLMENT','EQUAL_PRINCIPAL'):
-        return jsonify({'ok': False, 'error': '还款方式不合法'}), 400
+    err = _loan_terms_error(interest_rate, term_months, repayment_method)
+    if err:
+        return jsonify({'ok': False, 'error': err}), 400
     
     conn = None
     cur = None
@@ -1246,48 +1515,17 @@ def create_loan():
         conn = get_conn()
         cur = conn.cursor()
         start_date = datetime.date.today()
-        cur.execute('INSERT INTO loan(loan_no, amount, branch_id, interest_rate, term_months, repayment_method, status, start_date, end_date) VALUES(%s,%s,%s,%s,%s,%s,%s,%s,%s) RETURNING id', (loan_no, amount, branch_id, interest_rate, term_months, repayment_method, 'PENDING', start_date, None))
+        schedule = _build_repayment_schedule(amount, interest_rate, term_months, repayment_method, start_date)
+        last_due = schedule[-1][1] if schedule else None
+        cur.execute('INSERT INTO loan(loan_no, amount, branch_id, interest_rate, term_months, repayment_method, status, start_date, end_date) VALUES(%s,%s,%s,%s,%s,%s,%s,%s,%s) RETURNING id', (loan_no, amount, branch_id, interest_rate, term_months, repayment_method, 'PENDING', start_date, last_due))
         loan_id = cur.fetchone()[0]
         for cid in customer_ids:
             cur.execute('INSERT INTO loan_customer(loan_id, customer_id) VALUES(%s,%s) ON CONFLICT DO NOTHING', (loan_id, cid))
-        monthly_rate = (interest_rate or 0) / 12.0
-        def _add_months(d, m):
-            y = d.year + (d.month - 1 + m) // 12
-            mo = (d.month - 1 + m) % 12 + 1
-            day = min(d.day, [31,29 if (y%4==0 and (y%100!=0 or y%400==0)) else 28,31,30,31,30,31,31,30,31,30,31][mo-1])
-            return datetime.date(y, mo, day)
-        remaining = float(amount)
-        last_due = None
-        if repayment_method == 'EQUAL_INSTALLMENT':
-            r = monthly_rate
-            n = term_months
-            pay = 0.0
-            if r > 0:
-                pay = remaining * r * (1 + r) ** n / ((1 + r) ** n - 1)
-            else:
-                pay = remaining / n
-            pay = round(pay + 1e-8, 2)
-            for i in range(1, term_months + 1):
-                interest = round(remaining * r, 2)
-                principal = pay - interest
-                if i == term_months:
-                    principal = round(remaining, 2)
-                    interest = round(pay - principal, 2) if monthly_rate > 0 else 0.0
-                due_date = _add_months(start_date, i)
-                cur.execute('INSERT INTO repayment_schedule(loan_id, period_no, due_date, principal_due, interest_due, status) VALUES(%s,%s,%s,%s,%s,%s)', (loan_id, i, due_date, principal, interest, 'DUE'))
-                remaining = round(remaining - principal, 2)
-                last_due = due_date
-        else:
-            principal_each = round(remaining / term_months, 2)
-            for i in range(1, term_months + 1):
-                interest = round(remaining * monthly_rate, 2)
-                principal = principal_each if i < term_months else round(remaining, 2)
-                due_date = _add_months(start_date, i)
-                cur.execute('INSERT INTO repayment_schedule(loan_id, period_no, due_date, principal_due, interest_due, status) VALUES(%s,%s,%s,%s,%s,%s)', (loan_id, i, due_date, principal, interest, 'DUE'))
-                remaining = round(remaining - principal, 2)
-                last_due = due_date
-        if last_due:
-            cur.execute('UPDATE loan SET end_date=%s WHERE id=%s', (last_due, loan_id))
+        psycopg2.extras.execute_values(
+            cur,
+            'INSERT INTO repayment_schedule(loan_id, period_no, due_date, principal_due, interest_due, status) VALUES %s',
+            [(loan_id, i, due_date, principal, interest, 'DUE') for i, due_date, principal, interest in schedule]
+        )
         conn.commit()
         return jsonify({"ok": True, "loan_id": loan_id, "message": "贷款创建成功"})
     except Exception as e:
@@ -1303,12 +1541,256 @@ def create_loan():
         if conn:
             conn.close()
 
-@app.get('/repayments')
-def list_repayments():
+# 贷款试算：不落库，按参数做 LRU 缓存
+LOAN_QUOTE_CACHE_SIZE = int(os.getenv('LOAN_QUOTE_CACHE_SIZE', '4096'))
+LOAN_QUOTE_MAX_VARIANTS = 500
+LOAN_QUOTE_MAX_TERM = 600
+
+@functools.lru_cache(maxsize=LOAN_QUOTE_CACHE_SIZE)
+def _loan_quote(amount, interest_rate, term_months, repayment_method, start_date):
+    """计算一组贷款参数的还款计划及汇总，结果只读共享，调用方不得修改"""
+    schedule = [{
+        'period_no': i,
+        'due_date': due_date.isoformat(),
+        'principal_due': round(principal, 2),
+        'interest_due': round(interest, 2),
+        'payment': round(principal + interest, 2)
+    } for i, due_date, principal, interest in _build_repayment_schedule(amount, interest_rate, term_months, repayment_method, start_date)]
+    total_interest = round(sum(p['interest_due'] for p in schedule), 2)
+    return {
+        'amount': amount,
+        'interest_rate': interest_rate,
+        'term_months': term_months,
+        'repayment_method': repayment_method,
+        'start_date': start_date.isoformat(),
+        'end_date': schedule[-1]['due_date'] if schedule else None,
+        'first_payment': schedule[0]['payment'] if schedule else 0.0,
+        'total_principal': round(sum(p['principal_due'] for p in schedule), 2),
+        'total_interest': total_interest,
+        'total_payment': round(amount + total_interest, 2),
+        'schedule': schedule
+    }
+
+def _quote_variant(v, start_date):
+    """校验单组试算参数并返回试算结果"""
+    if not isinstance(v, dict):
+        return {'ok': False, 'error': '参数不完整'}
+    amount = v.get('amount')
+    interest_rate = v.get('interest_rate')
+    term_months = v.get('term_months')
+    repayment_method = v.get('repayment_method')
+    try:
+        amount = round(float(amount), 2)
+    except (TypeError, ValueError):
+        return {'ok': False, 'error': '金额不合法'}
+    if not math.isfinite(amount) or amount <= 0:
+        return {'ok': False, 'error': '金额不合法'}
+    err = _loan_terms_error(interest_rate, term_months, repayment_method)
+    if err:
+        return {'ok': False, 'error': err}
+    if term_months > LOAN_QUOTE_MAX_TERM:
+        return {'ok': False, 'error': '期限不合法'}
+    return dict(_loan_quote(amount, float(interest_rate), term_months, repayment_method, start_date), ok=True)
+
+@app.post('/loans/quote')
+def quote_loan():
+    """贷款试算：单组参数直接返回结果；传 variants 数组时批量试算"""
     if _require_login('admin'):
         return _require_login('admin')
-    rows = query_all('SELECT id, loan_id, batch_no, paid_at, amount, savings_account_id FROM repayment ORDER BY id')
-    return jsonify(rows)
+    data = request.get_json(force=True)
+    start_date = datetime.date.today()
+    variants = data.get('variants')
+    if variants is None:
+        result = _quote_variant(data, start_date)
+        return jsonify(result), (200 if result['ok'] else 400)
+    if not isinstance(variants, list) or not variants:
+        return jsonify({'ok': False, 'error': '参数不完整'}), 400
+    if len(variants) > LOAN_QUOTE_MAX_VARIANTS:
+        return jsonify({'ok': False, 'error': f'单次最多试算 {LOAN_QUOTE_MAX_VARIANTS} 组'}), 400
+    return jsonify({'ok': True, 'quotes': [_quote_variant(v, start_date) for v in variants]})
+
+# 贷款批量导入：COPY 到临时暂存表，反连接集中校验，一个事务内合并
+LOAN_IMPORT_COLUMNS = ('loan_no', 'amount', 'branch_id', 'customer_ids', 'interest_rate', 'term_months', 'repayment_method')
+LOAN_IMPORT_STATUSES = ('PENDING', 'APPROVED', 'DISBURSED', 'SETTLED')
+LOAN_IMPORT_BATCH = 5000
+LOAN_IMPORT_MAX_ERRORS = 100
+
+def _copy_rows(cur, table, columns, rows):
+    """用 COPY FROM STDIN 批量写入行"""
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+    cur.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buf)
+
+def import_loans_csv(f, operator_id=None):
+    """
+    批量导入贷款
+    CSV 表头: loan_no,amount,branch_id,customer_ids,interest_rate,term_months,repayment_method[,status][,start_date]
+    customer_ids 多个客户用 ; 分隔。全部校验通过才在同一事务内写入贷款、贷款客户关联和还款计划，否则整体回滚并返回错误行。
+    """
+    reader = csv.DictReader(f)
+    missing = [c for c in LOAN_IMPORT_COLUMNS if c not in (reader.fieldnames or [])]
+    if missing:
+        return {'ok': False, 'error': 'missing_columns', 'columns': missing}
+    errors = []
+    def _err(line_no, msg):
+        if len(errors) < LOAN_IMPORT_MAX_ERRORS:
+            errors.append({'line': line_no, 'error': msg})
+    today = datetime.date.today()
+    seen = set()
+    total = 0
+    conn = begin_transaction()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            CREATE TEMP TABLE loan_import_stage (
+              line_no INTEGER PRIMARY KEY, loan_id BIGINT, loan_no VARCHAR(64), amount NUMERIC(18,2), branch_id BIGINT,
+              interest_rate NUMERIC(5,4), term_months INTEGER, repayment_method VARCHAR(32), status VARCHAR(32),
+              start_date DATE, end_date DATE
+            ) ON COMMIT DROP
+        """)
+        cur.execute('CREATE TEMP TABLE loan_customer_import_stage (line_no INTEGER, customer_id BIGINT) ON COMMIT DROP')
+        cur.execute("""
+            CREATE TEMP TABLE repayment_schedule_import_stage (
+              line_no INTEGER, period_no INTEGER, due_date DATE, principal_due NUMERIC(18,2), interest_due NUMERIC(18,2)
+            ) ON COMMIT DROP
+        """)
+        loans, owners, periods = [], [], []
+        def _flush():
+            _copy_rows(cur, 'loan_import_stage', ('line_no', 'loan_no', 'amount', 'branch_id', 'interest_rate', 'term_months', 'repayment_method', 'status', 'start_date', 'end_date'), loans)
+            _copy_rows(cur, 'loan_customer_import_stage', ('line_no', 'customer_id'), owners)
+            _copy_rows(cur, 'repayment_schedule_import_stage', ('line_no', 'period_no', 'due_date', 'principal_due', 'interest_due'), periods)
+            del loans[:], owners[:], periods[:]
+        for row in reader:
+            line_no = reader.line_num
+            loan_no = (row.get('loan_no') or '').strip()
+            method = (row.get('repayment_method') or '').strip()
+            status = (row.get('status') or '').strip() or 'PENDING'
+            if not loan_no:
+                _err(line_no, '参数不完整')
+                continue
+            if loan_no in seen:
+                _err(line_no, f'贷款号重复: {loan_no}')
+                continue
+            seen.add(loan_no)
+            try:
+                amount = round(float(row['amount']), 2)
+                branch_id = int(row['branch_id'])
+                rate = float(row['interest_rate'])
+                term = int(row['term_months'])
+                cids = sorted({int(c) for c in (row.get('customer_ids') or '').split(';') if c.strip()})
+            except (TypeError, ValueError):
+                _err(line_no, '输入格式不正确')
+                continue
+            try:
+                start_date = datetime.date.fromisoformat(row['start_date'].strip()) if (row.get('start_date') or '').strip() else today
+            except ValueError:
+                _err(line_no, '起始日期不合法')
+                continue
+            if not math.isfinite(amount) or amount <= 0:
+                _err(line_no, '金额不合法')
+                continue
+            if not cids:
+                _err(line_no, '贷款必须至少由一位客户拥有')
+                continue
+            if status not in LOAN_IMPORT_STATUSES:
+                _err(line_no, '状态不合法')
+                continue
+            err = _loan_terms_error(rate, term, method)
+            if err:
+                _err(line_no, err)
+                continue
+            if errors:
+                continue
+            schedule = _build_repayment_schedule(amount, rate, term, method, start_date)
+            loans.append((line_no, loan_no, amount, branch_id, rate, term, method, status, start_date, schedule[-1][1]))
+            owners.extend((line_no, cid) for cid in cids)
+            periods.extend((line_no, i, due_date, round(principal, 2), round(interest, 2)) for i, due_date, principal, interest in schedule)
+            total += 1
+            if len(loans) >= LOAN_IMPORT_BATCH:
+                _flush()
+        if errors:
+            conn.rollback()
+            return {'ok': False, 'error': 'invalid_rows', 'errors': errors}
+        if not total:
+            conn.rollback()
+            return {'ok': False, 'error': 'empty'}
+        _flush()
+        cur.execute('ANALYZE loan_import_stage')
+        cur.execute('ANALYZE loan_customer_import_stage')
+        cur.execute("""
+            SELECT s.line_no, '分行不存在: ' || s.branch_id
+            FROM loan_import_stage s
+            WHERE NOT EXISTS (SELECT 1 FROM branch b WHERE b.id = s.branch_id)
+            UNION ALL
+            SELECT c.line_no, '客户不存在: ' || c.customer_id
+            FROM loan_customer_import_stage c
+            WHERE NOT EXISTS (SELECT 1 FROM customer cu WHERE cu.id = c.customer_id)
+            UNION ALL
+            SELECT s.line_no, '贷款号已存在: ' || s.loan_no
+            FROM loan_import_stage s
+            WHERE EXISTS (SELECT 1 FROM loan l WHERE l.loan_no = s.loan_no)
+            ORDER BY 1
+            LIMIT %s
+        """, (LOAN_IMPORT_MAX_ERRORS,))
+        errors = [{'line': line_no, 'error': msg} for line_no, msg in cur.fetchall()]
+        if errors:
+            conn.rollback()
+            return {'ok': False, 'error': 'invalid_rows', 'errors': errors}
+        # 预先分配贷款ID，后续关联表按暂存行号整体连接写入
+        cur.execute("UPDATE loan_import_stage SET loan_id = nextval(pg_get_serial_sequence('loan', 'id'))")
+        cur.execute("""
+            INSERT INTO loan(id, loan_no, amount, branch_id, interest_rate, term_months, repayment_method, status, start_date, end_date, settled_at)
+            SELECT loan_id, loan_no, amount, branch_id, interest_rate, term_months, repayment_method, status, start_date, end_date,
+                   CASE WHEN status = 'SETTLED' THEN NOW() END
+            FROM loan_import_stage
+            ORDER BY line_no
+        """)
+        cur.execute("""
+            INSERT INTO loan_customer(loan_id, customer_id)
+            SELECT s.loan_id, c.customer_id
+            FROM loan_customer_import_stage c
+            JOIN loan_import_stage s ON s.line_no = c.line_no
+        """)
+        cur.execute("""
+            INSERT INTO repayment_schedule(loan_id, period_no, due_date, principal_due, interest_due, status)
+            SELECT s.loan_id, p.period_no, p.due_date, p.principal_due, p.interest_due, 'DUE'
+            FROM repayment_schedule_import_stage p
+            JOIN loan_import_stage s ON s.line_no = p.line_no
+        """)
+        if operator_id:
+            cur.execute('INSERT INTO admin_activity_log(user_id, action, meta) VALUES(%s,%s,%s)', (operator_id, 'import_loans', json.dumps({'count': total})))
+        conn.commit()
+        return {'ok': True, 'imported': total}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+@app.post('/admin/loans/import')
+def admin_import_loans():
+    """上传 CSV 批量导入贷款（multipart 字段 file，或直接以 text/csv 作为请求体）"""
+    if _require_login('admin'):
+        return _require_login('admin')
+    upload = request.files.get('file')
+    if upload:
+        f = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    else:
+        f = io.StringIO(request.get_data(as_text=True).lstrip('\ufeff'), newline='')
+    try:
+        result = import_loans_csv(f, session.get('user_id'))
+        return jsonify(result), (200 if result['ok'] else 400)
+    except Exception as e:
+        if is_db_error(e):
+            s, c, m = map_db_error(e)
+            return jsonify({'ok': False, 'error': m, 'code': c}), s
+        return jsonify({'ok': False, 'error': '批量导入贷款失败'}), 500
+
+@app.get('/repayments')
+def list_repayments():
+    return _list_resource('repayments')
 
 @app.post('/repayments')
 def create_repayment():
@@ -1337,65 +1819,187 @@ def create_repayment():
             return jsonify({'ok': False, 'error': m, 'code': c}), s
         return jsonify({'ok': False, 'error': '添加还款记录失败'}), 500
 
-@app.get('/admin/query/customers')
-def admin_query_customers():
-    if _require_login('admin'):
-        return _require_login('admin')
-    name = request.args.get('name')
-    city = request.args.get('city')
-    idno = request.args.get('idno')
-    page = int(request.args.get('page', '1'))
-    size = int(request.args.get('size', '10'))
+CUSTOMER_QUERY_MAX_SIZE = 200
+
+def _customer_filters(alias=''):
+    """解析请求中的 name/city/idno 模糊过滤条件，返回 (where 条件列表, 参数列表)，alias 为 customer 表别名前缀"""
+    return _customer_filter_clauses(request.args.get('name'), request.args.get('city'), request.args.get('idno'), alias)
+
+def _customer_filter_clauses(name, city, idno, alias=''):
     where = []
     params = []
     if name:
-        where.append('name ILIKE %s')
-        params.append('%' + name + '%')
+        where.append(alias + 'name ILIKE %s')
+        params.append(_fuzzy_pattern(name))
     if city:
-        where.append('city ILIKE %s')
-        params.append('%' + city + '%')
+        where.append(alias + 'city ILIKE %s')
+        params.append(_fuzzy_pattern(city))
     if idno:
-        where.append('identity_no ILIKE %s')
-        params.append('%' + idno + '%')
-    sql = 'SELECT id, name, identity_no, city, street FROM customer'
-    if where:
-        sql += ' WHERE ' + ' AND '.join(where)
-    sql += ' ORDER BY id LIMIT %s OFFSET %s'
-    params.extend([size, (page - 1) * size])
-    rows = query_all(sql, tuple(params))
-    return jsonify(rows)
+        where.append(alias + 'identity_no ILIKE %s')
+        params.append(_fuzzy_pattern(idno))
+    return where, params
+
+def _customer_page_sql(where, params, cursor, size):
+    """客户分页查询的 (计数用 FROM 子句, 分页 SQL, 分页参数)"""
+    base = 'FROM customer' + (' WHERE ' + ' AND '.join(where) if where else '')
+    sql = 'SELECT id, name, identity_no, city, street ' + base + (' AND' if where else ' WHERE') + ' id > %s ORDER BY id LIMIT %s'
+    return base, sql, tuple(params) + (cursor, size + 1)
 
-@app.get('/admin/export/customers')
-def admin_export_customers():
+def _estimate_rows(sql, params=None):
+    """用规划器估算查询结果行数（只做 EXPLAIN，不执行查询）"""
+    rows = query_all('EXPLAIN (FORMAT JSON) ' + sql, params)
+    return int(rows[0]['QUERY PLAN'][0]['Plan']['Plan Rows'])
+
+@app.get('/admin/query/customers')
+def admin_query_customers():
+    """
+    客户分页查询：按 id 做 keyset 分页（cursor 为上一页最后一条的 id，下一页游标在 X-Next-Cursor 响应头）。
+    count=estimate（默认）返回规划器估算总数，count=exact 返回精确总数，count=none 不计数；
+    总数放在 X-Total-Count 响应头，X-Total-Count-Exact 标明是否精确。
+    """
     if _require_login('admin'):
         return _require_login('admin')
-    name = request.args.get('name')
-    city = request.args.get('city')
-    idno = request.args.get('idno')
-    where = []
-    params = []
-    if name:
-        where.append('name ILIKE %s')
-        params.append('%' + name + '%')
-    if city:
-        where.append('city ILIKE %s')
-        params.append('%' + city + '%')
-    if idno:
-        where.append('identity_no ILIKE %s')
-        params.append('%' + idno + '%')
-    sql = 'SELECT id, name, identity_no, city, street FROM customer'
-    if where:
-        sql += ' WHERE ' + ' AND '.join(where)
+    count_mode = request.args.get('count', 'estimate')
+    try:
+        size = int(request.args.get('size', '10'))
+        cursor = int(request.args.get('cursor', '0'))
+    except ValueError:
+        return jsonify({'ok': False, 'error': '分页参数不合法'}), 400
+    if size < 1 or size > CUSTOMER_QUERY_MAX_SIZE or cursor < 0 or count_mode not in ('estimate', 'exact', 'none'):
+        return jsonify({'ok': False, 'error': '分页参数不合法'}), 400
+    where, params = _customer_filters()
+    base, sql, page_params = _customer_page_sql(where, params, cursor, size)
+    rows = query_all(sql, page_params)
+    resp = _keyset_response(rows, size)
+    if count_mode == 'exact':
+        resp.headers['X-Total-Count'] = str(query_all('SELECT COUNT(*) AS total ' + base, tuple(params))[0]['total'])
+        resp.headers['X-Total-Count-Exact'] = '1'
+    elif count_mode == 'estimate':
+        resp.headers['X-Total-Count'] = str(_estimate_rows('SELECT id ' + base, tuple(params)))
+        resp.headers['X-Total-Count-Exact'] = '0'
+    return resp
+
+# 导出：COPY (SELECT ...) TO STDOUT 在后台线程中执行，数据块经有界队列流式返回，内存占用与表大小无关
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_QUEUE_SIZE = 16
+# 实体 -> (查询SQL, 按客户过滤时的条件)，客户过滤条件中 {cf} 替换为 name/city/idno 条件
+EXPORT_QUERIES = {
+    'customers': (
+        'SELECT c.id, c.name, c.identity_no, c.city, c.street FROM customer c',
+        '{cf}'
+    ),
+    'accounts': (
+        'SELECT a.id, a.account_no, a.created_at, a.balance, a.type, a.closed_at FROM account a',
+        'EXISTS (SELECT 1 FROM account_customer ac JOIN customer c ON c.id = ac.customer_id WHERE ac.account_id = a.id AND {cf})'
+    ),
+    'loans': (
+        'SELECT l.id, l.loan_no, l.amount, l.branch_id, l.interest_rate, l.term_months, l.repayment_method, l.status, l.start_date, l.end_date, l.settled_at FROM loan l',
+        'EXISTS (SELECT 1 FROM loan_customer lc JOIN customer c ON c.id = lc.customer_id WHERE lc.loan_id = l.id AND {cf})'
+    ),
+    'repayments': (
+        'SELECT r.id, r.loan_id, r.batch_no, r.paid_at, r.amount, r.savings_account_id FROM repayment r',
+        'EXISTS (SELECT 1 FROM loan_customer lc JOIN customer c ON c.id = lc.customer_id WHERE lc.loan_id = r.loan_id AND {cf})'
+    ),
+    'transactions': (
+        'SELECT t.id, t.account_id, t.business_id, t.transfer_id, t.txn_type, t.amount, t.balance_after, t.created_at, t.remark FROM transaction t',
+        'EXISTS (SELECT 1 FROM account_customer ac JOIN customer c ON c.id = ac.customer_id WHERE ac.account_id = t.account_id AND {cf})'
+    )
+}
+
+class _CopyBuffer:
+    """COPY TO STDOUT 的写入端：按行累积，满一块后放入队列"""
+    def __init__(self, q):
+        self.q = q
+        self.buf = bytearray()
+
+    def write(self, data):
+        self.buf += data
+        if len(self.buf) >= EXPORT_CHUNK_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buf:
+            self.q.put(bytes(self.buf))
+            self.buf = bytearray()
+
+def _stream_copy(sql, params=None, compress=False):
+    """以 COPY (sql) TO STDOUT 导出 CSV 并逐块产出数据，客户端断开时取消查询"""
+    q = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+    done = object()
     conn = get_conn()
+    errors = []
     cur = conn.cursor()
-    cur.execute(sql, tuple(params))
-    rows = cur.fetchall()
+    copy_sql = 'COPY (' + cur.mogrify(sql, params).decode('utf-8') + ') TO STDOUT WITH (FORMAT csv, HEADER)'
     cur.close()
-    conn.close()
-    lines = ['id,name,identity_no,city,street']
-    for r in rows:
-        lines.append(','.join([str(r[0]), r[1], r[2], r[3], r[4]]))
-    return '\n'.join(lines), 200, {'Content-Type': 'text/csv'}
+    def _run():
+        cur = conn.cursor()
+        try:
+            out = _CopyBuffer(q)
+            cur.copy_expert(copy_sql, out)
+            out.flush()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            cur.close()
+            q.put(done)
+    worker = threading.Thread(target=_run, daemon=True)
+    worker.start()
+    z = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    finished = False
+    try:
+        while True:
+            chunk = q.get()
+            if chunk is done:
+                finished = True
+                break
+            if z:
+                chunk = z.compress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+        if errors:
+            # 已经发出 200 和部分数据，只能抛出异常让服务器中断分块响应，客户端据此发现导出不完整
+            print(f"[{datetime.datetime.now()}] Export failed: {errors[0]}")
+            raise RuntimeError('导出中断') from errors[0]
+        if z:
+            yield z.flush()
+    finally:
+        if not finished:
+            try:
+                conn.cancel()
+            except Exception:
+                pass
+            while True:
+                try:
+                    if q.get(timeout=0.1) is done:
+                        break
+                except queue.Empty:
+                    if not worker.is_alive():
+                        break
+        worker.join()
+        conn.close()
+
+@app.get('/admin/export/<entity>')
+def admin_export(entity):
+    """流式导出 CSV（带表头，字段按 CSV 规则转义），支持 name/city/idno 客户过滤，gzip=1 时输出 .csv.gz"""
+    if _require_login('admin'):
+        return _require_login('admin')
+    if entity not in EXPORT_QUERIES:
+        return jsonify({'ok': False, 'error': 'invalid_entity'}), 400
+    select_sql, filter_sql = EXPORT_QUERIES[entity]
+    where, params = _customer_filters('c.')
+    sql = select_sql
+    if where:
+        sql += ' WHERE ' + filter_sql.format(cf=' AND '.join(where))
+    compress = request.args.get('gzip') == '1'
+    filename = entity + ('.csv.gz' if compress else '.csv')
+    execute('INSERT INTO admin_activity_log(user_id, action, meta) VALUES(%s,%s,%s)', (session.get('user_id'), 'export', json.dumps({'entity': entity, 'filters': dict(request.args)})))
+    return Response(
+        _stream_copy(sql, tuple(params), compress),
+        mimetype='application/gzip' if compress else 'text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
 
 _sensitive_codes = {}
 
@@ -1418,51 +2022,27 @@ def admin_batch_delete():
     info = _sensitive_codes.get(session.get('user_id'))
     if not info or info['code'] != code or info['exp'] < datetime.datetime.utcnow():
         return jsonify({'ok': False, 'error': 'verify'}), 403
-    if table not in ('branch','employee','customer','account','loan','repayment'):
+    if table not in CASCADE_DELETES:
         return jsonify({'ok': False, 'error': 'invalid_table'}), 400
-    conn = get_conn()
-    cur = conn.cursor()
+    if not isinstance(ids, list) or any(isinstance(i, bool) for i in ids):
+        return jsonify({'ok': False, 'error': 'invalid_params'}), 400
     try:
-        for i in ids:
-            if table == 'branch':
-                cur.execute('SELECT id FROM loan WHERE branch_id=%s', (i,))
-                loan_ids = [row[0] for row in cur.fetchall()]
-                for lid in loan_ids:
-                    cur.execute('DELETE FROM loan_customer WHERE loan_id=%s', (lid,))
-                    cur.execute('DELETE FROM repayment_schedule WHERE loan_id=%s', (lid,))
-                    cur.execute('DELETE FROM repayment WHERE loan_id=%s', (lid,))
-                    cur.execute('DELETE FROM loan WHERE id=%s', (lid,))
-                cur.execute('DELETE FROM branch WHERE id=%s', (i,))
-            elif table == 'customer':
-                cur.execute('SELECT id FROM business WHERE customer_id=%s', (i,))
-                bs_ids = [row[0] for row in cur.fetchall()]
-                for bid_ in bs_ids:
-                    cur.execute('DELETE FROM transaction WHERE business_id=%s', (bid_,))
-                cur.execute('DELETE FROM account_customer WHERE customer_id=%s', (i,))
-                cur.execute('DELETE FROM loan_customer WHERE customer_id=%s', (i,))
-                cur.execute('DELETE FROM business WHERE customer_id=%s', (i,))
-                cur.execute('DELETE FROM user_customer WHERE customer_id=%s', (i,))
-                cur.execute('DELETE FROM customer WHERE id=%s', (i,))
-            else:
-                cur.execute(f'DELETE FROM {table} WHERE id=%s', (i,))
-        conn.commit()
+        ids = sorted({int(i) for i in ids})
+    except (TypeError, ValueError):
+        return jsonify({'ok': False, 'error': 'invalid_params'}), 400
+    if not ids:
         return jsonify({'ok': True})
-    except Exception as e:
-        conn.rollback()
-        if is_db_error(e):
-            s, c, m = map_db_error(e)
-            return jsonify({'ok': False, 'error': m, 'code': c}), s
-        return jsonify({'ok': False, 'error': str(e)}), 400
-    finally:
-        cur.close()
-        conn.close()
+    # 后台任务分批提交，不再是一个事务；中途失败时已删除的部分保留，重新提交同一批 id 会删除剩余部分
+    return _job_accepted('delete', {'table': table, 'ids': ids}, 'batch_delete')
+
+USER_HISTORY_SQL = 'SELECT action, created_at FROM activity_log WHERE user_id=%s ORDER BY id DESC LIMIT 50'
 
 @app.get('/user/history')
 def user_history():
     if _require_login('user'):
         return _require_login('user')
     uid = session.get('user_id')
-    rows = query_all('SELECT action, created_at FROM activity_log WHERE user_id=%s ORDER BY id DESC LIMIT 50', (uid,))
+    rows = query_all(USER_HISTORY_SQL, (uid,))
     return jsonify(rows)
 
 @app.post('/user/change-password')
@@ -1942,19 +2522,14 @@ def user_close_account_request():
             return jsonify({'ok': False, 'error': m, 'code': c}), s
         return jsonify({'ok': False, 'error': str(e)}), 400
 
-@app.get('/user/accounts')
-def list_user_accounts():
-    """列出用户的所有账户"""
-    if _require_login('user'):
-        return _require_login('user')
-    
-    uid = session.get('user_id')
-    customer_row = query_all('SELECT customer_id FROM user_customer WHERE user_id=%s', (uid,))
-    if not customer_row:
-        return jsonify([])
-    
-    customer_id = customer_row[0]['customer_id']
-    rows = query_all("""
+# 用户中心各区块的查询，既供单独接口使用，也供 /user/dashboard 在同一个连接里依次执行
+def _user_customer_id(cur, uid):
+    cur.execute('SELECT customer_id FROM user_customer WHERE user_id=%s', (uid,))
+    row = cur.fetchone()
+    return row['customer_id'] if row else None
+
+def _user_accounts(cur, customer_id):
+    cur.execute("""
         SELECT a.id, a.account_no, a.balance, a.type, a.created_at,
                sa.interest_rate, ca.overdraft_limit
         FROM account a
@@ -1964,58 +2539,133 @@ def list_user_accounts():
         WHERE ac.customer_id = %s
         ORDER BY a.id
     """, (customer_id,))
-    
-    return jsonify(rows)
+    return cur.fetchall()
 
-@app.get('/user/savings-accounts')
-def list_user_savings_accounts():
-    if _require_login('user'):
-        return _require_login('user')
-    uid = session.get('user_id')
-    customer_row = query_all('SELECT customer_id FROM user_customer WHERE user_id=%s', (uid,))
-    if not customer_row:
-        return jsonify([])
-    customer_id = customer_row[0]['customer_id']
-    rows = query_all("""
+def _user_savings_accounts(cur, customer_id):
+    cur.execute("""
         SELECT a.id, a.account_no, a.balance
         FROM account a
         JOIN account_customer ac ON a.id = ac.account_id
         WHERE ac.customer_id = %s AND a.type = 'savings' AND (a.closed_at IS NULL)
         ORDER BY a.id
     """, (customer_id,))
-    return jsonify(rows)
+    return cur.fetchall()
 
-@app.get('/user/loans/open')
-def list_user_open_loans():
-    if _require_login('user'):
-        return _require_login('user')
-    uid = session.get('user_id')
-    customer_row = query_all('SELECT customer_id FROM user_customer WHERE user_id=%s', (uid,))
-    if not customer_row:
-        return jsonify([])
-    customer_id = customer_row[0]['customer_id']
-    loans = query_all("""
-        SELECT l.id, l.loan_no, l.amount, l.status, l.end_date, l.interest_rate, l.start_date
+def _user_open_loans(cur, customer_id):
+    """未结清贷款及剩余应还金额，已还金额在同一条查询中按贷款汇总"""
+    cur.execute("""
+        SELECT l.id, l.loan_no, l.amount, l.status, l.end_date, l.interest_rate, l.start_date,
+               COALESCE(r.total, 0) AS repaid_total
         FROM loan l
         JOIN loan_customer lc ON l.id = lc.loan_id
+        LEFT JOIN (
+            SELECT loan_id, SUM(amount) AS total FROM repayment
+            WHERE loan_id IN (SELECT loan_id FROM loan_customer WHERE customer_id = %s)
+            GROUP BY loan_id
+        ) r ON r.loan_id = l.id
         WHERE lc.customer_id = %s AND l.status <> 'SETTLED'
         ORDER BY l.id
-    """, (customer_id,))
+    """, (customer_id, customer_id))
     result = []
-    for l in loans:
+    for l in cur.fetchall():
         days = 0
         if l.get('start_date'):
             days = max((datetime.date.today() - l['start_date']).days, 0)
         rate = float(l.get('interest_rate') or 0)
         principal = float(l['amount'])
         accrued = round(principal * rate * days / 365.0, 2)
-        repaid_rows = query_all('SELECT COALESCE(SUM(amount),0) AS total FROM repayment WHERE loan_id=%s', (l['id'],))
-        repaid_total = float(repaid_rows[0]['total']) if repaid_rows and repaid_rows[0] else 0.0
-        remain = round(principal + accrued - repaid_total, 2)
+        remain = round(principal + accrued - float(l['repaid_total']), 2)
         if remain < 0:
             remain = 0.0
         result.append({'loan_id': l['id'], 'loan_no': l['loan_no'], 'principal_amount': round(principal,2), 'remaining_amount': remain, 'end_date': l.get('end_date')})
-    return jsonify(result)
+    return result
+
+def _user_transactions(cur, customer_id):
+    cur.execute("""
+        SELECT t.id, t.txn_type, t.amount, t.balance_after, t.created_at, t.remark,
+               a.account_no
+        FROM transaction t
+        JOIN account a ON t.account_id = a.id
+        JOIN account_customer ac ON a.id = ac.account_id
+        WHERE ac.customer_id = %s
+        ORDER BY t.created_at DESC
+        LIMIT 50
+    """, (customer_id,))
+    return cur.fetchall()
+
+def _user_section(fn):
+    """以当前登录用户的客户身份执行单个区块查询，未绑定客户时返回空列表"""
+    conn = get_conn()
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        customer_id = _user_customer_id(cur, session.get('user_id'))
+        return jsonify(fn(cur, customer_id) if customer_id else [])
+    finally:
+        cur.close(); conn.close()
+
+@app.get('/user/accounts')
+def list_user_accounts():
+    """列出用户的所有账户"""
+    if _require_login('user'):
+        return _require_login('user')
+    return _user_section(_user_accounts)
+
+@app.get('/user/savings-accounts')
+def list_user_savings_accounts():
+    if _require_login('user'):
+        return _require_login('user')
+    return _user_section(_user_savings_accounts)
+
+@app.get('/user/loans/open')
+def list_user_open_loans():
+    if _require_login('user'):
+        return _require_login('user')
+    return _user_section(_user_open_loans)
+
+USER_PROFILE_SQL = """
+    SELECT u.id, u.username, u.role, u.created_at, u.last_login_at, uc.customer_id
+    FROM app_user u
+    LEFT JOIN user_customer uc ON uc.user_id = u.id
+    WHERE u.id = %s
+"""
+
+@app.get('/user/dashboard')
+def user_dashboard():
+    """用户中心首屏数据：个人信息、账户、交易、操作记录、未结清贷款、储蓄账户，一个只读快照内查询完成"""
+    if _require_login('user'):
+        return _require_login('user')
+    uid = session.get('user_id')
+    conn = get_conn()
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        cur.execute(USER_PROFILE_SQL, (uid,))
+        me = cur.fetchone() or {}
+        customer_id = me.pop('customer_id', None)
+        cur.execute(USER_HISTORY_SQL, (uid,))
+        history = cur.fetchall()
+        result = {'ok': True, 'me': me, 'history': history, 'accounts': [], 'transactions': [],
+                  'open_loans': [], 'savings_accounts': []}
+        if customer_id:
+            result['accounts'] = _user_accounts(cur, customer_id)
+            result['transactions'] = _user_transactions(cur, customer_id)
+            result['open_loans'] = _user_open_loans(cur, customer_id)
+            result['savings_accounts'] = _user_savings_accounts(cur, customer_id)
+        conn.rollback()
+        return jsonify(result)
+    except Exception as e:
+        conn.rollback()
+        if is_db_error(e):
+            s, c, m = map_db_error(e)
+            return jsonify({'ok': False, 'error': m, 'code': c}), s
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    finally:
+        cur.close(); conn.close()
+
+LOAN_OWNED_SQL = 'SELECT 1 FROM loan_customer WHERE loan_id=%s AND customer_id=%s'
+ACCOUNT_OWNED_SQL = 'SELECT 1 FROM account_customer WHERE account_id=%s AND customer_id=%s'
+LOAN_SCHEDULE_SQL = 'SELECT period_no, due_date, principal_due, interest_due, status FROM repayment_schedule WHERE loan_id=%s ORDER BY period_no'
+LOAN_REPAID_SQL = 'SELECT COALESCE(SUM(amount),0) FROM repayment WHERE loan_id=%s'
 
 @app.get('/user/loan/<int:loan_id>/schedule')
 def get_user_loan_schedule(loan_id):
@@ -2026,10 +2676,10 @@ def get_user_loan_schedule(loan_id):
     if not customer_row:
         return jsonify([])
     customer_id = customer_row[0]['customer_id']
-    owned = query_all('SELECT 1 FROM loan_customer WHERE loan_id=%s AND customer_id=%s', (loan_id, customer_id))
+    owned = query_all(LOAN_OWNED_SQL, (loan_id, customer_id))
     if not owned:
         return jsonify([])
-    rows = query_all('SELECT period_no, due_date, principal_due, interest_due, status FROM repayment_schedule WHERE loan_id=%s ORDER BY period_no', (loan_id,))
+    rows = query_all(LOAN_SCHEDULE_SQL, (loan_id,))
     return jsonify(rows)
 
 @app.get('/user/loan/<int:loan_id>/repayments')
@@ -2041,7 +2691,7 @@ def get_user_loan_repayments(loan_id):
     if not customer_row:
         return jsonify([])
     customer_id = customer_row[0]['customer_id']
-    owned = query_all('SELECT 1 FROM loan_customer WHERE loan_id=%s AND customer_id=%s', (loan_id, customer_id))
+    owned = query_all(LOAN_OWNED_SQL, (loan_id, customer_id))
     if not owned:
         return jsonify([])
     rows = query_all("""
@@ -2085,13 +2735,13 @@ def user_repay():
         acc = cur.fetchone()
         if not acc or acc['type'] != 'savings' or acc.get('closed_at'):
             raise Exception('invalid_account')
-        cur.execute('SELECT 1 FROM account_customer WHERE account_id=%s AND customer_id=%s', (savings_account_id, customer_id))
+        cur.execute(ACCOUNT_OWNED_SQL, (savings_account_id, customer_id))
         if not cur.fetchone():
             raise Exception('not_owner')
         cur.execute('SELECT 1 FROM savings_account WHERE account_id=%s', (savings_account_id,))
         if not cur.fetchone():
             raise Exception('invalid_account')
-        cur.execute('SELECT 1 FROM loan_customer WHERE loan_id=%s AND customer_id=%s', (loan_id, customer_id))
+        cur.execute(LOAN_OWNED_SQL, (loan_id, customer_id))
         if not cur.fetchone():
             raise Exception('not_owner')
         cur.execute('SELECT id, amount, status, interest_rate, start_date FROM loan WHERE id=%s FOR UPDATE', (loan_id,))
@@ -2106,7 +2756,7 @@ def user_repay():
         rate = float(loan_row.get('interest_rate') or 0)
         principal = float(loan_row['amount'])
         accrued = round(principal * rate * days / 365.0, 2)
-        cur.execute('SELECT COALESCE(SUM(amount),0) FROM repayment WHERE loan_id=%s', (loan_id,))
+        cur.execute(LOAN_REPAID_SQL, (loan_id,))
         repaid_total = float(cur.fetchone()[0] or 0.0)
         outstanding = round(principal + accrued - repaid_total, 2)
         pay = round(float(amount), 2)
@@ -2185,46 +2835,102 @@ def list_user_transactions():
     """列出用户的交易记录"""
     if _require_login('user'):
         return _require_login('user')
-    
-    uid = session.get('user_id')
-    customer_row = query_all('SELECT customer_id FROM user_customer WHERE user_id=%s', (uid,))
-    if not customer_row:
-        return jsonify([])
-    
-    customer_id = customer_row[0]['customer_id']
-    rows = query_all("""
-        SELECT t.id, t.txn_type, t.amount, t.balance_after, t.created_at, t.remark,
-               a.account_no
-        FROM transaction t
-        JOIN account a ON t.account_id = a.id
-        JOIN account_customer ac ON a.id = ac.account_id
-        WHERE ac.customer_id = %s
-        ORDER BY t.created_at DESC
-        LIMIT 50
-    """, (customer_id,))
-    
-    return jsonify(rows)
+    return _user_section(_user_transactions)
+
+DASHBOARD_PENDING_LIMIT = 10
+DASHBOARD_ACTIVITY_LIMIT = 20
+DASHBOARD_PENDING_SQL = '''
+    SELECT b.id AS business_id, b.customer_id, b.remark, b.created_at, c.name AS customer_name,
+           COUNT(*) OVER () AS total
+    FROM business b
+    JOIN customer c ON b.customer_id = c.id
+    WHERE b.business_type = 'CLOSE_ACCOUNT' AND b.status = 'PENDING'
+    ORDER BY b.created_at DESC
+    LIMIT %s
+'''
+
+@app.get('/admin/dashboard/summary')
+def admin_dashboard_summary():
+    """管理后台首页概览：实体数量、待审批、贷款汇总、最近操作，一个只读快照内查询完成"""
+    if _require_login('admin'):
+        return _require_login('admin')
+    conn = get_conn()
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        cur.execute('SELECT table_name, SUM(row_count) AS total FROM entity_row_count GROUP BY table_name')
+        counts = {r['table_name']: int(r['total']) for r in cur.fetchall()}
+        cur.execute(DASHBOARD_PENDING_SQL, (DASHBOARD_PENDING_LIMIT,))
+        pending = cur.fetchall()
+        cur.execute('''
+            SELECT status, SUM(loan_count) AS loan_count, SUM(principal) AS principal, SUM(repaid) AS repaid
+            FROM branch_loan_portfolio
+            GROUP BY status
+            ORDER BY status
+        ''')
+        loans = cur.fetchall()
+        cur.execute('''
+            SELECT l.id, l.action, l.meta, l.created_at, u.username
+            FROM admin_activity_log l
+            LEFT JOIN admin_user u ON u.id = l.user_id
+            ORDER BY l.id DESC
+            LIMIT %s
+        ''', (DASHBOARD_ACTIVITY_LIMIT,))
+        activity = cur.fetchall()
+        conn.rollback()
+    except Exception as e:
+        conn.rollback()
+        if is_db_error(e):
+            s, c, m = map_db_error(e)
+            return jsonify({'ok': False, 'error': m, 'code': c}), s
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    finally:
+        cur.close(); conn.close()
+    pending_total = int(pending[0]['total']) if pending else 0
+    for p in pending:
+        del p['total']
+    return jsonify({
+        'ok': True,
+        'counts': {
+            'branches': counts.get('branch', 0),
+            'employees': counts.get('employee', 0),
+            'customers': counts.get('customer', 0),
+            'accounts': counts.get('account', 0),
+            'loans': counts.get('loan', 0)
+        },
+        'pending_approvals': {'total': pending_total, 'items': pending},
+        'loans': {
+            'by_status': loans,
+            'loan_count': sum(int(r['loan_count']) for r in loans),
+            'principal': sum(r['principal'] for r in loans),
+            'repaid': sum(r['repaid'] for r in loans)
+        },
+        'recent_activity': activity
+    })
+
+# 条件与排序对应部分索引 idx_account_closed_at
+CLOSED_ACCOUNTS_SQL = '''
+    SELECT a.id, a.account_no, a.closed_at,
+           EXTRACT(EPOCH FROM (NOW() - a.closed_at))/3600 as survive_hours
+    FROM account a
+    WHERE a.type = 'closed' AND a.closed_at IS NOT NULL
+    ORDER BY a.closed_at DESC
+'''
 
 @app.get('/admin/closed-accounts')
 def admin_get_closed_accounts():
-    """获取已关闭账户列表及存活时间信息"""
+    """获取已关闭账户列表及存活时间信息（超过保留期的账户会被归档移出主表）"""
     if _require_login('admin'):
         return _require_login('admin')
     
     try:
-        rows = query_all('''
-            SELECT a.id, a.account_no, a.closed_at,
-                   EXTRACT(EPOCH FROM (NOW() - a.closed_at))/3600 as survive_hours
-            FROM account a
-            WHERE a.type = 'closed' AND a.closed_at IS NOT NULL
-            ORDER BY a.closed_at DESC
-        ''')
+        rows = query_all(CLOSED_ACCOUNTS_SQL)
         
         # 处理数据格式
         result = []
         for row in rows:
             survive_hours = row['survive_hours']
-            status = '待清理' if survive_hours > 24 else '保留中'
+            status = '待归档' if survive_hours > CLOSED_ACCOUNT_RETENTION_HOURS else '保留中'
             
             result.append({
                 'id': row['id'],
@@ -2239,6 +2945,14 @@ def admin_get_closed_accounts():
         print(f"获取已关闭账户列表失败: {e}")  # 添加日志以便调试
         return jsonify([]), 500
 
+PENDING_CLOSE_ACCOUNTS_SQL = '''
+    SELECT b.id as business_id, b.customer_id, b.remark, b.created_at, c.name as customer_name
+    FROM business b
+    JOIN customer c ON b.customer_id = c.id
+    WHERE b.business_type = 'CLOSE_ACCOUNT' AND b.status = 'PENDING'
+    ORDER BY b.created_at DESC
+'''
+
 @app.get('/admin/pending-close-accounts')
 def admin_get_pending_close_accounts():
     """获取待审批的账户注销申请"""
@@ -2246,13 +2960,7 @@ def admin_get_pending_close_accounts():
         return _require_login('admin')
     
     try:
-        rows = query_all('''
-            SELECT b.id as business_id, b.customer_id, b.remark, b.created_at, c.name as customer_name
-            FROM business b
-            JOIN customer c ON b.customer_id = c.id
-            WHERE b.business_type = 'CLOSE_ACCOUNT' AND b.status = 'PENDING'
-            ORDER BY b.created_at DESC
-        ''')
+        rows = query_all(PENDING_CLOSE_ACCOUNTS_SQL)
         
         return jsonify(rows)
     except Exception as e:
@@ -2344,18 +3052,668 @@ def admin_approve_close_account():
             return jsonify({'ok': False, 'error': m, 'code': c}), s
         return jsonify({'ok': False, 'error': str(e)}), 400
 
+# 逾期批处理：按贷款ID区间分块，每块一个短事务，只读 loan 表，不对 loan 加行锁
+DELINQUENCY_CHUNK_SIZE = int(os.getenv('DELINQUENCY_CHUNK_SIZE', '5000'))
+DELINQUENCY_RUN_HOUR = int(os.getenv('DELINQUENCY_RUN_HOUR', '1'))
+DELINQUENCY_LOAN_STATUSES = ['APPROVED', 'DISBURSED']
+DELINQUENCY_LOCK_KEY = 726001
+
+def _delinquency_chunk(cur, as_of, lo, hi):
+    """处理贷款ID在 [lo, hi) 区间内的还款计划，返回 (更新期次数, 逾期贷款数)"""
+    cur.execute('DELETE FROM loan_delinquency WHERE loan_id >= %s AND loan_id < %s', (lo, hi))
+    # 按累计应还与累计已还比较判断每期状态：已还清为PAID，到期未还清为OVERDUE，其余为DUE
+    cur.execute("""
+        WITH paid AS (
+            SELECT loan_id, SUM(amount) AS total
+            FROM repayment
+            WHERE loan_id >= %(lo)s AND loan_id < %(hi)s
+            GROUP BY loan_id
+        ), sched AS (
+            SELECT s.id, s.loan_id, l.branch_id, s.due_date,
+                   SUM(s.principal_due + s.interest_due) OVER (PARTITION BY s.loan_id ORDER BY s.period_no) AS cum_due,
+                   COALESCE(p.total, 0) AS repaid
+            FROM repayment_schedule s
+            JOIN loan l ON l.id = s.loan_id
+            LEFT JOIN paid p ON p.loan_id = s.loan_id
+            WHERE s.loan_id >= %(lo)s AND s.loan_id < %(hi)s AND l.status = ANY(%(statuses)s)
+        ), marked AS (
+            SELECT id, loan_id, branch_id, due_date, cum_due, repaid,
+                   CASE WHEN cum_due <= repaid THEN 'PAID'
+                        WHEN due_date < %(as_of)s THEN 'OVERDUE'
+                        ELSE 'DUE' END AS new_status
+            FROM sched
+        ), upd AS (
+            UPDATE repayment_schedule rs SET status = m.new_status
+            FROM marked m
+            WHERE rs.id = m.id AND rs.status <> m.new_status
+            RETURNING rs.id
+        ), overdue AS (
+            SELECT loan_id, branch_id, %(as_of)s::date - MIN(due_date) AS dpd,
+                   COUNT(*) AS periods, MAX(cum_due) - MAX(repaid) AS amount
+            FROM marked
+            WHERE new_status = 'OVERDUE'
+            GROUP BY loan_id, branch_id
+        ), ins AS (
+            INSERT INTO loan_delinquency(loan_id, branch_id, days_past_due, bucket, overdue_periods, overdue_amount, as_of_date)
+            SELECT loan_id, branch_id, dpd,
+                   CASE WHEN dpd <= 30 THEN '1-30'
+                        WHEN dpd <= 60 THEN '31-60'
+                        WHEN dpd <= 90 THEN '61-90'
+                        ELSE '90+' END,
+                   periods, amount, %(as_of)s
+            FROM overdue
+            RETURNING loan_id
+        )
+        SELECT (SELECT COUNT(*) FROM upd), (SELECT COUNT(*) FROM ins)
+    """, {'lo': lo, 'hi': hi, 'as_of': as_of, 'statuses': DELINQUENCY_LOAN_STATUSES})
+    return cur.fetchone()
+
+def run_delinquency_batch(as_of=None, force=False, chunk_size=None, ctx=None):
+    """
+    逾期批处理
+    1. 按贷款ID区间分块标记还款计划的 PAID/OVERDUE/DUE 状态
+    2. 计算每笔贷款的逾期天数及逾期档位，写入 loan_delinquency
+    3. 汇总写入 branch_delinquency_summary
+    每块完成后在同一事务中记录断点，中断后再次运行会从断点继续。
+    作为后台任务运行时传入 ctx：登记连接供取消中断，每块之间检查取消，异常交给任务框架处理
+    """
+    as_of = as_of or datetime.date.today()
+    chunk_size = chunk_size or DELINQUENCY_CHUNK_SIZE
+    conn = begin_transaction()
+    cur = conn.cursor()
+    try:
+        if ctx is not None:
+            ctx.attach(conn)
+        cur.execute('SELECT pg_try_advisory_lock(%s)', (DELINQUENCY_LOCK_KEY,))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return {'ok': False, 'error': 'running'}
+        try:
+            cur.execute('SELECT status, last_loan_id FROM delinquency_run WHERE as_of_date=%s', (as_of,))
+            row = cur.fetchone()
+            if row and row[0] == 'DONE' and not force:
+                conn.rollback()
+                return {'ok': True, 'skipped': True, 'as_of': as_of.isoformat()}
+            if row and not force:
+                start_id = row[1]
+                cur.execute("UPDATE delinquency_run SET status='RUNNING', error=NULL WHERE as_of_date=%s", (as_of,))
+            else:
+                start_id = 0
+                cur.execute("""
+                    INSERT INTO delinquency_run(as_of_date, status, last_loan_id) VALUES(%s, 'RUNNING', 0)
+                    ON CONFLICT (as_of_date) DO UPDATE SET status='RUNNING', last_loan_id=0, schedules_updated=0,
+                        loans_overdue=0, started_at=NOW(), finished_at=NULL, error=NULL
+                """, (as_of,))
+            cur.execute('SELECT COALESCE(MAX(id), 0) FROM loan')
+            max_id = cur.fetchone()[0]
+            conn.commit()
+            lo = start_id + 1
+            while lo <= max_id:
+                hi = lo + chunk_size
+                cur.execute("SET LOCAL lock_timeout = '5s'")
+                updated, overdue = _delinquency_chunk(cur, as_of, lo, hi)
+                cur.execute("""
+                    UPDATE delinquency_run
+                    SET last_loan_id=%s, schedules_updated=schedules_updated+%s, loans_overdue=loans_overdue+%s
+                    WHERE as_of_date=%s
+                """, (hi - 1, updated, overdue, as_of))
+                conn.commit()
+                lo = hi
+                if ctx is not None:
+                    ctx.progress(min(lo - 1, max_id), max_id)
+            cur.execute('DELETE FROM branch_delinquency_summary WHERE as_of_date=%s', (as_of,))
+            cur.execute("""
+                INSERT INTO branch_delinquency_summary(as_of_date, branch_id, bucket, loan_count, overdue_amount)
+                SELECT %s, branch_id, bucket, COUNT(*), SUM(overdue_amount)
+                FROM loan_delinquency
+                GROUP BY branch_id, bucket
+            """, (as_of,))
+            cur.execute("UPDATE delinquency_run SET status='DONE', finished_at=NOW() WHERE as_of_date=%s RETURNING schedules_updated, loans_overdue", (as_of,))
+            updated, overdue = cur.fetchone()
+            conn.commit()
+            print(f"[{datetime.datetime.now()}] Delinquency batch {as_of} done: {updated} schedules updated, {overdue} loans overdue")
+            return {'ok': True, 'as_of': as_of.isoformat(), 'schedules_updated': updated, 'loans_overdue': overdue}
+        finally:
+            try:
+                conn.rollback()
+                cur.execute('SELECT pg_advisory_unlock(%s)', (DELINQUENCY_LOCK_KEY,))
+                conn.commit()
+            except Exception:
+                pass
+    except Exception as e:
+        print(f"[{datetime.datetime.now()}] Error running delinquency batch: {e}")
+        try:
+            execute("UPDATE delinquency_run SET status='FAILED', error=%s WHERE as_of_date=%s",
+                    ('cancelled' if isinstance(e, JobCancelled) else str(e), as_of))
+        except Exception:
+            pass
+        if ctx is not None:
+            raise
+        return {'ok': False, 'error': str(e)}
+    finally:
+        cur.close()
+        conn.close()
+
+def delinquency_scheduler():
+    """每天 DELINQUENCY_RUN_HOUR 点执行一次逾期批处理"""
+    while True:
+        now = datetime.datetime.now()
+        nxt = now.replace(hour=DELINQUENCY_RUN_HOUR, minute=0, second=0, microsecond=0)
+        if nxt <= now:
+            nxt += datetime.timedelta(days=1)
+        time.sleep((nxt - now).total_seconds())
+        run_delinquency_batch()
+
+@app.post('/admin/delinquency/run')
+def admin_run_delinquency():
+    """手动触发逾期批处理（后台任务执行）"""
+    if _require_login('admin'):
+        return _require_login('admin')
+    data = request.get_json(silent=True) or {}
+    as_of = data.get('as_of')
+    try:
+        as_of = datetime.date.fromisoformat(as_of) if as_of else datetime.date.today()
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'invalid_date'}), 400
+    force = bool(data.get('force'))
+    return _job_accepted('delinquency', {'as_of': as_of.isoformat(), 'force': force}, 'delinquency_run')
+
+@app.get('/admin/delinquency/summary')
+def admin_delinquency_summary():
+    """获取逾期批处理运行状态及分行逾期汇总"""
+    if _require_login('admin'):
+        return _require_login('admin')
+    as_of = request.args.get('as_of')
+    if as_of:
+        runs = query_all('SELECT * FROM delinquency_run WHERE as_of_date=%s', (as_of,))
+    else:
+        runs = query_all('SELECT * FROM delinquency_run ORDER BY as_of_date DESC LIMIT 1')
+    if not runs:
+        return jsonify({'run': None, 'branches': []})
+    run = runs[0]
+    rows = query_all("""
+        SELECT s.branch_id, b.union_no, b.name, s.bucket, s.loan_count, s.overdue_amount
+        FROM branch_delinquency_summary s
+        JOIN branch b ON b.id = s.branch_id
+        WHERE s.as_of_date = %s
+        ORDER BY s.branch_id, s.bucket
+    """, (run['as_of_date'],))
+    return jsonify({'run': run, 'branches': rows})
+
+# 后台任务队列
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_POLL_INTERVAL = 2
+JOB_HEARTBEAT_INTERVAL = 30
+JOB_STALE_SECONDS = 300
+JOB_DELETE_CHUNK = 500
+JOB_DELETE_ROWS = 5000
+JOB_LIST_LIMIT = 50
+JOB_HANDLERS = {}
+
+class JobCancelled(Exception):
+    pass
+
+class JobContext:
+    """传给任务处理函数：上报进度、检查取消、登记正在执行 SQL 的连接以便取消时中断"""
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def attach(self, conn):
+        execute('UPDATE job SET backend_pid=%s WHERE id=%s', (conn.get_backend_pid(), self.job_id))
+
+    def progress(self, done, total=None, message=None):
+        rows = execute_returning('''
+            UPDATE job SET progress_done=%s, progress_total=COALESCE(%s, progress_total),
+                           progress_message=COALESCE(%s, progress_message), heartbeat_at=NOW()
+            WHERE id=%s
+            RETURNING cancel_requested
+        ''', (done, total, message, self.job_id))
+        if rows and rows[0]['cancel_requested']:
+            raise JobCancelled()
+
+    def check(self):
+        rows = query_all('SELECT cancel_requested FROM job WHERE id=%s', (self.job_id,))
+        if rows and rows[0]['cancel_requested']:
+            raise JobCancelled()
+
+def job_handler(kind):
+    """注册任务处理函数，处理函数签名为 fn(ctx, params)，返回值写入 job.result"""
+    def wrap(fn):
+        JOB_HANDLERS[kind] = fn
+        return fn
+    return wrap
+
+def enqueue_job(kind, params=None, user_id=None):
+    """写入一条排队任务并返回任务 id"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(kind)
+    rows = execute_returning(
+        'INSERT INTO job(kind, params, created_by) VALUES(%s,%s,%s) RETURNING id',
+        (kind, json.dumps(params or {}), user_id)
+    )
+    return rows[0]['id']
+
+def _job_accepted(kind, params=None, action=None):
+    """请求线程里入队并立即返回 202，供耗时的管理接口复用"""
+    try:
+        job_id = enqueue_job(kind, params, session.get('user_id'))
+        execute('INSERT INTO admin_activity_log(user_id, action, meta) VALUES(%s,%s,%s)', (session.get('user_id'), action or kind, json.dumps({'job_id': job_id, 'params': params})))
+        return jsonify({'ok': True, 'job_id': job_id}), 202
+    except Exception as e:
+        if is_db_error(e):
+            s, c, m = map_db_error(e)
+            return jsonify({'ok': False, 'error': m, 'code': c}), s
+        return jsonify({'ok': False, 'error': '任务提交失败'}), 500
+
+def _claim_job():
+    rows = execute_returning('''
+        UPDATE job SET status='RUNNING', started_at=NOW(), heartbeat_at=NOW()
+        WHERE id = (
+            SELECT id FROM job WHERE status='QUEUED' ORDER BY id
+            FOR UPDATE SKIP LOCKED LIMIT 1
+        )
+        RETURNING id, kind, params
+    ''')
+    return rows[0] if rows else None
+
+def _job_heartbeat(job_id, stop):
+    while not stop.wait(JOB_HEARTBEAT_INTERVAL):
+        try:
+            execute('UPDATE job SET heartbeat_at=NOW() WHERE id=%s', (job_id,))
+        except Exception:
+            pass
+
+def _finish_job(job_id, status, result=None, error=None):
+    execute('''
+        UPDATE job SET status=%s, result=%s, error=%s, finished_at=NOW(), backend_pid=NULL
+        WHERE id=%s
+    ''', (status, json.dumps(result, default=str) if result is not None else None, error, job_id))
+
+def _run_job(job):
+    ctx = JobContext(job['id'])
+    stop = threading.Event()
+    threading.Thread(target=_job_heartbeat, args=(job['id'], stop), daemon=True).start()
+    try:
+        ctx.check()
+        result = JOB_HANDLERS[job['kind']](ctx, job['params'] or {})
+        if isinstance(result, dict) and result.get('ok') is False:
+            _finish_job(job['id'], 'FAILED', result, result.get('error'))
+        else:
+            _finish_job(job['id'], 'SUCCEEDED', result)
+    except JobCancelled:
+        _finish_job(job['id'], 'CANCELLED')
+    except Exception as e:
+        # 取消接口会对登记的连接执行 pg_cancel_backend，此时语句报错按取消处理
+        cancelled = query_all('SELECT cancel_requested FROM job WHERE id=%s', (job['id'],))
+        if cancelled and cancelled[0]['cancel_requested']:
+            _finish_job(job['id'], 'CANCELLED')
+        else:
+            print(f"[{datetime.datetime.now()}] Job {job['id']} ({job['kind']}) failed: {e}")
+            _finish_job(job['id'], 'FAILED', error=str(e))
+    finally:
+        stop.set()
+
+def job_worker():
+    """任务工作线程：领取排队任务执行，并回收心跳超时（进程退出遗留）的任务"""
+    while True:
+        try:
+            execute('''
+                UPDATE job SET status='FAILED', error='worker_lost', finished_at=NOW(), backend_pid=NULL
+                WHERE status='RUNNING' AND heartbeat_at < NOW() - make_interval(secs => %s)
+            ''', (JOB_STALE_SECONDS,))
+            job = _claim_job()
+        except Exception as e:
+            print(f"[{datetime.datetime.now()}] Job worker error: {e}")
+            job = None
+        if job is None:
+            time.sleep(JOB_POLL_INTERVAL)
+            continue
+        _run_job(job)
+
+# 数量可能很大的子行：每次最多删除一批并返回删除数，反复调用直到返回 0，再由 CASCADE_DELETES 删除其余关联和主表行
+def _prune_branch_loans(cur, ids):
+    cur.execute('SELECT id FROM loan WHERE branch_id = ANY(%s::bigint[]) ORDER BY id LIMIT %s', (ids, JOB_DELETE_CHUNK))
+    loan_ids = [row[0] for row in cur.fetchall()]
+    if loan_ids:
+        _delete_loans(cur, loan_ids)
+    return len(loan_ids)
+
+def _prune_customer_transactions(cur, ids):
+    cur.execute('''
+        DELETE FROM transaction WHERE id IN (
+            SELECT t.id FROM transaction t JOIN business b ON t.business_id = b.id
+            WHERE b.customer_id = ANY(%s::bigint[]) LIMIT %s
+        )
+    ''', (ids, JOB_DELETE_ROWS))
+    return cur.rowcount
+
+def _prune_account_transactions(cur, ids):
+    cur.execute('''
+        DELETE FROM transaction WHERE id IN (
+            SELECT id FROM transaction WHERE account_id = ANY(%s::bigint[]) LIMIT %s
+        )
+    ''', (ids, JOB_DELETE_ROWS))
+    return cur.rowcount
+
+def _prune_loan_repayments(cur, ids):
+    cur.execute('''
+        DELETE FROM repayment WHERE id IN (
+            SELECT id FROM repayment WHERE loan_id = ANY(%s::bigint[]) LIMIT %s
+        )
+    ''', (ids, JOB_DELETE_ROWS))
+    return cur.rowcount
+
+JOB_CHILD_PRUNES = {
+    'branch': _prune_branch_loans,
+    'customer': _prune_customer_transactions,
+    'account': _prune_account_transactions,
+    'loan': _prune_loan_repayments
+}
+
+@job_handler('delete')
+def _job_delete(ctx, params):
+    """
+    级联删除按 JOB_DELETE_CHUNK 个主表 id 分批，每批内先按 JOB_DELETE_ROWS 行分批删除大量子行，每次提交后可取消。
+    整个删除不是一个事务：失败或取消时已提交的批次保留，用同样的参数重新提交即可继续删除剩余部分
+    """
+    table = params.get('table')
+    ids = sorted({int(i) for i in params.get('ids') or []})
+    prune = JOB_CHILD_PRUNES.get(table)
+    conn = begin_transaction()
+    cur = conn.cursor()
+    ctx.attach(conn)
+    done = 0
+    try:
+        for start in range(0, len(ids), JOB_DELETE_CHUNK):
+            chunk = ids[start:start + JOB_DELETE_CHUNK]
+            while prune is not None and prune(cur, chunk):
+                conn.commit()
+                ctx.check()
+            CASCADE_DELETES[table](cur, chunk)
+            conn.commit()
+            done += len(chunk)
+            ctx.progress(done, len(ids))
+        return {'table': table, 'deleted': done}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close(); conn.close()
+
+def _job_sql(ctx, sql):
+    conn = get_conn()
+    cur = conn.cursor()
+    ctx.attach(conn)
+    try:
+        cur.execute(sql)
+        conn.commit()
+    finally:
+        cur.close(); conn.close()
+
+@job_handler('search_rebuild')
+def _job_search_rebuild(ctx, params):
+    _job_sql(ctx, 'SELECT rebuild_search_document()')
+
+@job_handler('portfolio_rebuild')
+def _job_portfolio_rebuild(ctx, params):
+    _job_sql(ctx, 'SELECT rebuild_branch_loan_portfolio()')
+
+@job_handler('migrate')
+def _job_migrate(ctx, params):
+    return {'applied': migrate()}
+
+@job_handler('delinquency')
+def _job_delinquency(ctx, params):
+    as_of = datetime.date.fromisoformat(params['as_of']) if params.get('as_of') else None
+    return run_delinquency_batch(as_of, bool(params.get('force')), ctx=ctx)
+
+def _job_row(row):
+    return {k: row[k] for k in ('id', 'kind', 'params', 'status', 'progress_done', 'progress_total',
+                                 'progress_message', 'result', 'error', 'cancel_requested', 'created_by',
+                                 'created_at', 'started_at', 'finished_at')}
+
+@app.get('/admin/jobs')
+def admin_list_jobs():
+    """最近的后台任务，可按 status 过滤"""
+    if _require_login('admin'):
+        return _require_login('admin')
+    status = request.args.get('status')
+    if status:
+        rows = query_all('SELECT * FROM job WHERE status=%s ORDER BY id DESC LIMIT %s', (status, JOB_LIST_LIMIT))
+    else:
+        rows = query_all('SELECT * FROM job ORDER BY id DESC LIMIT %s', (JOB_LIST_LIMIT,))
+    return jsonify([_job_row(r) for r in rows])
+
+@app.get('/admin/jobs/<int:job_id>')
+def admin_get_job(job_id):
+    if _require_login('admin'):
+        return _require_login('admin')
+    rows = query_all('SELECT * FROM job WHERE id=%s', (job_id,))
+    if not rows:
+        return jsonify({'ok': False, 'error': 'not_found'}), 404
+    return jsonify(_job_row(rows[0]))
+
+@app.post('/admin/jobs/<int:job_id>/cancel')
+def admin_cancel_job(job_id):
+    """排队中的任务直接取消；执行中的任务打上取消标记并中断其正在执行的语句"""
+    if _require_login('admin'):
+        return _require_login('admin')
+    rows = execute_returning('''
+        UPDATE job SET cancel_requested=TRUE,
+               status=CASE WHEN status='QUEUED' THEN 'CANCELLED' ELSE status END,
+               finished_at=CASE WHEN status='QUEUED' THEN NOW() ELSE finished_at END
+        WHERE id=%s AND status IN ('QUEUED', 'RUNNING')
+        RETURNING status, backend_pid
+    ''', (job_id,))
+    if not rows:
+        return jsonify({'ok': False, 'error': 'not_cancellable'}), 409
+    if rows[0]['status'] == 'RUNNING' and rows[0]['backend_pid']:
+        query_all('SELECT pg_cancel_backend(%s) AS cancelled', (rows[0]['backend_pid'],))
+    execute('INSERT INTO admin_activity_log(user_id, action, meta) VALUES(%s,%s,%s)', (session.get('user_id'), 'job_cancel', json.dumps({'job_id': job_id})))
+    return jsonify({'ok': True, 'status': rows[0]['status']})
+
+def start_job_workers():
+    for _ in range(JOB_WORKERS):
+        threading.Thread(target=job_worker, daemon=True).start()
+
+# 活动日志按天分区，整分区 DETACH + DROP，不逐行删除
+LOG_PARTITION_TABLES = ('activity_log', 'admin_activity_log')
+LOG_RETENTION_DAYS = 30
+LOG_PARTITIONS_AHEAD = 7
+# 已关闭账户超过保留期后归档
+CLOSED_ACCOUNT_RETENTION_HOURS = 24
+RETENTION_BATCH = int(os.getenv('RETENTION_BATCH', '500'))
+RETENTION_PAUSE = float(os.getenv('RETENTION_PAUSE', '0.05'))
+
+def _archive_transfers(cur, account_ids):
+    """
+    把涉及这些账户的转账移入 transfer_archive。对端账户的流水仍在主表并保留 transfer_id（该列没有外键），
+    归档后仍能查到对应的转账，账户归档和手动删除账户共用
+    """
+    cur.execute("""
+        WITH moved AS (
+            DELETE FROM transfer WHERE from_account_id = ANY(%s::bigint[]) OR to_account_id = ANY(%s::bigint[])
+            RETURNING id, from_account_id, to_account_id, amount, status, created_at, completed_at
+        )
+        INSERT INTO transfer_archive(id, from_account_id, to_account_id, amount, status, created_at, completed_at)
+        SELECT id, from_account_id, to_account_id, amount, status, created_at, completed_at FROM moved
+        ON CONFLICT (id) DO NOTHING
+    """, (account_ids, account_ids))
+
+def _archive_closed_batch(cur, batch_size):
+    """
+    归档一批已关闭账户，调用方负责提交。仍被还款记录引用的储蓄账户保留在主表。
+    转账随先归档的一方进入 transfer_archive，对端账户仍在主表的流水保留原 transfer_id（该列没有外键）
+    """
+    cur.execute("""
+        SELECT a.id FROM account a
+        WHERE a.type = 'closed' AND a.closed_at < NOW() - make_interval(hours => %s)
+          AND NOT EXISTS (SELECT 1 FROM repayment r WHERE r.savings_account_id = a.id)
+        ORDER BY a.closed_at
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    """, (CLOSED_ACCOUNT_RETENTION_HOURS, batch_size))
+    ids = [row[0] for row in cur.fetchall()]
+    if not ids:
+        return 0
+    cur.execute("""
+        INSERT INTO account_archive(id, account_no, created_at, balance, type, closed_at, interest_rate, overdraft_limit)
+        SELECT a.id, a.account_no, a.created_at, a.balance, a.type, a.closed_at, s.interest_rate, c.overdraft_limit
+        FROM account a
+        LEFT JOIN savings_account s ON s.account_id = a.id
+        LEFT JOIN checking_account c ON c.account_id = a.id
+        WHERE a.id = ANY(%s::bigint[])
+        ON CONFLICT (id) DO NOTHING
+    """, (ids,))
+    cur.execute("""
+        INSERT INTO account_customer_archive(account_id, customer_id, last_access_date)
+        SELECT account_id, customer_id, last_access_date FROM account_customer
+        WHERE account_id = ANY(%s::bigint[])
+        ON CONFLICT (account_id, customer_id) DO NOTHING
+    """, (ids,))
+    cur.execute("""
+        WITH moved AS (
+            DELETE FROM transaction WHERE account_id = ANY(%s::bigint[])
+            RETURNING id, account_id, business_id, transfer_id, txn_type, amount, balance_after, created_at, remark
+        )
+        INSERT INTO transaction_archive(id, account_id, business_id, transfer_id, txn_type, amount, balance_after, created_at, remark)
+        SELECT id, account_id, business_id, transfer_id, txn_type, amount, balance_after, created_at, remark FROM moved
+        ON CONFLICT (id) DO NOTHING
+    """, (ids,))
+    _archive_transfers(cur, ids)
+    cur.execute('DELETE FROM account WHERE id = ANY(%s::bigint[])', (ids,))
+    return len(ids)
+
+def archive_closed_accounts(ctx=None, batch_size=None, pause=None):
+    """按批归档已关闭账户，每批一个事务，返回归档账户数"""
+    batch_size = batch_size or RETENTION_BATCH
+    pause = RETENTION_PAUSE if pause is None else pause
+    conn = get_conn()
+    cur = conn.cursor()
+    archived = 0
+    try:
+        while True:
+            n = _archive_closed_batch(cur, batch_size)
+            conn.commit()
+            if not n:
+                return archived
+            archived += n
+            if ctx:
+                ctx.progress(archived, message=f'account: {archived}')
+            time.sleep(pause)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close(); conn.close()
+
+def _rotate_log_partitions(table):
+    """预建未来几天的分区（default 中已有的当天数据搬入新分区），删除超过保留期的分区和 default 中的过期行，返回 (新建数, 删除数)"""
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT ensure_log_partitions(%s, CURRENT_DATE, %s)', (table, LOG_PARTITIONS_AHEAD))
+        created = cur.fetchone()[0]
+        cur.execute('SELECT drop_expired_log_partitions(%s, %s)', (table, LOG_RETENTION_DAYS))
+        dropped = cur.fetchone()[0]
+        conn.commit()
+        return created, dropped
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close(); conn.close()
+
+def cleanup_expired_data(ctx=None, batch_size=None, pause=None):
+    """
+    清理过期数据
+    1. 活动日志和管理员活动日志预建分区，并整分区删除超过30天的数据
+    2. 超过24小时的已关闭账户连同流水、转账分批归档
+    返回每张表的处理结果和耗时
+    """
+    report = []
+    for table in LOG_PARTITION_TABLES:
+        started = time.time()
+        item = {'table': table, 'partitions_created': 0, 'partitions_dropped': 0}
+        try:
+            item['partitions_created'], item['partitions_dropped'] = _rotate_log_partitions(table)
+        except Exception as e:
+            item['error'] = str(e)
+            print(f"[{datetime.datetime.now()}] Error rotating partitions of {table}: {e}")
+        item['seconds'] = round(time.time() - started, 3)
+        report.append(item)
+        print(f"[{datetime.datetime.now()}] Rotated {table}: +{item['partitions_created']} / -{item['partitions_dropped']} partitions in {item['seconds']}s")
+        if ctx:
+            ctx.check()
+    started = time.time()
+    item = {'table': 'account', 'archived': 0}
+    try:
+        item['archived'] = archive_closed_accounts(ctx, batch_size, pause)
+    except JobCancelled:
+        raise
+    except Exception as e:
+        item['error'] = str(e)
+        print(f"[{datetime.datetime.now()}] Error archiving closed accounts: {e}")
+    item['seconds'] = round(time.time() - started, 3)
+    report.append(item)
+    print(f"[{datetime.datetime.now()}] Archived closed accounts: {item['archived']} rows in {item['seconds']}s")
+    return {'tables': report}
+
+@job_handler('cleanup')
+def _job_cleanup(ctx, params):
+    return cleanup_expired_data(ctx, params.get('batch_size'), params.get('pause'))
+
+@app.post('/admin/cleanup/run')
+def admin_run_cleanup():
+    """手动触发过期数据清理（后台任务执行）"""
+    if _require_login('admin'):
+        return _require_login('admin')
+    data = request.get_json(silent=True) or {}
+    params = {}
+    try:
+        if data.get('batch_size') is not None:
+            params['batch_size'] = int(data['batch_size'])
+            if params['batch_size'] < 1:
+                raise ValueError('batch_size')
+        if data.get('pause') is not None:
+            params['pause'] = float(data['pause'])
+    except (TypeError, ValueError):
+        return jsonify({'ok': False, 'error': 'invalid_params'}), 400
+    return _job_accepted('cleanup', params)
+
 def cleanup_scheduler():
     """定期执行清理任务的调度器"""
     while True:
-        # 每小时执行一次清理任务
+        # 每小时执行一次清理任务，启动后立即执行第一次
+        try:
+            cleanup_expired_data()
+        except Exception as e:
+            print(f"[{datetime.datetime.now()}] Error running cleanup: {e}")
         time.sleep(3600)  # 1小时 = 3600秒
-        cleanup_expired_data()
 
 if __name__ == '__main__':
-    # 启动清理任务调度器线程
-    cleanup_thread = threading.Thread(target=cleanup_scheduler, daemon=True)
-    cleanup_thread.start()
-    
+    # 启动前执行未应用的迁移（已是最新时只比对校验和）
+    try:
+        applied = migrate()
+        if applied:
+            print(f"[{datetime.datetime.now()}] 已执行迁移: {', '.join(applied)}")
+    except Exception as e:
+        print(f"[{datetime.datetime.now()}] 数据库迁移失败: {e}")
+    # 基线未变化时迁移不会重跑 schema.sql 末尾的建分区语句，启动时补建日志分区（不依赖清理调度是否启用）
+    for table in LOG_PARTITION_TABLES:
+        try:
+            _rotate_log_partitions(table)
+        except Exception as e:
+            print(f"[{datetime.datetime.now()}] Error rotating partitions of {table}: {e}")
+    # 启动清理任务和逾期批处理调度器线程（BACKGROUND_SCHEDULERS=0 时不启动，供基准测试排除后台负载）
+    if os.getenv('BACKGROUND_SCHEDULERS', '1') == '1':
+        cleanup_thread = threading.Thread(target=cleanup_scheduler, daemon=True)
+        cleanup_thread.start()
+        delinquency_thread = threading.Thread(target=delinquency_scheduler, daemon=True)
+        delinquency_thread.start()
+    # 启动后台任务工作线程
+    start_job_workers()
+
     use_waitress = os.getenv('USE_WAITRESS', '1') == '1'
     if use_waitress:
         try:
@@ -2365,33 +3723,3 @@ if __name__ == '__main__':
             app.run(host='127.0.0.1', port=5000, use_reloader=False)
     else:
         app.run(host='127.0.0.1', port=5000, use_reloader=False)
-
-def cleanup_expired_data():
-    """
-    清理过期数据
-    1. 删除超过24小时的已关闭账户
-    2. 删除超过30天的用户活动日志
-    """
-    try:
-        # 删除超过24小时的已关闭账户
-        execute("""
-            DELETE FROM account 
-            WHERE type = 'closed' 
-            AND closed_at < NOW() - INTERVAL '24 hours'
-        """)
-        
-        # 删除超过30天的用户活动日志
-        execute("""
-            DELETE FROM activity_log 
-            WHERE created_at < NOW() - INTERVAL '30 days'
-        """)
-        
-        # 删除超过30天的管理员活动日志
-        execute("""
-            DELETE FROM admin_activity_log 
-            WHERE created_at < NOW() - INTERVAL '30 days'
-        """)
-        
-        print(f"[{datetime.datetime.now()}] Cleaned up expired data")
-    except Exception as e:
-        print(f"[{datetime.datetime.now()}] Error cleaning up expired data: {e}")
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+接口基准测试脚本
+启动 app.py（或连接 --url 指定的已运行实例），以固定并发依次压测主要接口：
+登录、存取款、转账、还款、用户仪表盘读取、管理端模糊查询、/loans/financials 以及 CSV 导出。
+每个场景记录吞吐量、p50/p95/p99 延迟、错误数和每请求 SQL 数（需要 pg_stat_statements 扩展，否则不统计），
+SQL 数只统计目标库的语句；自动启动的 app.py 关闭后台任务工作线程和定时调度，
+用 --url 压测已运行的实例时应以 JOB_WORKERS=0 BACKGROUND_SCHEDULERS=0 启动，否则统计中混有后台轮询的语句。
+结果与基线比较，超出容忍范围时以非零状态退出。
+数据库应先用 seed_data.py 生成数据（登录用户 u00000001 起，密码 123456）。
+用法: python benchmark.py [--concurrency 8] [--duration 10] [--scenarios deposit,transfer]
+                          [--baseline benchmark_baseline.json] [--save-baseline] [--out result.json]
+"""
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from db import get_conn, query_all
+
+DEFAULT_URL = 'http://127.0.0.1:5000'
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+USER_PASSWORD = '123456'
+ADMIN_USER = ('administrator', '123456')
+SERVER_START_TIMEOUT = 60
+# 错误率超过该比例视为失败
+MAX_ERROR_RATE = 0.01
+
+
+class _Client:
+    """带 Cookie 会话和 CSRF 令牌的最小 HTTP 客户端"""
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.csrf = None
+
+    def request(self, method, path, body=None):
+        data = None
+        headers = {}
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if method != 'GET':
+            headers['X-CSRF-Token'] = self.csrf or ''
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=300) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def refresh_csrf(self):
+        status, body = self.request('GET', '/csrf-token')
+        if status != 200:
+            raise RuntimeError(f'获取 CSRF 令牌失败: HTTP {status}')
+        self.csrf = json.loads(body)['token']
+
+    def login(self, username, password):
+        self.refresh_csrf()
+        status, body = self.request('POST', '/login', {'username': username, 'password': password})
+        # 登录后会话里的令牌会轮换
+        self.refresh_csrf()
+        return status
+
+
+def _load_profiles(count):
+    """选取有未结清贷款和可用储蓄账户的登录用户，以及转账的对端账户"""
+    rows = query_all('''
+        SELECT u.username, uc.customer_id,
+               (SELECT MIN(a.id) FROM account a JOIN account_customer ac ON ac.account_id = a.id
+                WHERE ac.customer_id = uc.customer_id AND a.type = 'savings' AND a.closed_at IS NULL) AS savings_id,
+               (SELECT MIN(l.id) FROM loan l JOIN loan_customer lc ON lc.loan_id = l.id
+                WHERE lc.customer_id = uc.customer_id AND l.status = 'DISBURSED') AS loan_id
+        FROM app_user u
+        JOIN user_customer uc ON uc.user_id = u.id
+        WHERE u.role = 'user' AND EXISTS (
+            SELECT 1 FROM loan_customer lc JOIN loan l ON l.id = lc.loan_id
+            WHERE lc.customer_id = uc.customer_id AND l.status = 'DISBURSED')
+        ORDER BY u.id
+        LIMIT %s
+    ''', (count,))
+    profiles = [r for r in rows if r['savings_id'] and r['loan_id']]
+    if len(profiles) < count:
+        raise RuntimeError(f'可用的压测用户不足（需要 {count} 个，找到 {len(profiles)} 个），请先运行 seed_data.py')
+    targets = query_all("SELECT id FROM account WHERE type <> 'closed' ORDER BY id LIMIT 1000")
+    for i, p in enumerate(profiles):
+        p['to_account_id'] = targets[(i * 7 + 1) % len(targets)]['id']
+        if p['to_account_id'] == p['savings_id']:
+            p['to_account_id'] = targets[(i * 7 + 2) % len(targets)]['id']
+    return profiles
+
+# 场景: 名称 -> (角色, 函数(client, profile, rng) -> (方法, 路径, 请求体))
+SCENARIOS = {
+    'login': ('login', lambda c, p, r: ('POST', '/login', {'username': p['username'], 'password': USER_PASSWORD})),
+    'deposit': ('user', lambda c, p, r: ('POST', '/user/deposit', {'account_id': p['savings_id'], 'amount': 100, 'remark': 'bench'})),
+    'withdraw': ('user', lambda c, p, r: ('POST', '/user/withdraw', {'account_id': p['savings_id'], 'amount': 1, 'remark': 'bench'})),
+    'transfer': ('user', lambda c, p, r: ('POST', '/user/transfer', {'from_account_id': p['savings_id'], 'to_account_id': p['to_account_id'], 'amount': 1, 'remark': 'bench'})),
+    'repay': ('user', lambda c, p, r: ('POST', '/user/repay', {'loan_id': p['loan_id'], 'savings_account_id': p['savings_id'], 'amount': 1, 'confirm': True})),
+    'user_dashboard': ('user', lambda c, p, r: ('GET', '/user/dashboard', None)),
+    'user_transactions': ('user', lambda c, p, r: ('GET', '/user/transactions', None)),
+    'user_history': ('user', lambda c, p, r: ('GET', '/user/history', None)),
+    'admin_query_branch': ('admin', lambda c, p, r: ('GET', f'/admin/api/query/branch?fuzzy=1&union_no=1021000{r.randint(0, 9)}', None)),
+    'admin_query_customer': ('admin', lambda c, p, r: ('GET', f'/admin/api/query/customer?fuzzy=1&id={r.randint(10, 99)}', None)),
+    'admin_query_account': ('admin', lambda c, p, r: ('GET', f'/admin/api/query/account?fuzzy=1&account_no=ACC0000{r.randint(10, 99)}', None)),
+    'admin_query_loan': ('admin', lambda c, p, r: ('GET', f'/admin/api/query/loan?fuzzy=1&loan_no=LN0000{r.randint(10, 99)}', None)),
+    'loans_financials': ('admin', lambda c, p, r: ('GET', '/loans/financials', None)),
+    'export_customers': ('admin', lambda c, p, r: ('GET', '/admin/export/customers?city=' + urllib.parse.quote('北京'), None)),
+    'export_transactions': ('admin', lambda c, p, r: ('GET', f'/admin/export/transactions?idno={r.randint(100, 999)}&gzip=1', None))
+}
+
+
+def _query_count():
+    """pg_stat_statements 中目标库累计的语句执行次数（排除同一集群上其它库的负载），未安装扩展时返回 None"""
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT COALESCE(SUM(calls), 0) FROM pg_stat_statements
+                WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+                  AND query NOT LIKE '%pg_stat_statements%'
+            """)
+            return int(cur.fetchone()[0])
+        finally:
+            cur.close()
+            conn.close()
+    except Exception:
+        return None
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = max(0, math.ceil(pct / 100.0 * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+def _run_scenario(name, clients, profiles, duration, warmup):
+    """每个并发线程固定使用一个客户端和一个用户，先预热再计时"""
+    role, build = SCENARIOS[name]
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    state = {'record': False, 'stop': False}
+
+    def worker(idx):
+        client, profile = clients[idx], profiles[idx]
+        rng = random.Random(f'{name}:{idx}')
+        while not state['stop']:
+            method, path, body = build(client, profile, rng)
+            started = time.perf_counter()
+            try:
+                status, _ = client.request(method, path, body)
+                ok = 200 <= status < 400
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+            if role == 'login':
+                try:
+                    client.refresh_csrf()
+                except Exception:
+                    ok = False
+            if state['record']:
+                with lock:
+                    latencies.append(elapsed)
+                    if not ok:
+                        errors[0] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(len(clients))]
+    for t in threads:
+        t.start()
+    time.sleep(warmup)
+    before = _query_count()
+    started = time.perf_counter()
+    state['record'] = True
+    time.sleep(duration)
+    state['record'] = False
+    elapsed = time.perf_counter() - started
+    after = _query_count()
+    state['stop'] = True
+    for t in threads:
+        t.join()
+    latencies.sort()
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors[0],
+        'throughput': round(count / elapsed, 2),
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 2) if count else None,
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 2) if count else None,
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 2) if count else None,
+        'queries_per_request': round((after - before) / count, 2) if count and before is not None and after is not None else None
+    }
+
+def _compare(results, baseline, tolerance):
+    """返回回归列表：吞吐下降、p95/p99 上升或每请求 SQL 数增加超过容忍比例，以及错误率超标"""
+    regressions = []
+    for name, cur in results.items():
+        if cur['requests'] and cur['errors'] / cur['requests'] > MAX_ERROR_RATE:
+            regressions.append(f"{name}: 错误率 {cur['errors']}/{cur['requests']}")
+        base = baseline.get(name)
+        if not base:
+            continue
+        if base.get('throughput') and cur['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(f"{name}: 吞吐 {cur['throughput']} < 基线 {base['throughput']}")
+        for key in ('p95_ms', 'p99_ms', 'queries_per_request'):
+            if base.get(key) is not None and cur.get(key) is not None and cur[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {cur[key]} > 基线 {base[key]}")
+    return regressions
+
+def _start_server(url):
+    log = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_server.log'), 'w', encoding='utf-8')
+    # 关闭任务轮询和定时调度，压测期间库里只有被测请求产生的语句
+    env = dict(os.environ, JOB_WORKERS='0', BACKGROUND_SCHEDULERS='0')
+    proc = subprocess.Popen([sys.executable, 'app.py'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=log, stderr=subprocess.STDOUT, env=env)
+    deadline = time.time() + SERVER_START_TIMEOUT
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError('app.py 启动失败，见 benchmark_server.log')
+        try:
+            with urllib.request.urlopen(url + '/health', timeout=2) as resp:
+                if resp.status == 200:
+                    return proc
+        except Exception:
+            time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError('等待 app.py 启动超时')
+
+def _print_results(results):
+    keys = ['requests', 'errors', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request']
+    print(f"{'场景':<22}" + ''.join(f'{k:>20}' for k in keys))
+    for name, r in results.items():
+        print(f"{name:<22}" + ''.join(f"{'-' if r[k] is None else r[k]:>20}" for k in keys))
+
+def run(args):
+    names = [n for n in args.scenarios.split(',') if n] if args.scenarios else list(SCENARIOS)
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        print(f"❌ 未知场景: {', '.join(unknown)}")
+        return 1
+    profiles = _load_profiles(args.concurrency)
+    server = None
+    if not args.url:
+        print("🚀 启动 app.py...")
+        server = _start_server(DEFAULT_URL)
+    base_url = args.url or DEFAULT_URL
+    try:
+        print("🔐 登录压测用户...")
+        clients = {'login': [], 'user': [], 'admin': []}
+        for p in profiles:
+            clients['login'].append(_Client(base_url))
+            c = _Client(base_url)
+            if c.login(p['username'], USER_PASSWORD) != 200:
+                raise RuntimeError(f"用户 {p['username']} 登录失败")
+            clients['user'].append(c)
+            a = _Client(base_url)
+            if a.login(*ADMIN_USER) != 200:
+                raise RuntimeError('管理员登录失败')
+            clients['admin'].append(a)
+        for c in clients['login']:
+            c.refresh_csrf()
+        if _query_count() is None:
+            print("ℹ️  未安装 pg_stat_statements，不统计每请求 SQL 数")
+        results = {}
+        for name in names:
+            role = SCENARIOS[name][0]
+            print(f"⏱️  {name}（并发 {args.concurrency}，{args.duration} 秒）...")
+            results[name] = _run_scenario(name, clients[role], profiles, args.duration, args.warmup)
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=30)
+    print("")
+    _print_results(results)
+    report = {
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'scenarios': results
+    }
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 已保存基线 {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"\nℹ️  没有基线文件 {args.baseline}，使用 --save-baseline 保存本次结果")
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('concurrency') != args.concurrency:
+        print(f"⚠️  基线并发为 {baseline.get('concurrency')}，本次为 {args.concurrency}，结果不可直接比较")
+    regressions = _compare(results, baseline.get('scenarios', {}), args.tolerance)
+    if regressions:
+        print(f"\n❌ 性能回归（容忍 {args.tolerance:.0%}）:")
+        for r in regressions:
+            print(f"   {r}")
+        return 1
+    print(f"\n✅ 与基线相比无回归（容忍 {args.tolerance:.0%}）")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description='接口基准测试')
+    parser.add_argument('--url', default=None, help='已运行实例的地址，不指定时自动启动 app.py')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发数')
+    parser.add_argument('--duration', type=float, default=10, help='每个场景的计时秒数')
+    parser.add_argument('--warmup', type=float, default=2, help='每个场景的预热秒数')
+    parser.add_argument('--scenarios', default=None, help=f"场景列表，逗号分隔，默认全部: {','.join(SCENARIOS)}")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='基线文件')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果保存为基线')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的退化比例')
+    parser.add_argument('--out', default=None, help='结果输出文件')
+    args = parser.parse_args()
+    if args.concurrency <= 0 or args.duration <= 0 or args.warmup < 0 or args.tolerance < 0:
+        print("❌ 参数不合法")
+        return 1
+    try:
+        return run(args)
+    except Exception as e:
+        print(f"❌ 基准测试失败: {e}")
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+索引覆盖检查脚本
+对各接口访问路径上的 SQL 执行 EXPLAIN，发现顺序扫描即报告失败。
+检查时关闭 enable_seqscan：数据量小时规划器本来就倾向全表扫描，
+关闭后计划里仍出现 Seq Scan 说明该访问路径确实没有可用的索引。
+各接口的 SQL 与查询函数均直接从 app.py 引用，检查的就是实际运行的查询；
+级联删除按 app.py 的删除函数逐条解释其中的语句。
+外键级联、触发器内部的查询不会出现在 EXPLAIN 中，不在检查范围内。
+用法: python check_indexes.py [-v]（需要已有数据的库，用于取样参数）
+"""
+import argparse
+import json
+import sys
+from db import get_conn
+from app import (_user_customer_id, _user_accounts, _user_savings_accounts, _user_open_loans, _user_transactions,
+                 _fuzzy_pattern, _like_escape, _accounts_sql, _loans_sql, _customer_filter_clauses, _customer_page_sql,
+                 _delete_customers, _delete_accounts, _delete_loans, _delete_employees, _delete_branches, JOB_CHILD_PRUNES,
+                 ADMIN_SEARCH_SQL, ADMIN_SEARCH_TYPES, ADMIN_QUERY_PAGE_SIZE, EXPORT_QUERIES,
+                 USER_PROFILE_SQL, USER_HISTORY_SQL, BRANCH_FUZZY_SQL, BRANCH_BY_UNION_NO_SQL, ACCOUNT_FUZZY_WHERE, LOAN_FUZZY_WHERE,
+                 LOAN_OWNED_SQL, ACCOUNT_OWNED_SQL, LOAN_SCHEDULE_SQL, LOAN_REPAID_SQL,
+                 DASHBOARD_PENDING_SQL, DASHBOARD_PENDING_LIMIT, CLOSED_ACCOUNTS_SQL, PENDING_CLOSE_ACCOUNTS_SQL)
+
+# 取样参数：名称 -> 查询，取库中任意一行的值代入 SQL
+SAMPLES = {
+    'uid': 'SELECT user_id FROM user_customer LIMIT 1',
+    'customer_id': 'SELECT customer_id FROM account_customer LIMIT 1',
+    'account_id': 'SELECT account_id FROM account_customer LIMIT 1',
+    'loan_id': 'SELECT loan_id FROM loan_customer LIMIT 1',
+    'branch_id': 'SELECT id FROM branch LIMIT 1',
+    'employee_id': 'SELECT id FROM employee LIMIT 1',
+    'union_no': 'SELECT union_no FROM branch LIMIT 1',
+    # 模糊查询取 4 个字符的片段，足够构成三元组
+    'union_term': 'SELECT substr(union_no, 2, 4) FROM branch WHERE length(union_no) >= 5 LIMIT 1',
+    'account_term': 'SELECT substr(account_no, 2, 4) FROM account WHERE length(account_no) >= 5 LIMIT 1',
+    'loan_term': 'SELECT substr(loan_no, 2, 4) FROM loan WHERE length(loan_no) >= 5 LIMIT 1',
+    'idno_term': 'SELECT substr(identity_no, 2, 4) FROM customer WHERE length(identity_no) >= 5 LIMIT 1'
+}
+
+# 复用 app.py 查询函数的检查：(名称, 函数, 参数名)，函数以 _PlanCursor 代替游标执行
+HELPER_CHECKS = [
+    ('/user/dashboard: 绑定客户', _user_customer_id, 'uid'),
+    ('/user/dashboard, /user/accounts', _user_accounts, 'customer_id'),
+    ('/user/dashboard, /user/savings-accounts', _user_savings_accounts, 'customer_id'),
+    ('/user/dashboard, /user/loans/open', _user_open_loans, 'customer_id'),
+    ('/user/dashboard, /user/transactions', _user_transactions, 'customer_id'),
+    ('删除客户', lambda cur, v: _delete_customers(cur, [v]), 'customer_id'),
+    ('删除账户', lambda cur, v: _delete_accounts(cur, [v]), 'account_id'),
+    ('删除贷款', lambda cur, v: _delete_loans(cur, [v]), 'loan_id'),
+    ('删除员工', lambda cur, v: _delete_employees(cur, [v]), 'employee_id'),
+    ('删除支行', lambda cur, v: _delete_branches(cur, [v]), 'branch_id')
+]
+# 后台删除任务分批删除子行的函数
+for _table, _prune in JOB_CHILD_PRUNES.items():
+    HELPER_CHECKS.append((f'后台删除 {_table}: 分批删除子行', lambda cur, v, fn=_prune: fn(cur, [v]), _table + '_id'))
+
+# 只取证件号过滤条件的 SQL 片段，参数由取样名称 idno_pattern 代入
+_IDNO_WHERE, _ = _customer_filter_clauses(None, None, '-', 'c.')
+_CUSTOMER_PAGE = _customer_page_sql(_customer_filter_clauses(None, None, '-')[0], ['idno_pattern'], 0, 10)
+
+# (名称, SQL, 参数)，参数为取样名称或字面值
+CHECKS = [
+    ('/user/dashboard: 个人信息', USER_PROFILE_SQL, ('uid',)),
+    ('/user/dashboard, /user/history', USER_HISTORY_SQL, ('uid',)),
+    ('联行号模糊查询', BRANCH_FUZZY_SQL, ('union_pattern', 0, ADMIN_QUERY_PAGE_SIZE + 1)),
+    ('账号模糊查询', *_accounts_sql(ACCOUNT_FUZZY_WHERE, ('account_pattern', 0), ADMIN_QUERY_PAGE_SIZE + 1)),
+    ('贷款编号模糊查询', *_loans_sql(LOAN_FUZZY_WHERE, ('loan_pattern', 0), ADMIN_QUERY_PAGE_SIZE + 1)),
+    ('客户证件号模糊查询', *_CUSTOMER_PAGE[1:]),
+    ('统一搜索', ADMIN_SEARCH_SQL, {'q': 'account_term', 'pattern': 'account_search', 'types': list(ADMIN_SEARCH_TYPES), 'limit': 20}),
+    ('贷款归属校验', LOAN_OWNED_SQL, ('loan_id', 'customer_id')),
+    ('账户归属校验', ACCOUNT_OWNED_SQL, ('account_id', 'customer_id')),
+    ('还款计划', LOAN_SCHEDULE_SQL, ('loan_id',)),
+    ('已还金额', LOAN_REPAID_SQL, ('loan_id',)),
+    ('联行号精确查询', BRANCH_BY_UNION_NO_SQL, ('union_no',)),
+    ('管理后台首页: 待审批业务', DASHBOARD_PENDING_SQL, (DASHBOARD_PENDING_LIMIT,)),
+    ('待审批销户申请', PENDING_CLOSE_ACCOUNTS_SQL, ()),
+    ('已关闭账户', CLOSED_ACCOUNTS_SQL, ())
+]
+
+# 导出：不带过滤条件时本来就是整表 COPY，只检查按客户证件号过滤的情况
+for _entity, (_select_sql, _filter_sql) in EXPORT_QUERIES.items():
+    CHECKS.append((f'/admin/export/{_entity}?idno=', _select_sql + ' WHERE ' + _filter_sql.format(cf=' AND '.join(_IDNO_WHERE)), ('idno_pattern',)))
+
+class _PlanCursor:
+    """代替游标传给 app.py 的查询函数：execute 只做 EXPLAIN 并记下计划，取数一律返回空结果"""
+    def __init__(self, cur):
+        self.cur = cur
+        self.plans = []
+        self.rowcount = 0
+
+    def execute(self, sql, params=None):
+        self.plans.append(_explain(self.cur, sql, params))
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+def _explain(cur, sql, params):
+    cur.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan
+
+def _seq_scans(node, found):
+    if node.get('Node Type') == 'Seq Scan':
+        found.append(node.get('Relation Name'))
+    for child in node.get('Plans', []):
+        _seq_scans(child, found)
+    return found
+
+def _load_samples(cur):
+    samples = {}
+    for name, sql in SAMPLES.items():
+        cur.execute(sql)
+        row = cur.fetchone()
+        samples[name] = row[0] if row else None
+    for name in [k for k in samples if k.endswith('_term')]:
+        if samples[name] is not None:
+            samples[name[:-5] + '_pattern'] = _fuzzy_pattern(samples[name])
+            samples[name[:-5] + '_search'] = '%' + _like_escape(samples[name]) + '%'
+    return samples
+
+def _resolve(keys, samples):
+    """把参数中的取样名称替换为样本值，返回 (参数, 缺少的取样名称)"""
+    def value(k):
+        return samples[k] if isinstance(k, str) else k
+    names = keys.values() if isinstance(keys, dict) else keys
+    missing = [k for k in names if isinstance(k, str) and samples.get(k) is None]
+    if missing:
+        return None, missing
+    if isinstance(keys, dict):
+        return {p: value(k) for p, k in keys.items()}, []
+    return tuple(value(k) for k in keys), []
+
+def _report(name, plans, failures, verbose):
+    scans = []
+    for plan in plans:
+        _seq_scans(plan[0]['Plan'], scans)
+    if scans:
+        failures.append(name)
+        print(f"❌ {name}: 顺序扫描 {', '.join(scans)}")
+    else:
+        print(f"✅ {name}")
+    if verbose:
+        for plan in plans:
+            print(json.dumps(plan, ensure_ascii=False, indent=2))
+
+def check_indexes(verbose=False):
+    conn = get_conn()
+    cur = conn.cursor()
+    failures = []
+    try:
+        samples = _load_samples(cur)
+        cur.execute('SET LOCAL enable_seqscan = off')
+        for name, fn, key in HELPER_CHECKS:
+            if samples.get(key) is None:
+                print(f"⚠️  {name}: 缺少样本数据（{key}），跳过")
+                continue
+            plan_cur = _PlanCursor(cur)
+            fn(plan_cur, samples[key])
+            _report(name, plan_cur.plans, failures, verbose)
+        for name, sql, keys in CHECKS:
+            params, missing = _resolve(keys, samples)
+            if missing:
+                print(f"⚠️  {name}: 缺少样本数据（{', '.join(missing)}），跳过")
+                continue
+            _report(name, [_explain(cur, sql, params)], failures, verbose)
+    finally:
+        conn.rollback()
+        cur.close()
+        conn.close()
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description='检查接口访问路径的索引覆盖')
+    parser.add_argument('-v', '--verbose', action='store_true', help='输出完整执行计划')
+    args = parser.parse_args()
+    print("🔍 检查索引覆盖...")
+    try:
+        failures = check_indexes(args.verbose)
+    except Exception as e:
+        print(f"❌ 检查失败: {e}")
+        return 1
+    if failures:
+        print(f"\n❌ {len(failures)} 条访问路径缺少索引")
+        return 1
+    print("\n✅ 所有访问路径均可走索引")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,8 @@
 import os
+import re
 import json
+import time
+import hashlib
 import psycopg2
 import psycopg2.extras
 
@@ -19,13 +22,13 @@ def get_config():
     password = cfg.get('password', os.getenv('PGPASSWORD', ''))
     return {"host": host, "port": port, "database": dbname, "user": user, "password": password}
 
-def get_conn():
+def get_conn(dbname=None):
     c = get_config()
     # 显式指定客户端编码为utf8
     conn = psycopg2.connect(
         host=c['host'],
         port=c['port'],
-        dbname=c['database'],
+        dbname=dbname or c['database'],
         user=c['user'],
         password=c['password'],
         client_encoding='utf8'
@@ -34,16 +37,177 @@ def get_conn():
     conn.set_client_encoding('UTF8')
     return conn
 
-def init_db():
-    path = os.path.join(os.path.dirname(__file__), 'schema.sql')
+# 迁移：schema.sql 作为基线（版本 0000_schema，本身可重复执行，内容变化时整体重跑），
+# 之后的变更放在 migrations/NNNN_名称.sql，按编号顺序各执行一次，已执行过的文件不允许再修改
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'schema.sql')
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
+BASELINE_VERSION = '0000_schema'
+MIGRATION_LOCK_KEY = 726046
+# 等待其它实例完成迁移的最长时间（秒），超时抛出异常而不是无限等待
+MIGRATION_LOCK_TIMEOUT = 600
+MIGRATION_FILE_RE = re.compile(r'^(\d{4})_[A-Za-z0-9_]+\.sql$')
+# 含 CONCURRENTLY 的迁移（大表在线建索引）不能放在事务里：按语句逐条自动提交执行，
+# 语句需可重复执行（IF NOT EXISTS），中途失败留下的无效索引在重跑时先删除再重建；
+# 分区父表上的 CREATE INDEX CONCURRENTLY 由迁移程序改为逐个分区并发建索引后挂到父索引上
+CONCURRENTLY_RE = re.compile(r'\bCONCURRENTLY\b', re.IGNORECASE)
+CONCURRENT_INDEX_RE = re.compile(
+    r'CREATE\s+(UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)\s+ON\s+(\w+)\s*(.*)$',
+    re.IGNORECASE | re.DOTALL)
+
+def _migration_files():
+    """返回 [(版本, 路径)]，基线在前，编号迁移按文件名排序"""
+    files = [(BASELINE_VERSION, SCHEMA_PATH)]
+    if os.path.isdir(MIGRATIONS_DIR):
+        for name in sorted(os.listdir(MIGRATIONS_DIR)):
+            if MIGRATION_FILE_RE.match(name):
+                files.append((name[:-4], os.path.join(MIGRATIONS_DIR, name)))
+    return files
+
+def _read_migration(path):
     with open(path, 'r', encoding='utf-8') as f:
         sql = f.read()
-    conn = get_conn()
+    return sql, hashlib.sha256(sql.encode('utf-8')).hexdigest()
+
+def _strip_comments(sql):
+    return re.sub(r'--[^\n]*', '', sql)
+
+def _split_statements(sql):
+    """按行尾分号拆分语句，只用于不含函数体的迁移文件"""
+    return [p.strip() for p in re.split(r';[ \t]*(?:\r?\n|$)', sql) if _strip_comments(p).strip()]
+
+def _drop_invalid_index(cur, name):
+    cur.execute("""
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.oid = to_regclass(%s) AND NOT i.indisvalid
+    """, (name,))
+    if cur.fetchone():
+        cur.execute('DROP INDEX CONCURRENTLY IF EXISTS ' + name)
+
+def _is_partitioned(cur, table):
+    cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+def _create_partitioned_index(cur, unique, name, parent, definition):
+    """
+    分区父表不支持 CONCURRENTLY，直接建索引会在整个构建期间锁住所有分区的写入：
+    先用 ON ONLY 在父表上建空索引（不扫描数据），再逐个分区并发建索引并挂到父索引上，全部挂上后父索引自动生效。
+    之后新建的分区会自动带上索引；中途失败重跑时只处理还没挂上的分区
+    """
+    kind = 'UNIQUE INDEX' if unique else 'INDEX'
+    cur.execute(f'CREATE {kind} IF NOT EXISTS {name} ON ONLY {parent} {definition}')
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+          AND NOT EXISTS (
+            SELECT 1 FROM pg_inherits ii JOIN pg_index x ON x.indexrelid = ii.inhrelid
+            WHERE ii.inhparent = to_regclass(%s) AND x.indrelid = c.oid
+          )
+        ORDER BY c.relname
+    """, (parent, name))
+    for (part,) in cur.fetchall():
+        suffix = part[len(parent) + 1:] if part.startswith(parent + '_') else part
+        child = (name + '_' + suffix)[:63]
+        _drop_invalid_index(cur, child)
+        cur.execute(f'CREATE {kind} CONCURRENTLY IF NOT EXISTS {child} ON {part} {definition}')
+        cur.execute(f'ALTER INDEX {name} ATTACH PARTITION {child}')
+
+def _run_concurrently(cur, sql):
+    for stmt in _split_statements(sql):
+        m = CONCURRENT_INDEX_RE.match(_strip_comments(stmt).strip())
+        if m and _is_partitioned(cur, m.group(3)):
+            _create_partitioned_index(cur, bool(m.group(1)), m.group(2), m.group(3), m.group(4))
+            continue
+        if m:
+            _drop_invalid_index(cur, m.group(2))
+        cur.execute(stmt)
+
+def _record_version(cur, version, checksum, started):
+    cur.execute("""
+        INSERT INTO schema_version(version, checksum, duration_ms) VALUES(%s,%s,%s)
+        ON CONFLICT (version) DO UPDATE SET checksum = EXCLUDED.checksum,
+          applied_at = CURRENT_TIMESTAMP, duration_ms = EXCLUDED.duration_ms
+    """, (version, checksum, int((time.time() - started) * 1000)))
+
+def _applied_versions(cur):
+    cur.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return {}
+    cur.execute('SELECT version, checksum FROM schema_version')
+    return dict(cur.fetchall())
+
+def schema_checksum():
+    """全部迁移文件（基线 + 编号迁移）的合并校验和，任一文件变化都会改变"""
+    h = hashlib.sha256()
+    for version, path in _migration_files():
+        h.update(version.encode('utf-8'))
+        h.update(_read_migration(path)[1].encode('utf-8'))
+    return h.hexdigest()
+
+def migrate(dbname=None, lock_timeout=MIGRATION_LOCK_TIMEOUT):
+    """
+    执行未应用的迁移，返回本次执行的版本列表。
+    全部已应用时只做一次校验和比对即返回；需要迁移时先取咨询锁，多个实例同时启动只有一个执行，
+    lock_timeout 秒内取不到锁抛出 RuntimeError
+    """
+    pending = [(v, p) + _read_migration(p) for v, p in _migration_files()]
+    conn = get_conn(dbname)
     conn.autocommit = True
     cur = conn.cursor()
-    cur.execute(sql)
-    cur.close()
-    conn.close()
+    try:
+        applied = _applied_versions(cur)
+        if all(applied.get(v) == checksum for v, _, _, checksum in pending):
+            return []
+        # 轮询取锁而不是阻塞等待：等锁的语句持有快照，会让持锁实例的 CREATE INDEX CONCURRENTLY 一直等下去
+        deadline = time.time() + lock_timeout
+        while True:
+            cur.execute('SELECT pg_try_advisory_lock(%s)', (MIGRATION_LOCK_KEY,))
+            if cur.fetchone()[0]:
+                break
+            if time.time() >= deadline:
+                raise RuntimeError('等待迁移锁超时，可能有其它实例正在执行迁移')
+            time.sleep(1)
+        try:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                  version VARCHAR(128) PRIMARY KEY,
+                  checksum CHAR(64) NOT NULL,
+                  applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                  duration_ms INTEGER
+                )
+            """)
+            # 等锁期间其它实例可能已经完成迁移，重新读取
+            applied = _applied_versions(cur)
+            done = []
+            for version, path, sql, checksum in pending:
+                if applied.get(version) == checksum:
+                    continue
+                if version in applied and version != BASELINE_VERSION:
+                    raise RuntimeError(f'迁移 {version} 已执行过但文件内容已修改')
+                started = time.time()
+                if CONCURRENTLY_RE.search(_strip_comments(sql)):
+                    _run_concurrently(cur, sql)
+                    _record_version(cur, version, checksum, started)
+                    done.append(version)
+                    continue
+                cur.execute('BEGIN')
+                try:
+                    cur.execute(sql)
+                    _record_version(cur, version, checksum, started)
+                    cur.execute('COMMIT')
+                except Exception:
+                    cur.execute('ROLLBACK')
+                    raise
+                done.append(version)
+            return done
+        finally:
+            cur.execute('SELECT pg_advisory_unlock(%s)', (MIGRATION_LOCK_KEY,))
+    finally:
+        cur.close()
+        conn.close()
+
+def init_db():
+    return migrate()
 
 def execute(sql, params=None):
     conn = get_conn()
@@ -68,6 +232,17 @@ def query_all(sql, params=None):
     conn.close()
     return rows
 
+def execute_returning(sql, params=None):
+    """执行带 RETURNING 的写语句，提交后返回结果行"""
+    conn = get_conn()
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cur.execute(sql, params or ())
+    rows = cur.fetchall()
+    conn.commit()
+    cur.close()
+    conn.close()
+    return rows
+
 def query_one(sql, params=None):
     """查询单条记录"""
     conn = get_conn()
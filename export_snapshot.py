@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+账务数据快照导出脚本（供离线分析使用，避免分析查询压在主库上）
+在同一个 REPEATABLE READ 只读快照中按 id 区间分块读取 transaction、repayment、loan，
+按月分区写出 Parquet 文件：
+  <out>/transaction/month=YYYY-MM/part-<起始id>-<结束id>.parquet
+  <out>/repayment/month=YYYY-MM/part-<起始id>-<结束id>.parquet
+  <out>/loan/month=YYYY-MM/part-<起始id>-<结束id>.parquet
+transaction 和 repayment 按 id 增量导出：后续运行只导出上次水位之后的新行。
+id 在插入时分配、提交可能更晚，快照时尚未提交的事务会在水位以下留下空号，
+因此水位以下 TRAIL_WINDOW 个 id 内的空号会记入状态，之后每次运行补查，出现即补导（每行只导出一次）。
+增量导出只追加新行，不反映之后的删除和修改（账户归档移走的流水、管理端删除的还款等），
+需要与库中现状一致时用 --full 全量重建。
+loan 的状态会变化，每次运行全量重写。
+用法: python export_snapshot.py --out ./snapshot [--tables transaction,repayment,loan] [--chunk 100000] [--full]
+依赖 pyarrow（pip install pyarrow）
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from db import get_conn
+
+# 表 -> (列定义, 分区日期列, 是否按 id 水位增量导出)
+TABLES = {
+    'transaction': (
+        [('id', 'int64'), ('account_id', 'int64'), ('business_id', 'int64'), ('transfer_id', 'int64'),
+         ('txn_type', 'string'), ('amount', 'money'), ('balance_after', 'money'), ('created_at', 'timestamp'),
+         ('remark', 'string')],
+        'created_at', True
+    ),
+    'repayment': (
+        [('id', 'int64'), ('loan_id', 'int64'), ('batch_no', 'string'), ('paid_at', 'date'),
+         ('amount', 'money'), ('savings_account_id', 'int64')],
+        'paid_at', True
+    ),
+    'loan': (
+        [('id', 'int64'), ('loan_no', 'string'), ('amount', 'money'), ('branch_id', 'int64'),
+         ('interest_rate', 'rate'), ('term_months', 'int32'), ('repayment_method', 'string'), ('status', 'string'),
+         ('start_date', 'date'), ('end_date', 'date'), ('settled_at', 'timestamp')],
+        'start_date', False
+    )
+}
+STATE_FILE = '_state.json'
+# 分片文件名带运行序号，中断后据此清理未提交的分片；旧版本文件名不带序号，按起始 id 判断
+PART_RE = re.compile(r'^part-(\d+)-(\d+)(?:-r(\d+))?\.parquet$')
+# 水位以下补查空号的 id 窗口：提交晚于其后 TRAIL_WINDOW 个 id 分配的事务仍会漏导
+TRAIL_WINDOW = 100000
+
+def _arrow_schema(pa, columns):
+    types = {
+        'int64': pa.int64(),
+        'int32': pa.int32(),
+        'string': pa.string(),
+        'money': pa.decimal128(18, 2),
+        'rate': pa.decimal128(5, 4),
+        'timestamp': pa.timestamp('us'),
+        'date': pa.date32()
+    }
+    return pa.schema([(name, types[t]) for name, t in columns])
+
+def _load_state(out):
+    path = os.path.join(out, STATE_FILE)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+def _save_state(out, state):
+    path = os.path.join(out, STATE_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+def _table_state(state, table):
+    """表的增量状态：水位、已提交的运行序号、水位以下待补查的空号（兼容旧版本只存水位的格式）"""
+    v = state.get(table)
+    if isinstance(v, dict):
+        return v
+    return {'watermark': v or 0, 'run': 0, 'pending': []}
+
+def _drop_uncommitted(table_dir, ts):
+    """删除上次中断留下的文件：未完成的 .tmp 以及运行序号（或起始 id）超过已提交状态的分片"""
+    if not os.path.isdir(table_dir):
+        return
+    for root, _, files in os.walk(table_dir):
+        for name in files:
+            m = PART_RE.match(name)
+            if name.endswith('.tmp'):
+                stale = True
+            elif not m:
+                stale = False
+            elif m.group(3) is not None:
+                stale = int(m.group(3)) > ts['run']
+            else:
+                stale = int(m.group(1)) > ts['watermark']
+            if stale:
+                os.remove(os.path.join(root, name))
+
+def _export_table(pq, pa, cur, table, out_dir, lo, hi, chunk, run=None, pending=(), gap_floor=None):
+    """
+    导出 id 在 [lo, hi] 区间的行以及 pending 中已经出现的行，返回 (写出的行数, 仍缺失的 id 列表)。
+    gap_floor 不为空时收集区间内大于该值的空号
+    """
+    columns, month_col, _ = TABLES[table]
+    schema = _arrow_schema(pa, columns)
+    names = [name for name, _ in columns]
+    month_idx = names.index(month_col)
+    suffix = f'-r{run}' if run is not None else ''
+    writers = {}
+    total = 0
+    missing = []
+
+    def write(rows):
+        by_month = {}
+        for row in rows:
+            v = row[month_idx]
+            by_month.setdefault(v.strftime('%Y-%m') if v else 'unknown', []).append(row)
+        for month, part in by_month.items():
+            w = writers.get(month)
+            if w is None:
+                part_dir = os.path.join(out_dir, f'month={month}')
+                os.makedirs(part_dir, exist_ok=True)
+                path = os.path.join(part_dir, f'part-{lo:020d}-{hi:020d}{suffix}.parquet')
+                w = (pq.ParquetWriter(path + '.tmp', schema, compression='snappy'), path)
+                writers[month] = w
+            cols = list(zip(*part))
+            w[0].write_table(pa.Table.from_arrays([pa.array(c, type=f.type) for c, f in zip(cols, schema)], schema=schema))
+        return len(rows)
+
+    try:
+        if pending:
+            cur.execute(f'SELECT {", ".join(names)} FROM {table} WHERE id = ANY(%s) ORDER BY id', (list(pending),))
+            rows = cur.fetchall()
+            found = {row[0] for row in rows}
+            missing.extend(i for i in pending if i not in found)
+            total += write(rows)
+        start = lo
+        while start <= hi:
+            end = min(start + chunk - 1, hi)
+            cur.execute(f'SELECT {", ".join(names)} FROM {table} WHERE id >= %s AND id <= %s ORDER BY id', (start, end))
+            rows = cur.fetchall()
+            if gap_floor is not None and end > gap_floor:
+                seen = {row[0] for row in rows}
+                missing.extend(i for i in range(max(start, gap_floor + 1), end + 1) if i not in seen)
+            total += write(rows)
+            start = end + 1
+        for w, path in writers.values():
+            w.close()
+            os.replace(path + '.tmp', path)
+        writers = {}
+        return total, missing
+    finally:
+        for w, path in writers.values():
+            try:
+                w.close()
+                os.remove(path + '.tmp')
+            except Exception:
+                pass
+
+def export_snapshot(out, tables, chunk, full=False):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("❌ 需要安装 pyarrow: pip install pyarrow")
+        return False
+    os.makedirs(out, exist_ok=True)
+    state = _load_state(out)
+    conn = get_conn()
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    cur = conn.cursor()
+    try:
+        for table in tables:
+            _, _, incremental = TABLES[table]
+            started = time.time()
+            cur.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}')
+            hi = cur.fetchone()[0]
+            table_dir = os.path.join(out, table)
+            if incremental and not full:
+                ts = _table_state(state, table)
+                watermark = ts['watermark']
+                _drop_uncommitted(table_dir, ts)
+                if hi <= watermark and not ts['pending']:
+                    print(f"ℹ️  {table}: 没有新数据（水位 {watermark}）")
+                    continue
+                run = ts['run'] + 1
+                hi = max(hi, watermark)
+                count, missing = _export_table(pq, pa, cur, table, table_dir, watermark + 1, hi, chunk,
+                                               run=run, pending=ts['pending'], gap_floor=hi - TRAIL_WINDOW)
+                state[table] = {'watermark': hi, 'run': run, 'pending': sorted(i for i in missing if i > hi - TRAIL_WINDOW)}
+            else:
+                new_dir = table_dir + '.__new__'
+                shutil.rmtree(new_dir, ignore_errors=True)
+                # 全量重建时同样记录水位以下的空号，之后的增量运行从这里继续
+                count, missing = _export_table(pq, pa, cur, table, new_dir, 1, hi, chunk,
+                                               run=0 if incremental else None,
+                                               gap_floor=hi - TRAIL_WINDOW if incremental else None)
+                old_dir = table_dir + '.__old__'
+                if os.path.isdir(table_dir):
+                    os.replace(table_dir, old_dir)
+                os.replace(new_dir, table_dir)
+                shutil.rmtree(old_dir, ignore_errors=True)
+                state[table] = {'watermark': hi, 'run': 0, 'pending': sorted(missing)} if incremental else hi
+            _save_state(out, state)
+            print(f"✅ {table}: 导出 {count} 行，耗时 {time.time() - started:.1f} 秒")
+        conn.rollback()
+        return True
+    finally:
+        cur.close()
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='导出账务数据 Parquet 快照')
+    parser.add_argument('--out', required=True, help='输出目录')
+    parser.add_argument('--tables', default=','.join(TABLES), help='要导出的表，逗号分隔')
+    parser.add_argument('--chunk', type=int, default=100000, help='每次读取的 id 区间大小')
+    parser.add_argument('--full', action='store_true', help='全量重建所有表（反映删除和修改）')
+    args = parser.parse_args()
+    tables = [t for t in args.tables.split(',') if t]
+    unknown = [t for t in tables if t not in TABLES]
+    if unknown:
+        print(f"❌ 不支持的表: {', '.join(unknown)}")
+        return 1
+    print(f"📦 导出快照到 {args.out}")
+    try:
+        return 0 if export_snapshot(args.out, tables, args.chunk, args.full) else 1
+    except Exception as e:
+        print(f"❌ 导出失败: {e}")
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
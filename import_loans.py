@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+贷款批量导入脚本
+用法: python import_loans.py loans.csv
+CSV 表头: loan_no,amount,branch_id,customer_ids,interest_rate,term_months,repayment_method[,status][,start_date]
+"""
+import sys
+import time
+from app import import_loans_csv
+
+def main():
+    if len(sys.argv) != 2:
+        print("用法: python import_loans.py loans.csv")
+        return 1
+    path = sys.argv[1]
+    print(f"📥 正在导入贷款: {path}")
+    started = time.time()
+    try:
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            result = import_loans_csv(f)
+    except Exception as e:
+        print(f"❌ 导入失败: {e}")
+        return 1
+    if not result['ok']:
+        print(f"❌ 导入失败: {result['error']}")
+        for col in result.get('columns', []):
+            print(f"   缺少列: {col}")
+        for err in result.get('errors', []):
+            print(f"   第 {err['line']} 行: {err['error']}")
+        return 1
+    print(f"✅ 导入完成: {result['imported']} 笔贷款，耗时 {time.time() - started:.1f} 秒")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
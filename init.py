@@ -77,18 +77,11 @@ def init_database():
     print("")
     print("📊 创建数据库表结构...")
     try:
-        # 读取SQL文件
-        schema_path = os.path.join(os.path.dirname(__file__), 'schema.sql')
-        with open(schema_path, 'r', encoding='utf-8') as f:
-            sql_commands = f.read()
-        
-        # 执行SQL
-        conn = _open_conn(cfg)
-        conn.autocommit = True
-        cur = conn.cursor()
-        cur.execute(sql_commands)
-        cur.close()
-        conn.close()
+        # 执行版本化迁移（schema.sql 基线 + migrations/ 下的编号迁移）
+        from db import migrate
+        applied = migrate()
+        if applied:
+            print(f"   已执行迁移: {', '.join(applied)}")
         print("✅ 数据库表结构创建完成")
         
     except Exception as e:
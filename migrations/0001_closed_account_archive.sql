@@ -0,0 +1,55 @@
+-- 已关闭账户归档：超过保留期的已关闭账户连同流水、转账按批搬到归档表（归档表不建外键）
+CREATE TABLE IF NOT EXISTS account_archive (
+  id BIGINT PRIMARY KEY,
+  account_no VARCHAR(64) NOT NULL,
+  created_at TIMESTAMP NOT NULL,
+  balance NUMERIC(18,2) NOT NULL,
+  type account_type NOT NULL,
+  closed_at TIMESTAMP,
+  interest_rate NUMERIC(5,4),
+  overdraft_limit NUMERIC(18,2),
+  archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS account_customer_archive (
+  account_id BIGINT NOT NULL,
+  customer_id BIGINT NOT NULL,
+  last_access_date DATE,
+  PRIMARY KEY (account_id, customer_id)
+);
+CREATE INDEX IF NOT EXISTS idx_account_customer_archive_customer ON account_customer_archive(customer_id);
+
+CREATE TABLE IF NOT EXISTS transaction_archive (
+  id BIGINT PRIMARY KEY,
+  account_id BIGINT NOT NULL,
+  business_id BIGINT,
+  transfer_id BIGINT,
+  txn_type VARCHAR(32) NOT NULL,
+  amount NUMERIC(18,2) NOT NULL,
+  balance_after NUMERIC(18,2) NOT NULL,
+  created_at TIMESTAMP NOT NULL,
+  remark TEXT,
+  archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_transaction_archive_account_created ON transaction_archive(account_id, created_at);
+
+CREATE TABLE IF NOT EXISTS transfer_archive (
+  id BIGINT PRIMARY KEY,
+  from_account_id BIGINT NOT NULL,
+  to_account_id BIGINT NOT NULL,
+  amount NUMERIC(18,2) NOT NULL,
+  status VARCHAR(32) NOT NULL,
+  created_at TIMESTAMP NOT NULL,
+  completed_at TIMESTAMP,
+  archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 转账随先关闭的一方归档后，对端账户的流水仍保留原 transfer_id（指向 transfer_archive），
+-- 因此去掉 transaction.transfer_id 对 transfer 的外键；不再需要按 transfer_id 回写流水，对应索引一并删除
+ALTER TABLE transaction DROP CONSTRAINT IF EXISTS transaction_transfer_id_fkey;
+DROP INDEX IF EXISTS idx_transaction_transfer_id;
+
+-- 已关闭账户列表与归档挑选都按 closed_at 走这个部分索引
+CREATE INDEX IF NOT EXISTS idx_account_closed_at ON account(closed_at DESC) WHERE type = 'closed';
+-- 归档时排除仍被还款记录引用的储蓄账户
+CREATE INDEX IF NOT EXISTS idx_repayment_savings_account ON repayment(savings_account_id);
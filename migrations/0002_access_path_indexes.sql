@@ -0,0 +1,18 @@
+-- 访问路径索引：复合主键只能服务以首列开头的查询，反向查找需要单独的索引。
+-- 使用 CONCURRENTLY 在线建索引，不阻塞写入；本文件逐条语句自动提交执行，不在事务中
+-- 按客户查账户 / 贷款（用户仪表盘、客户删除级联）
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_account_customer_customer ON account_customer(customer_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_loan_customer_customer ON loan_customer(customer_id);
+-- user_customer 按 user_id 单独查询由主键 (user_id, customer_id) 覆盖；删除客户时按 customer_id 查
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_customer_customer ON user_customer(customer_id);
+-- 删除客户时按业务单删除流水
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_transaction_business_id ON transaction(business_id) WHERE business_id IS NOT NULL;
+-- 待审批业务列表：按类型、状态过滤并按创建时间倒序
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_business_type_status_created ON business(business_type, status, created_at DESC);
+-- /user/history 按用户取最近的操作记录；activity_log 是分区表，迁移程序会改为 ON ONLY 建父索引、
+-- 逐个分区并发建索引再挂到父索引上，之后新建的日分区自动带上索引
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_activity_log_user_id ON activity_log(user_id, id DESC);
+-- 删除员工时解除下属、客户专员的引用以及删除家属
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_dependent_employee ON dependent(employee_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_employee_manager ON employee(manager_id) WHERE manager_id IS NOT NULL;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_customer_assistant_employee ON customer(assistant_employee_id) WHERE assistant_employee_id IS NOT NULL;
@@ -1,12 +1,20 @@
 #!/usr/bin/env python3
 """
 数据库重置脚本 - 彻底清除数据库中的所有对象
+快速重置: python reset_db.py --template [--database 目标库] [--yes]
+  目标为配置中的应用库时需要输入 yes 确认，或加 --yes 跳过确认（脚本中使用）；
+  首次按迁移文件校验和建好模板库（执行全部迁移并创建默认管理员），
+  之后每次以 CREATE DATABASE ... TEMPLATE 克隆，不再重复执行 DDL 和密码哈希
 """
 
 import psycopg2
 import psycopg2.extras
+import argparse
+import hashlib
+import secrets
 import json
 import os
+import time
 import traceback
 import sys
 
@@ -230,6 +238,104 @@ def reset_database():
     
     return True
 
+# 模板库名带上迁移校验和前缀，迁移文件变化后自动重建，旧模板随之删除
+TEMPLATE_PREFIX = 'bank_tpl_'
+MAINTENANCE_DB = 'postgres'
+# 日志分区按建模板当天预建，克隆出的库可能已过了那几天，克隆后按当前日期补建（与 app.py 保持一致）
+LOG_PARTITION_TABLES = ('activity_log', 'admin_activity_log')
+LOG_PARTITIONS_AHEAD = 7
+
+def _admin_conn(cfg, database=MAINTENANCE_DB):
+    """连接维护库执行 CREATE/DROP DATABASE（不能在事务内执行，需要 autocommit）"""
+    conn = psycopg2.connect(
+        host=cfg["host"],
+        port=cfg["port"],
+        database=database,
+        user=cfg["user"],
+        password=cfg["password"]
+    )
+    conn.autocommit = True
+    return conn
+
+def _drop_database(cur, name):
+    """断开目标库上的连接后删除；模板库需先取消模板标记才能删除"""
+    cur.execute("SELECT datistemplate FROM pg_database WHERE datname = %s", (name,))
+    row = cur.fetchone()
+    if not row:
+        return
+    if row[0]:
+        cur.execute(f'ALTER DATABASE "{name}" WITH IS_TEMPLATE false ALLOW_CONNECTIONS true')
+    cur.execute("SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = %s AND pid <> pg_backend_pid()", (name,))
+    cur.execute(f'DROP DATABASE "{name}"')
+
+def ensure_template(cfg=None):
+    """返回与当前迁移文件对应的模板库名，不存在时构建"""
+    from db import migrate, schema_checksum
+    cfg = cfg or get_config()
+    name = TEMPLATE_PREFIX + schema_checksum()[:16]
+    conn = _admin_conn(cfg)
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT 1 FROM pg_database WHERE datname = %s AND datistemplate", (name,))
+        if cur.fetchone():
+            return name
+        # 并行的测试进程可能同时发现模板缺失，加锁后重新检查，只构建一次
+        cur.execute("SELECT pg_advisory_lock(hashtext(%s))", (name,))
+        cur.execute("SELECT 1 FROM pg_database WHERE datname = %s AND datistemplate", (name,))
+        if cur.fetchone():
+            return name
+        started = time.time()
+        print(f"  正在构建模板库 {name}...")
+        build = name + '_build'
+        _drop_database(cur, build)
+        cur.execute(f'CREATE DATABASE "{build}"')
+        migrate(build)
+        bconn = _admin_conn(cfg, build)
+        bcur = bconn.cursor()
+        salt = secrets.token_bytes(16)
+        pwd_hash = hashlib.pbkdf2_hmac('sha256', '123456'.encode('utf-8'), salt, 120000)
+        bcur.execute("INSERT INTO admin_user(username, password_hash, password_salt) VALUES(%s,%s,%s) ON CONFLICT (username) DO NOTHING", ('administrator', pwd_hash, salt))
+        bcur.close()
+        bconn.close()
+        # 构建完成后再改名为正式模板名，中断时不会留下不完整的模板
+        cur.execute(f'ALTER DATABASE "{build}" RENAME TO "{name}"')
+        cur.execute(f'ALTER DATABASE "{name}" WITH IS_TEMPLATE true ALLOW_CONNECTIONS false')
+        cur.execute("SELECT datname FROM pg_database WHERE datname LIKE %s AND datname <> %s", (TEMPLATE_PREFIX + '%', name))
+        for (old,) in cur.fetchall():
+            print(f"  删除过期模板库 {old}")
+            _drop_database(cur, old)
+        print(f"  模板库构建完成，耗时 {time.time() - started:.1f} 秒")
+        return name
+    finally:
+        cur.close()
+        conn.close()
+
+def clone_database(target, cfg=None):
+    """从模板库克隆出全新的目标库（已存在则先删除），可用于每个测试独立建库"""
+    cfg = cfg or get_config()
+    if target == MAINTENANCE_DB or target.startswith(TEMPLATE_PREFIX):
+        raise ValueError(f"不能以 {target} 作为重置目标")
+    template = ensure_template(cfg)
+    conn = _admin_conn(cfg)
+    cur = conn.cursor()
+    try:
+        started = time.time()
+        _drop_database(cur, target)
+        cur.execute(f'CREATE DATABASE "{target}" TEMPLATE "{template}"')
+    finally:
+        cur.close()
+        conn.close()
+    conn = _admin_conn(cfg, target)
+    cur = conn.cursor()
+    try:
+        for table in LOG_PARTITION_TABLES:
+            cur.execute('SELECT ensure_log_partitions(%s, CURRENT_DATE, %s)', (table, LOG_PARTITIONS_AHEAD))
+    finally:
+        cur.close()
+        conn.close()
+    print(f"  已从模板 {template} 克隆 {target}，耗时 {time.time() - started:.2f} 秒")
+    return target
+
 def show_database_objects():
     """显示当前数据库中的所有对象，包括表、视图、函数等"""
     cfg = get_config()
@@ -336,6 +442,30 @@ def show_database_objects():
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description='数据库重置工具')
+    parser.add_argument('--template', action='store_true', help='从模板库快速克隆重置')
+    parser.add_argument('--database', help='快速重置的目标库，默认为配置中的库')
+    parser.add_argument('--yes', action='store_true', help='快速重置配置中的库时不询问确认')
+    args = parser.parse_args()
+    if args.template:
+        target = args.database or get_config()['database']
+        # 目标是配置中的应用库时和完整重置一样先确认，--database 指定其它库（如基准测试库）时不询问
+        if target == get_config()['database'] and not args.yes:
+            print(f"\n警告: 将删除并重建应用数据库 {target}，其中所有数据都会丢失！")
+            try:
+                response = input("确定要重置数据库吗? 输入 'yes' 确认: ")
+            except (KeyboardInterrupt, EOFError):
+                response = ''
+            if response.lower() != 'yes':
+                print("\n操作已取消")
+                return
+        try:
+            clone_database(target)
+            print("\n数据库重置成功！")
+        except Exception as e:
+            print(f"\n快速重置失败: {e}")
+            sys.exit(1)
+        return
     try:
         print("=== 数据库重置工具 ===")
         print("\n警告: 此操作将删除数据库中的所有对象和数据！")
@@ -355,20 +355,506 @@ CREATE TABLE IF NOT EXISTS repayment_schedule (
 );
 CREATE INDEX IF NOT EXISTS idx_repayment_schedule_loan_due ON repayment_schedule(loan_id, due_date);
 
--- 添加活动日志表
+-- 添加活动日志表（按 created_at 每天一个分区，见文件末尾的分区维护函数）
 CREATE TABLE IF NOT EXISTS activity_log (
-  id BIGSERIAL PRIMARY KEY,
+  id BIGSERIAL,
   user_id BIGINT NOT NULL REFERENCES app_user(id),
   action VARCHAR(64) NOT NULL,
   meta JSONB,
-  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
-);
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
 
--- 添加管理员活动日志表
+-- 添加管理员活动日志表（同上按天分区）
 CREATE TABLE IF NOT EXISTS admin_activity_log (
-  id BIGSERIAL PRIMARY KEY,
+  id BIGSERIAL,
   user_id BIGINT NOT NULL REFERENCES admin_user(id),
   action VARCHAR(64) NOT NULL,
   meta JSONB,
-  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- 逾期批处理：每笔贷款的逾期状态（只保存有逾期期次的贷款）
+CREATE TABLE IF NOT EXISTS loan_delinquency (
+  loan_id BIGINT PRIMARY KEY REFERENCES loan(id) ON DELETE CASCADE,
+  branch_id BIGINT NOT NULL REFERENCES branch(id),
+  days_past_due INTEGER NOT NULL,
+  bucket VARCHAR(16) NOT NULL,
+  overdue_periods INTEGER NOT NULL,
+  overdue_amount NUMERIC(18,2) NOT NULL,
+  as_of_date DATE NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_loan_delinquency_branch_bucket ON loan_delinquency(branch_id, bucket);
+CREATE INDEX IF NOT EXISTS idx_repayment_schedule_overdue ON repayment_schedule(loan_id) WHERE status = 'OVERDUE';
+
+-- 逾期批处理：按分行、逾期档位汇总
+CREATE TABLE IF NOT EXISTS branch_delinquency_summary (
+  as_of_date DATE NOT NULL,
+  branch_id BIGINT NOT NULL REFERENCES branch(id) ON DELETE CASCADE,
+  bucket VARCHAR(16) NOT NULL,
+  loan_count INTEGER NOT NULL,
+  overdue_amount NUMERIC(18,2) NOT NULL,
+  PRIMARY KEY (as_of_date, branch_id, bucket)
+);
+
+-- 逾期批处理运行记录，last_loan_id 为断点，用于中断后续跑
+CREATE TABLE IF NOT EXISTS delinquency_run (
+  as_of_date DATE PRIMARY KEY,
+  status VARCHAR(16) NOT NULL DEFAULT 'RUNNING',
+  last_loan_id BIGINT NOT NULL DEFAULT 0,
+  schedules_updated BIGINT NOT NULL DEFAULT 0,
+  loans_overdue BIGINT NOT NULL DEFAULT 0,
+  started_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  finished_at TIMESTAMP,
+  error TEXT
+);
+
+-- 分行贷款组合汇总表，由 loan/repayment 上的语句级触发器增量维护
+CREATE TABLE IF NOT EXISTS branch_loan_portfolio (
+  branch_id BIGINT NOT NULL REFERENCES branch(id) ON DELETE CASCADE,
+  status VARCHAR(32) NOT NULL,
+  loan_count BIGINT NOT NULL DEFAULT 0,
+  principal NUMERIC(20,2) NOT NULL DEFAULT 0,
+  repaid NUMERIC(20,2) NOT NULL DEFAULT 0,
+  rate_weighted NUMERIC(24,6) NOT NULL DEFAULT 0,
+  PRIMARY KEY (branch_id, status)
+);
+
+CREATE OR REPLACE FUNCTION branch_loan_portfolio_on_loan() RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    INSERT INTO branch_loan_portfolio AS p (branch_id, status, loan_count, principal, repaid, rate_weighted)
+    SELECT branch_id, status, COUNT(*), SUM(amount), 0, SUM(amount * interest_rate)
+    FROM new_rows
+    GROUP BY branch_id, status
+    ORDER BY branch_id, status
+    ON CONFLICT (branch_id, status) DO UPDATE SET
+      loan_count = p.loan_count + EXCLUDED.loan_count,
+      principal = p.principal + EXCLUDED.principal,
+      rate_weighted = p.rate_weighted + EXCLUDED.rate_weighted;
+  ELSIF TG_OP = 'DELETE' THEN
+    -- repayment 外键要求先删还款，已还金额已由 repayment 触发器扣减
+    INSERT INTO branch_loan_portfolio AS p (branch_id, status, loan_count, principal, repaid, rate_weighted)
+    SELECT branch_id, status, -COUNT(*), -SUM(amount), 0, -SUM(amount * interest_rate)
+    FROM old_rows
+    GROUP BY branch_id, status
+    ORDER BY branch_id, status
+    ON CONFLICT (branch_id, status) DO UPDATE SET
+      loan_count = p.loan_count + EXCLUDED.loan_count,
+      principal = p.principal + EXCLUDED.principal,
+      rate_weighted = p.rate_weighted + EXCLUDED.rate_weighted;
+  ELSE
+    WITH moved AS (
+      SELECT o.id, o.branch_id, o.status, -1 AS cnt, -o.amount AS amount, -(o.amount * o.interest_rate) AS rate_w
+      FROM old_rows o
+      UNION ALL
+      SELECT n.id, n.branch_id, n.status, 1, n.amount, n.amount * n.interest_rate
+      FROM new_rows n
+    ), paid AS (
+      SELECT loan_id, SUM(amount) AS total
+      FROM repayment
+      WHERE loan_id IN (SELECT id FROM new_rows)
+      GROUP BY loan_id
+    )
+    INSERT INTO branch_loan_portfolio AS p (branch_id, status, loan_count, principal, repaid, rate_weighted)
+    SELECT m.branch_id, m.status, SUM(m.cnt), SUM(m.amount), SUM(m.cnt * COALESCE(r.total, 0)), SUM(m.rate_w)
+    FROM moved m
+    LEFT JOIN paid r ON r.loan_id = m.id
+    GROUP BY m.branch_id, m.status
+    HAVING SUM(m.cnt) <> 0 OR SUM(m.amount) <> 0 OR SUM(m.cnt * COALESCE(r.total, 0)) <> 0 OR SUM(m.rate_w) <> 0
+    ORDER BY m.branch_id, m.status
+    ON CONFLICT (branch_id, status) DO UPDATE SET
+      loan_count = p.loan_count + EXCLUDED.loan_count,
+      principal = p.principal + EXCLUDED.principal,
+      repaid = p.repaid + EXCLUDED.repaid,
+      rate_weighted = p.rate_weighted + EXCLUDED.rate_weighted;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION branch_loan_portfolio_on_repayment() RETURNS TRIGGER AS $$
+BEGIN
+  -- 过渡表只在对应事件中存在，因此按 TG_OP 分支引用
+  IF TG_OP = 'INSERT' THEN
+    INSERT INTO branch_loan_portfolio AS p (branch_id, status, repaid)
+    SELECT l.branch_id, l.status, SUM(m.amount)
+    FROM (SELECT loan_id, amount FROM new_rows) m
+    JOIN loan l ON l.id = m.loan_id
+    GROUP BY l.branch_id, l.status
+    HAVING SUM(m.amount) <> 0
+    ORDER BY l.branch_id, l.status
+    ON CONFLICT (branch_id, status) DO UPDATE SET repaid = p.repaid + EXCLUDED.repaid;
+  ELSIF TG_OP = 'DELETE' THEN
+    INSERT INTO branch_loan_portfolio AS p (branch_id, status, repaid)
+    SELECT l.branch_id, l.status, SUM(m.amount)
+    FROM (SELECT loan_id, -amount AS amount FROM old_rows) m
+    JOIN loan l ON l.id = m.loan_id
+    GROUP BY l.branch_id, l.status
+    HAVING SUM(m.amount) <> 0
+    ORDER BY l.branch_id, l.status
+    ON CONFLICT (branch_id, status) DO UPDATE SET repaid = p.repaid + EXCLUDED.repaid;
+  ELSE
+    INSERT INTO branch_loan_portfolio AS p (branch_id, status, repaid)
+    SELECT l.branch_id, l.status, SUM(m.amount)
+    FROM (SELECT loan_id, amount FROM new_rows UNION ALL SELECT loan_id, -amount FROM old_rows) m
+    JOIN loan l ON l.id = m.loan_id
+    GROUP BY l.branch_id, l.status
+    HAVING SUM(m.amount) <> 0
+    ORDER BY l.branch_id, l.status
+    ON CONFLICT (branch_id, status) DO UPDATE SET repaid = p.repaid + EXCLUDED.repaid;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rebuild_branch_loan_portfolio() RETURNS VOID AS $$
+BEGIN
+  LOCK TABLE loan, repayment IN SHARE MODE;
+  DELETE FROM branch_loan_portfolio;
+  INSERT INTO branch_loan_portfolio(branch_id, status, loan_count, principal, repaid, rate_weighted)
+  SELECT l.branch_id, l.status, COUNT(*), SUM(l.amount), COALESCE(SUM(r.total), 0), SUM(l.amount * l.interest_rate)
+  FROM loan l
+  LEFT JOIN (SELECT loan_id, SUM(amount) AS total FROM repayment GROUP BY loan_id) r ON r.loan_id = l.id
+  GROUP BY l.branch_id, l.status;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+  created BOOLEAN := FALSE;
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_loan_portfolio_ins') THEN
+    CREATE TRIGGER trg_loan_portfolio_ins AFTER INSERT ON loan
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION branch_loan_portfolio_on_loan();
+    created := TRUE;
+  END IF;
+  IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_loan_portfolio_upd') THEN
+    CREATE TRIGGER trg_loan_portfolio_upd AFTER UPDATE ON loan
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION branch_loan_portfolio_on_loan();
+    created := TRUE;
+  END IF;
+  IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_loan_portfolio_del') THEN
+    CREATE TRIGGER trg_loan_portfolio_del AFTER DELETE ON loan
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION branch_loan_portfolio_on_loan();
+    created := TRUE;
+  END IF;
+  IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_repayment_portfolio_ins') THEN
+    CREATE TRIGGER trg_repayment_portfolio_ins AFTER INSERT ON repayment
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION branch_loan_portfolio_on_repayment();
+    created := TRUE;
+  END IF;
+  IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_repayment_portfolio_upd') THEN
+    CREATE TRIGGER trg_repayment_portfolio_upd AFTER UPDATE ON repayment
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION branch_loan_portfolio_on_repayment();
+    created := TRUE;
+  END IF;
+  IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_repayment_portfolio_del') THEN
+    CREATE TRIGGER trg_repayment_portfolio_del AFTER DELETE ON repayment
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION branch_loan_portfolio_on_repayment();
+    created := TRUE;
+  END IF;
+  -- 首次安装触发器时用现有数据回填汇总表
+  IF created THEN
+    PERFORM rebuild_branch_loan_portfolio();
+  END IF;
+END$$;
+
+-- 管理端模糊查询使用的三元组索引（ILIKE '%x%' 及短词前缀匹配均可走索引）
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_branch_union_no_trgm ON branch USING gin (union_no gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_account_account_no_trgm ON account USING gin (account_no gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_loan_loan_no_trgm ON loan USING gin (loan_no gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_customer_name_trgm ON customer USING gin (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_customer_city_trgm ON customer USING gin (city gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_customer_identity_no_trgm ON customer USING gin (identity_no gin_trgm_ops);
+
+-- 管理端统一搜索：各实体的搜索文档，由触发器随源表同步维护
+CREATE TABLE IF NOT EXISTS search_document (
+  entity_type VARCHAR(16) NOT NULL,
+  entity_id BIGINT NOT NULL,
+  title TEXT NOT NULL,
+  subtitle TEXT,
+  body TEXT NOT NULL,
+  tsv tsvector GENERATED ALWAYS AS (to_tsvector('simple', body)) STORED,
+  PRIMARY KEY (entity_type, entity_id)
 );
+CREATE INDEX IF NOT EXISTS idx_search_document_body_trgm ON search_document USING gin (body gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_search_document_tsv ON search_document USING gin (tsv);
+
+-- 搜索文档的唯一来源定义，触发器同步和全量重建都基于此视图
+CREATE OR REPLACE VIEW search_document_source AS
+  SELECT 'customer'::varchar(16) AS entity_type, id AS entity_id, name::text AS title, city::text AS subtitle,
+         concat_ws(' ', id, name, identity_no, city, street) AS body
+  FROM customer
+  UNION ALL
+  SELECT 'account', id, account_no, type::text, concat_ws(' ', id, account_no)
+  FROM account
+  UNION ALL
+  SELECT 'loan', id, loan_no, status, concat_ws(' ', id, loan_no)
+  FROM loan
+  UNION ALL
+  SELECT 'branch', id, name, concat_ws(' ', union_no, city), concat_ws(' ', id, union_no, name, city)
+  FROM branch
+  UNION ALL
+  SELECT 'employee', id, name, NULL, concat_ws(' ', id, name)
+  FROM employee;
+
+CREATE OR REPLACE FUNCTION search_document_sync() RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    DELETE FROM search_document WHERE entity_type = TG_TABLE_NAME AND entity_id = OLD.id;
+    RETURN NULL;
+  END IF;
+  INSERT INTO search_document(entity_type, entity_id, title, subtitle, body)
+  SELECT entity_type, entity_id, title, subtitle, body
+  FROM search_document_source
+  WHERE entity_type = TG_TABLE_NAME AND entity_id = NEW.id
+  ON CONFLICT (entity_type, entity_id) DO UPDATE SET
+    title = EXCLUDED.title, subtitle = EXCLUDED.subtitle, body = EXCLUDED.body;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rebuild_search_document() RETURNS VOID AS $$
+BEGIN
+  DELETE FROM search_document;
+  INSERT INTO search_document(entity_type, entity_id, title, subtitle, body)
+  SELECT entity_type, entity_id, title, subtitle, body FROM search_document_source;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+  r RECORD;
+  created BOOLEAN := FALSE;
+BEGIN
+  -- UPDATE 只监听参与搜索的列，避免余额变动等高频更新触发同步
+  FOR r IN SELECT * FROM (VALUES
+    ('customer', 'name, identity_no, city, street'),
+    ('account', 'account_no, type'),
+    ('loan', 'loan_no, status'),
+    ('branch', 'union_no, name, city'),
+    ('employee', 'name')
+  ) AS v(tbl, cols) LOOP
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_' || r.tbl || '_search_document') THEN
+      EXECUTE format(
+        'CREATE TRIGGER %I AFTER INSERT OR DELETE OR UPDATE OF %s ON %I FOR EACH ROW EXECUTE FUNCTION search_document_sync()',
+        'trg_' || r.tbl || '_search_document', r.cols, r.tbl);
+      created := TRUE;
+    END IF;
+  END LOOP;
+  -- 首次安装触发器时回填已有数据
+  IF created THEN
+    PERFORM rebuild_search_document();
+  END IF;
+END$$;
+
+-- 列表接口 ETag 用的表变更计数：语句级触发器在每次写入后累加计数，随事务提交可见
+-- 按会话 pid 分成 16 个分片，避免并发写同一张表时都去争抢同一行计数
+CREATE TABLE IF NOT EXISTS table_change_counter (
+  table_name TEXT NOT NULL,
+  shard SMALLINT NOT NULL,
+  version BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (table_name, shard)
+);
+
+CREATE OR REPLACE FUNCTION table_change_counter_bump() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO table_change_counter(table_name, shard, version)
+  VALUES (TG_TABLE_NAME, pg_backend_pid() % 16, 1)
+  ON CONFLICT (table_name, shard) DO UPDATE SET version = table_change_counter.version + 1;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+  tbl TEXT;
+BEGIN
+  FOREACH tbl IN ARRAY ARRAY['branch', 'employee', 'dependent', 'customer', 'account',
+                             'savings_account', 'checking_account', 'loan', 'repayment'] LOOP
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_' || tbl || '_change_counter') THEN
+      EXECUTE format(
+        'CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I FOR EACH STATEMENT EXECUTE FUNCTION table_change_counter_bump()',
+        'trg_' || tbl || '_change_counter', tbl);
+    END IF;
+  END LOOP;
+END$$;
+
+-- 管理后台概览用的实体行数计数：只在 INSERT/DELETE/TRUNCATE 时维护，与 table_change_counter 一样按会话 pid 分片
+CREATE TABLE IF NOT EXISTS entity_row_count (
+  table_name TEXT NOT NULL,
+  shard SMALLINT NOT NULL,
+  row_count BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (table_name, shard)
+);
+
+CREATE OR REPLACE FUNCTION entity_row_count_bump() RETURNS TRIGGER AS $$
+DECLARE
+  delta BIGINT;
+BEGIN
+  IF TG_OP = 'TRUNCATE' THEN
+    DELETE FROM entity_row_count WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+  ELSIF TG_OP = 'INSERT' THEN
+    SELECT COUNT(*) INTO delta FROM new_rows;
+  ELSE
+    SELECT -COUNT(*) INTO delta FROM old_rows;
+  END IF;
+  IF delta <> 0 THEN
+    INSERT INTO entity_row_count(table_name, shard, row_count)
+    VALUES (TG_TABLE_NAME, pg_backend_pid() % 16, delta)
+    ON CONFLICT (table_name, shard) DO UPDATE SET row_count = entity_row_count.row_count + EXCLUDED.row_count;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+  tbl TEXT;
+BEGIN
+  FOREACH tbl IN ARRAY ARRAY['branch', 'employee', 'customer', 'account', 'loan'] LOOP
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_' || tbl || '_row_count_ins') THEN
+      EXECUTE format(
+        'CREATE TRIGGER %I AFTER INSERT ON %I REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION entity_row_count_bump()',
+        'trg_' || tbl || '_row_count_ins', tbl);
+      EXECUTE format(
+        'CREATE TRIGGER %I AFTER DELETE ON %I REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION entity_row_count_bump()',
+        'trg_' || tbl || '_row_count_del', tbl);
+      EXECUTE format(
+        'CREATE TRIGGER %I AFTER TRUNCATE ON %I FOR EACH STATEMENT EXECUTE FUNCTION entity_row_count_bump()',
+        'trg_' || tbl || '_row_count_trunc', tbl);
+      -- 首次安装触发器时用实际行数初始化
+      DELETE FROM entity_row_count WHERE table_name = tbl;
+      EXECUTE format('INSERT INTO entity_row_count(table_name, shard, row_count) SELECT %L, 0, COUNT(*) FROM %I', tbl, tbl);
+    END IF;
+  END LOOP;
+END$$;
+
+-- 后台任务队列：工作线程用 FOR UPDATE SKIP LOCKED 领取任务，耗时操作不再占用 HTTP 请求线程
+CREATE TABLE IF NOT EXISTS job (
+  id BIGSERIAL PRIMARY KEY,
+  kind VARCHAR(64) NOT NULL,
+  params JSONB,
+  status VARCHAR(16) NOT NULL DEFAULT 'QUEUED',
+  progress_done BIGINT NOT NULL DEFAULT 0,
+  progress_total BIGINT,
+  progress_message TEXT,
+  result JSONB,
+  error TEXT,
+  cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+  backend_pid INTEGER,
+  created_by BIGINT,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  started_at TIMESTAMP,
+  heartbeat_at TIMESTAMP,
+  finished_at TIMESTAMP,
+  CHECK (status IN ('QUEUED', 'RUNNING', 'SUCCEEDED', 'FAILED', 'CANCELLED'))
+);
+CREATE INDEX IF NOT EXISTS idx_job_queued ON job(id) WHERE status = 'QUEUED';
+CREATE INDEX IF NOT EXISTS idx_job_running_heartbeat ON job(heartbeat_at) WHERE status = 'RUNNING';
+
+-- 活动日志分区维护：按天建分区（<表名>_pYYYYMMDD），另有 default 分区兜底，
+-- 过期数据通过 DETACH + DROP 整个分区清理，不再逐行 DELETE；落入 default 的少量行按时间删除
+CREATE OR REPLACE FUNCTION ensure_log_partitions(parent TEXT, from_date DATE, days_ahead INTEGER) RETURNS INTEGER AS $$
+DECLARE
+  d DATE := from_date;
+  part TEXT;
+  created INTEGER := 0;
+BEGIN
+  IF to_regclass(parent || '_default') IS NULL THEN
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', parent || '_default', parent);
+  END IF;
+  WHILE d <= CURRENT_DATE + days_ahead LOOP
+    part := parent || '_p' || to_char(d, 'YYYYMMDD');
+    IF to_regclass(part) IS NULL THEN
+      BEGIN
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)', part, parent, d, d + 1);
+      EXCEPTION WHEN check_violation THEN
+        -- default 分区里已有这一天的数据：先建普通表并把这些行从 default 搬过去，再挂为分区
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', part, parent);
+        EXECUTE format(
+          'WITH moved AS (DELETE FROM %I WHERE created_at >= %L AND created_at < %L RETURNING *) INSERT INTO %I SELECT * FROM moved',
+          parent || '_default', d, d + 1, part);
+        EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', parent, part, d, d + 1);
+      END;
+      created := created + 1;
+    END IF;
+    d := d + 1;
+  END LOOP;
+  RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION drop_expired_log_partitions(parent TEXT, keep_days INTEGER) RETURNS INTEGER AS $$
+DECLARE
+  r RECORD;
+  dropped INTEGER := 0;
+BEGIN
+  FOR r IN
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = parent::regclass
+      AND c.relname ~ ('^' || parent || '_p[0-9]{8}$')
+      AND to_date(right(c.relname, 8), 'YYYYMMDD') + 1 <= CURRENT_DATE - keep_days
+    ORDER BY c.relname
+  LOOP
+    EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', parent, r.relname);
+    EXECUTE format('DROP TABLE %I', r.relname);
+    dropped := dropped + 1;
+  END LOOP;
+  -- 没有对应日分区的行（建分区之前写入的历史日期等）留在 default 中，同样按保留期删除
+  IF to_regclass(parent || '_default') IS NOT NULL THEN
+    EXECUTE format('DELETE FROM %I WHERE created_at < %L', parent || '_default', CURRENT_DATE - keep_days);
+  END IF;
+  RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 已有库中的普通日志表转换为分区表：旧表改名后按天建分区并搬迁数据，id 序列沿用原序列。
+-- 只搬迁保留期（与 app.py 的 LOG_RETENTION_DAYS 一致，30 天）内的数据，更早的行随旧表删除
+DO $$
+DECLARE
+  t TEXT;
+  ref TEXT;
+  seq TEXT;
+  first_day DATE;
+BEGIN
+  FOREACH t IN ARRAY ARRAY['activity_log', 'admin_activity_log'] LOOP
+    IF EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass(t) AND relkind = 'r') THEN
+      ref := CASE t WHEN 'activity_log' THEN 'app_user' ELSE 'admin_user' END;
+      seq := pg_get_serial_sequence(t, 'id');
+      EXECUTE format('ALTER TABLE %I RENAME TO %I', t, t || '_legacy');
+      EXECUTE format('ALTER INDEX IF EXISTS %I RENAME TO %I', t || '_pkey', t || '_legacy_pkey');
+      EXECUTE format(
+        'CREATE TABLE %I (
+           id BIGINT NOT NULL DEFAULT nextval(%L::regclass),
+           user_id BIGINT NOT NULL REFERENCES %I(id),
+           action VARCHAR(64) NOT NULL,
+           meta JSONB,
+           created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+           PRIMARY KEY (id, created_at)
+         ) PARTITION BY RANGE (created_at)', t, seq, ref);
+      EXECUTE format('SELECT GREATEST(COALESCE(MIN(created_at)::date, CURRENT_DATE), CURRENT_DATE - 30) FROM %I', t || '_legacy') INTO first_day;
+      PERFORM ensure_log_partitions(t, first_day, 7);
+      EXECUTE format(
+        'INSERT INTO %I(id, user_id, action, meta, created_at) SELECT id, user_id, action, meta, created_at FROM %I WHERE created_at >= %L',
+        t, t || '_legacy', first_day);
+      EXECUTE format('ALTER SEQUENCE %s OWNED BY %I.id', seq, t);
+      EXECUTE format('DROP TABLE %I', t || '_legacy');
+    END IF;
+  END LOOP;
+END$$;
+
+SELECT ensure_log_partitions('activity_log', CURRENT_DATE, 7);
+SELECT ensure_log_partitions('admin_activity_log', CURRENT_DATE, 7);
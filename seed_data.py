@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+合成数据生成脚本（用于在接近生产规模的数据上做性能验证）
+按规模因子批量生成支行、员工、客户及其登录用户、贷款及还款计划、账户（储蓄/支票子类型）、
+业务单与多年交易流水和还款记录。
+- 全部通过 COPY 写入，按表和 id 区间切分成任务并行执行，每个任务一个事务
+- 每个任务的随机数种子由 (--seed, 表, 区间起点) 决定，与并行度无关；相同的 --seed 和 --as-of 生成相同的数据
+- 主键显式指定，结束后把序列推进到最大值
+- 规模因子 1 约 100 万条交易流水，100 约 1 亿条
+- 只能写入空库，先用 python reset_db.py --template 重置
+用法: python seed_data.py [--scale 1] [--workers 8] [--seed 42] [--years 3] [--as-of YYYY-MM-DD] [--fast]
+--fast 以 session_replication_role = replica 关闭触发器和外键检查（需要超级用户），
+       加载完成后统一重建搜索文档、组合汇总、行数计数等派生数据
+生成的登录用户为 u00000001 起，密码均为 123456
+"""
+import argparse
+import datetime
+import hashlib
+import io
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from db import get_conn
+
+# 规模因子为 1 时各表行数
+BASE_ROWS = {
+    'branch': 20,
+    'employee': 500,
+    'customer': 50000,
+    'account': 75000,
+    'loan': 10000,
+    'transaction': 1000000
+}
+# 每个任务处理的 id 区间大小
+CHUNK = {
+    'employee': 5000,
+    'customer': 10000,
+    'account': 2000,
+    'loan': 2000
+}
+# 交易流水和业务单按账户区间分配 id 段，段内顺序编号（段之间留空洞）
+TXN_BLOCK_FACTOR = 3
+PENDING_CLOSE_RATE = 0.002
+CLOSED_RATE = 0.02
+MISSED_PAYMENT_RATE = 0.03
+PASSWORD = '123456'
+
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢姜崔钟谭陆汪范金石廖贾夏韦付方白邹孟熊秦邱江尹薛闫段雷侯龙史陶黎贺顾毛郝龚邵万钱严覃武戴莫孔向汤'
+GIVEN = '伟芳娜秀英敏静丽强磊军洋勇艳杰娟涛明超秀兰霞平刚桂英华建国建华志强海燕春梅玉兰文博子轩浩然梓涵欣怡雨萱思远晨阳'
+CITIES = ['北京', '上海', '广州', '深圳', '杭州', '南京', '成都', '武汉', '西安', '重庆', '天津', '苏州', '长沙', '郑州', '青岛', '厦门']
+STREETS = ['人民路', '解放路', '中山路', '建设路', '和平路', '新华路', '长江路', '黄河路', '文化路', '光明路']
+RELATIONSHIPS = ['配偶', '子女', '父母']
+# 账户阶段按主储蓄账户（id 与客户相同）取已还期次：还款人为贷款借款人中 id 最小的客户
+PAID_PERIODS_SQL = '''
+    SELECT lc.customer_id, s.loan_id, s.period_no, s.due_date, s.principal_due + s.interest_due
+    FROM loan_customer lc
+    JOIN repayment_schedule s ON s.loan_id = lc.loan_id AND s.status = 'PAID'
+    WHERE lc.customer_id BETWEEN %s AND %s
+      AND NOT EXISTS (SELECT 1 FROM loan_customer o WHERE o.loan_id = lc.loan_id AND o.customer_id < lc.customer_id)
+'''
+
+
+def _rng(seed, table, lo):
+    return random.Random(f'{seed}:{table}:{lo}')
+
+def _name(rng):
+    return rng.choice(SURNAMES) + ''.join(rng.choice(GIVEN) for _ in range(rng.randint(1, 2)))
+
+def _phone(rng):
+    return '1' + rng.choice('3456789') + ''.join(rng.choice('0123456789') for _ in range(9))
+
+def _line(buf, values):
+    """按 COPY 文本格式写一行，生成的值不含制表符、换行和反斜杠，无需转义"""
+    buf.write('\t'.join('\\N' if v is None else str(v) for v in values))
+    buf.write('\n')
+
+def _copy(cur, table, columns, buf):
+    buf.seek(0)
+    cur.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN', buf)
+
+def _sizes(scale):
+    sizes = {t: max(1, int(n * scale)) for t, n in BASE_ROWS.items()}
+    sizes['manager'] = max(1, sizes['employee'] // 20)
+    return sizes
+
+def _chunks(lo, hi, size):
+    return [(s, min(s + size - 1, hi)) for s in range(lo, hi + 1, size)]
+
+def _paid_at(loan_id, period, due):
+    """期次的还款时间：到期日前 0~5 天的营业时间内，只由贷款 id 和期次决定，贷款和账户两个阶段算出的结果一致"""
+    day = due - datetime.timedelta(days=(loan_id * 7 + period * 3) % 6)
+    return datetime.datetime.combine(day, datetime.time(9, 0)) + datetime.timedelta(seconds=(loan_id * 131 + period * 977) % (8 * 3600))
+
+def _paid_periods(cur, lo, hi):
+    """客户 id -> 按时间排序的 (还款时间, 贷款 id, 金额) 列表"""
+    cur.execute(PAID_PERIODS_SQL, (lo, hi))
+    paid = {}
+    for customer_id, loan_id, period, due, amount in cur.fetchall():
+        paid.setdefault(customer_id, []).append((_paid_at(loan_id, period, due), loan_id, float(amount)))
+    for rows in paid.values():
+        rows.sort()
+    return paid
+
+
+def _gen_branch(cur, rng, lo, hi, sizes, opts):
+    buf = io.StringIO()
+    for i in range(lo, hi + 1):
+        city = CITIES[i % len(CITIES)]
+        _line(buf, (i, f'{102100000000 + i}', f'{city}第{i}支行', city))
+    _copy(cur, 'branch', ('id', 'union_no', 'name', 'city'), buf)
+    return hi - lo + 1
+
+def _gen_employee(cur, rng, lo, hi, sizes, opts):
+    """前 manager 个员工没有上级，其余员工的上级从中随机选取（需要先于其他员工单独加载）"""
+    emp, dep = io.StringIO(), io.StringIO()
+    as_of = opts['as_of']
+    for i in range(lo, hi + 1):
+        manager = None if i <= sizes['manager'] else rng.randint(1, sizes['manager'])
+        hired = as_of - datetime.timedelta(days=rng.randint(30, 365 * 20))
+        _line(emp, (i, _name(rng), _phone(rng), hired, manager))
+        for _ in range(rng.choice((0, 0, 1, 2))):
+            _line(dep, (i, _name(rng), rng.choice(RELATIONSHIPS)))
+    _copy(cur, 'employee', ('id', 'name', 'phone', 'hire_date', 'manager_id'), emp)
+    _copy(cur, 'dependent', ('employee_id', 'name', 'relationship'), dep)
+    return hi - lo + 1
+
+def _gen_customer(cur, rng, lo, hi, sizes, opts):
+    """每个客户对应一个同 id 的登录用户"""
+    cust, users, links = io.StringIO(), io.StringIO(), io.StringIO()
+    for i in range(lo, hi + 1):
+        city = rng.choice(CITIES)
+        street = f'{rng.choice(STREETS)}{rng.randint(1, 999)}号'
+        assistant = rng.randint(1, sizes['employee']) if rng.random() < 0.8 else None
+        _line(cust, (i, _name(rng), f'{i:018d}', city, street, assistant))
+        _line(users, (i, f'u{i:08d}', 'user', opts['pw_hash'], opts['pw_salt']))
+        _line(links, (i, i))
+    _copy(cur, 'customer', ('id', 'name', 'identity_no', 'city', 'street', 'assistant_employee_id'), cust)
+    _copy(cur, 'app_user', ('id', 'username', 'role', 'password_hash', 'password_salt'), users)
+    _copy(cur, 'user_customer', ('user_id', 'customer_id'), links)
+    return hi - lo + 1
+
+def _gen_account(cur, rng, lo, hi, sizes, opts):
+    """
+    账户 id 不超过客户数时为对应客户的主储蓄账户（不会关闭），其余账户随机归属。
+    每个账户的流水按时间顺序生成并累计余额，账户余额等于最后一条流水的 balance_after（已关闭账户以一笔销户取款清零）；
+    每条流水配一张同 id 的已完成业务单，与应用内存取款的写入方式一致。
+    贷款阶段标记为 PAID 的期次在这里从还款人的主储蓄账户扣款，与 /user/repay 一样写入 REPAYMENT 业务单、流水和还款记录；
+    余额不足时先存入一笔工资补足，保证余额不为负
+    """
+    as_of = opts['as_of']
+    now = datetime.datetime.combine(as_of, datetime.time(18, 0))
+    span = opts['years'] * 365 * 86400
+    per_account = sizes['transaction'] / sizes['account']
+    next_id = (lo - 1) // CHUNK['account'] * CHUNK['account'] * int(per_account * TXN_BLOCK_FACTOR + 1) + 1
+    accounts, links, savings, checking = io.StringIO(), io.StringIO(), io.StringIO(), io.StringIO()
+    business, txns, repayments = io.StringIO(), io.StringIO(), io.StringIO()
+    txn_count = 0
+    paid = _paid_periods(cur, lo, min(hi, sizes['customer'])) if lo <= sizes['customer'] else {}
+    for i in range(lo, hi + 1):
+        owner = i if i <= sizes['customer'] else rng.randint(1, sizes['customer'])
+        created = now - datetime.timedelta(seconds=rng.randint(86400, span))
+        due_repayments = paid.get(i, []) if i <= sizes['customer'] else []
+        if due_repayments:
+            created = min(created, due_repayments[0][0] - datetime.timedelta(days=1))
+        if i <= sizes['customer']:
+            kind = 'savings'
+        else:
+            kind = 'checking' if rng.random() < 0.7 else 'savings'
+        overdraft = rng.choice((0, 1000, 5000, 10000)) if kind == 'checking' else 0
+        balance = 0.0
+        n = rng.randint(0, int(per_account * 2))
+        offsets = [rng.randint(0, int((now - created).total_seconds())) for _ in range(n)]
+        events = sorted([(created + datetime.timedelta(seconds=off), None) for off in offsets] +
+                        [(paid_at, (loan_id, amount)) for paid_at, loan_id, amount in due_repayments], key=lambda e: e[0])
+        at = created
+        for at, repayment in events:
+            if repayment is not None:
+                loan_id, amount = repayment
+                if balance < amount:
+                    topup = round(amount - balance + rng.uniform(100, 5000), 2)
+                    balance = round(balance + topup, 2)
+                    _line(business, (next_id, 'DEPOSIT', owner, 'COMPLETED', at, at, '工资'))
+                    _line(txns, (next_id, i, next_id, 'DEPOSIT', f'{topup:.2f}', f'{balance:.2f}', at, '工资'))
+                    next_id += 1
+                    txn_count += 1
+                balance = round(balance - amount, 2)
+                _line(business, (next_id, 'REPAYMENT', owner, 'COMPLETED', at, at, ''))
+                _line(txns, (next_id, i, next_id, 'REPAYMENT', f'{amount:.2f}', f'{balance:.2f}', at, ''))
+                _line(repayments, (loan_id, f'{rng.getrandbits(48):012x}', at.date(), f'{amount:.2f}', i))
+                next_id += 1
+                txn_count += 2
+                continue
+            if balance > 100 and rng.random() < 0.45:
+                txn_type = 'WITHDRAW'
+                amount = round(rng.uniform(10, min(balance, 20000)), 2)
+                balance = round(balance - amount, 2)
+            else:
+                txn_type = 'DEPOSIT'
+                amount = round(rng.uniform(10, 50000), 2)
+                balance = round(balance + amount, 2)
+            _line(business, (next_id, txn_type, owner, 'COMPLETED', at, at, ''))
+            _line(txns, (next_id, i, next_id, txn_type, f'{amount:.2f}', f'{balance:.2f}', at, ''))
+            next_id += 1
+            txn_count += 1
+        closed_at = None
+        if i > sizes['customer'] and rng.random() < CLOSED_RATE:
+            kind = 'closed'
+            closed_at = max(at, now - datetime.timedelta(seconds=rng.randint(0, 90 * 86400)))
+            if balance > 0:
+                # 销户前取出全部余额，已关闭账户余额为 0
+                _line(business, (next_id, 'WITHDRAW', owner, 'COMPLETED', closed_at, closed_at, '销户取款'))
+                _line(txns, (next_id, i, next_id, 'WITHDRAW', f'{balance:.2f}', '0.00', closed_at, '销户取款'))
+                next_id += 1
+                txn_count += 1
+                balance = 0.0
+        elif rng.random() < PENDING_CLOSE_RATE:
+            requested = max(at, now - datetime.timedelta(seconds=rng.randint(0, 30 * 86400)))
+            _line(business, (next_id, 'CLOSE_ACCOUNT', owner, 'PENDING', requested, requested, f'申请注销账户 {i}，原因: 不再使用'))
+            next_id += 1
+        _line(accounts, (i, f'ACC{i:012d}', created, f'{balance:.2f}', kind, closed_at))
+        _line(links, (i, owner, (now - datetime.timedelta(days=rng.randint(0, 365))).date()))
+        if kind == 'savings':
+            _line(savings, (i, f'{rng.choice((0.0035, 0.0150, 0.0175, 0.0225, 0.0275)):.4f}'))
+        elif kind == 'checking':
+            _line(checking, (i, overdraft))
+    _copy(cur, 'account', ('id', 'account_no', 'created_at', 'balance', 'type', 'closed_at'), accounts)
+    _copy(cur, 'account_customer', ('account_id', 'customer_id', 'last_access_date'), links)
+    _copy(cur, 'savings_account', ('account_id', 'interest_rate'), savings)
+    _copy(cur, 'checking_account', ('account_id', 'overdraft_limit'), checking)
+    _copy(cur, 'business', ('id', 'business_type', 'customer_id', 'status', 'created_at', 'updated_at', 'remark'), business)
+    _copy(cur, 'transaction', ('id', 'account_id', 'business_id', 'txn_type', 'amount', 'balance_after', 'created_at', 'remark'), txns)
+    _copy(cur, 'repayment', ('loan_id', 'batch_no', 'paid_at', 'amount', 'savings_account_id'), repayments)
+    return hi - lo + 1 + txn_count
+
+def _gen_loan(cur, rng, lo, hi, sizes, opts):
+    """
+    还款计划与应用放款时使用同一个生成函数；到期的期次大多已按期还款（计划标记为 PAID，
+    还款记录和扣款流水在账户阶段写入），少量漏还的期次保持 DUE，留给逾期批处理识别。
+    全部期次到期且已还清的贷款为 SETTLED，结清时间为最后一期的还款时间
+    """
+    from app import _build_repayment_schedule
+    as_of = opts['as_of']
+    loans, links, schedules = io.StringIO(), io.StringIO(), io.StringIO()
+    rows = 0
+    for i in range(lo, hi + 1):
+        term = rng.choice((12, 24, 36, 60))
+        rate = round(rng.uniform(0.03, 0.08), 4)
+        method = rng.choice(('EQUAL_INSTALLMENT', 'EQUAL_PRINCIPAL'))
+        amount = rng.randint(10, 1000) * 1000
+        start = as_of - datetime.timedelta(days=rng.randint(0, opts['years'] * 365))
+        schedule = _build_repayment_schedule(amount, rate, term, method, start)
+        borrowers = [rng.randint(1, sizes['customer'])]
+        if rng.random() < 0.1:
+            co = rng.randint(1, sizes['customer'])
+            if co != borrowers[0]:
+                borrowers.append(co)
+        roll = rng.random()
+        status = 'PENDING' if roll < 0.03 else 'APPROVED' if roll < 0.06 else 'DISBURSED'
+        all_paid = True
+        for period, due, principal, interest in schedule:
+            if status != 'DISBURSED' or due > as_of or rng.random() < MISSED_PAYMENT_RATE:
+                _line(schedules, (i, period, due, f'{principal:.2f}', f'{interest:.2f}', 'DUE'))
+                all_paid = False
+                continue
+            _line(schedules, (i, period, due, f'{principal:.2f}', f'{interest:.2f}', 'PAID'))
+        settled_at = None
+        if status == 'DISBURSED' and all_paid:
+            status = 'SETTLED'
+            settled_at = _paid_at(i, schedule[-1][0], schedule[-1][1])
+        _line(loans, (i, f'LN{i:012d}', amount, rng.randint(1, sizes['branch']), f'{rate:.4f}', term, method,
+                      status, start, schedule[-1][1], settled_at))
+        for c in borrowers:
+            _line(links, (i, c))
+        rows += len(schedule)
+    _copy(cur, 'loan', ('id', 'loan_no', 'amount', 'branch_id', 'interest_rate', 'term_months', 'repayment_method',
+                        'status', 'start_date', 'end_date', 'settled_at'), loans)
+    _copy(cur, 'loan_customer', ('loan_id', 'customer_id'), links)
+    _copy(cur, 'repayment_schedule', ('loan_id', 'period_no', 'due_date', 'principal_due', 'interest_due', 'status'), schedules)
+    return hi - lo + 1 + rows
+
+GENERATORS = {
+    'branch': _gen_branch,
+    'employee': _gen_employee,
+    'customer': _gen_customer,
+    'account': _gen_account,
+    'loan': _gen_loan
+}
+
+def _run_task(task):
+    """在独立连接和事务中执行一个 (表, 起始 id, 结束 id) 任务，返回写入的行数"""
+    table, lo, hi, sizes, opts = task
+    conn = get_conn(opts['database'])
+    cur = conn.cursor()
+    try:
+        cur.execute('SET synchronous_commit = off')
+        if opts['fast']:
+            cur.execute('SET session_replication_role = replica')
+        count = GENERATORS[table](cur, _rng(opts['seed'], table, lo), lo, hi, sizes, opts)
+        conn.commit()
+        return count
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+def _phases(sizes):
+    """按外键依赖分阶段，同一阶段内的任务并行执行"""
+    return [
+        ('支行与管理层员工', [('branch', 1, sizes['branch']), ('employee', 1, sizes['manager'])]),
+        ('员工', [('employee', lo, hi) for lo, hi in _chunks(sizes['manager'] + 1, sizes['employee'], CHUNK['employee'])]),
+        ('客户与登录用户', [('customer', lo, hi) for lo, hi in _chunks(1, sizes['customer'], CHUNK['customer'])]),
+        ('贷款与还款计划', [('loan', lo, hi) for lo, hi in _chunks(1, sizes['loan'], CHUNK['loan'])]),
+        # 账户阶段按还款计划写入还款记录和扣款流水，必须在贷款之后
+        ('账户、交易流水与还款', [('account', lo, hi) for lo, hi in _chunks(1, sizes['account'], CHUNK['account'])])
+    ]
+
+SEQUENCE_TABLES = ['branch', 'employee', 'dependent', 'customer', 'app_user', 'account', 'business', 'transaction',
+                   'loan', 'repayment_schedule', 'repayment']
+COUNTED_TABLES = ['branch', 'employee', 'customer', 'account', 'loan']
+CHANGE_COUNTED_TABLES = ['branch', 'employee', 'dependent', 'customer', 'account', 'savings_account',
+                         'checking_account', 'loan', 'repayment']
+
+def _finish(cur, fast):
+    """推进序列；关闭触发器加载时重建触发器维护的派生数据；最后更新统计信息"""
+    for t in SEQUENCE_TABLES:
+        cur.execute(f"SELECT setval(pg_get_serial_sequence('{t}', 'id'), GREATEST((SELECT MAX(id) FROM {t}), 1))")
+    if fast:
+        print("🔧 重建派生数据...")
+        cur.execute('SELECT rebuild_search_document()')
+        cur.execute('SELECT rebuild_branch_loan_portfolio()')
+        for t in COUNTED_TABLES:
+            cur.execute('DELETE FROM entity_row_count WHERE table_name = %s', (t,))
+            cur.execute(f'INSERT INTO entity_row_count(table_name, shard, row_count) SELECT %s, 0, COUNT(*) FROM {t}', (t,))
+        for t in CHANGE_COUNTED_TABLES:
+            cur.execute("""
+                INSERT INTO table_change_counter(table_name, shard, version) VALUES (%s, 0, 1)
+                ON CONFLICT (table_name, shard) DO UPDATE SET version = table_change_counter.version + 1
+            """, (t,))
+    print("📈 更新统计信息...")
+    cur.execute('ANALYZE')
+
+def seed(scale, workers, seed_value, years, as_of, fast, database=None):
+    sizes = _sizes(scale)
+    salt = hashlib.sha256(f'{seed_value}:salt'.encode('utf-8')).digest()[:16]
+    pw_hash = hashlib.pbkdf2_hmac('sha256', PASSWORD.encode('utf-8'), salt, 120000)
+    opts = {
+        'seed': seed_value,
+        'years': years,
+        'as_of': as_of,
+        'fast': fast,
+        'database': database,
+        'pw_hash': '\\\\x' + pw_hash.hex(),
+        'pw_salt': '\\\\x' + salt.hex()
+    }
+    conn = get_conn(database)
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT EXISTS(SELECT 1 FROM branch) OR EXISTS(SELECT 1 FROM customer) OR EXISTS(SELECT 1 FROM account)')
+        if cur.fetchone()[0]:
+            print("❌ 目标库已有数据，请先执行 python reset_db.py --template 重置")
+            return False
+        print(f"📋 规模: {', '.join(f'{t} {n}' for t, n in sizes.items())}")
+        started = time.time()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for label, tasks in _phases(sizes):
+                phase_started = time.time()
+                total = sum(pool.map(_run_task, [t + (sizes, opts) for t in tasks]))
+                elapsed = time.time() - phase_started
+                print(f"✅ {label}: {len(tasks)} 个任务，{total} 行，耗时 {elapsed:.1f} 秒（{total / max(elapsed, 0.001):.0f} 行/秒）")
+        _finish(cur, fast)
+        print(f"🎉 数据生成完成，总耗时 {time.time() - started:.1f} 秒")
+        return True
+    finally:
+        cur.close()
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='生成合成测试数据')
+    parser.add_argument('--scale', type=float, default=1.0, help='规模因子，1 约 100 万条交易流水')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help='并行进程数')
+    parser.add_argument('--seed', type=int, default=42, help='随机数种子')
+    parser.add_argument('--years', type=int, default=3, help='交易流水与贷款覆盖的年数')
+    parser.add_argument('--as-of', default=None, help='数据截止日期 YYYY-MM-DD，默认今天')
+    parser.add_argument('--database', default=None, help='目标库，默认为配置中的库')
+    parser.add_argument('--fast', action='store_true', help='加载期间关闭触发器和外键检查（需要超级用户）')
+    args = parser.parse_args()
+    try:
+        as_of = datetime.date.fromisoformat(args.as_of) if args.as_of else datetime.date.today()
+    except ValueError:
+        print("❌ --as-of 日期格式应为 YYYY-MM-DD")
+        return 1
+    if args.scale <= 0 or args.workers <= 0 or args.years <= 0:
+        print("❌ --scale、--workers、--years 必须为正数")
+        return 1
+    print(f"🌱 生成合成数据（规模 {args.scale}，种子 {args.seed}，截止 {as_of}，{args.workers} 个进程）")
+    try:
+        return 0 if seed(args.scale, args.workers, args.seed, args.years, as_of, args.fast, args.database) else 1
+    except Exception as e:
+        print(f"❌ 数据生成失败: {e}")
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())